@@ -0,0 +1,109 @@
+# benchmarks/bench_logging.py
+"""
+Coste del logging por item publicado, visto desde el bucle de eventos. Cada item simula lo
+que registra _publish_to_channel: una línea por video enviado y, cada cierto número de items,
+un aviso de flood control. La salida es un archivo con una latencia fija por escritura, para
+imitar un stdout lento (el pipe de logs de Render bajo carga).
+
+Configuraciones:
+  basic           logging.basicConfig: el bucle formatea y escribe cada registro
+  queue           log_setup.py sin muestreo: el bucle solo encola, un hilo formatea en JSON
+  queue+sampling  log_setup.py con el muestreo por defecto
+
+Uso: python benchmarks/bench_logging.py [--items 2000] [--videos 3] [--flood-every 20] [--sink-latency-ms 0.2]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_setup
+
+logger = logging.getLogger("bench.publish")
+
+
+class SlowSink:
+    """Archivo en el que cada escritura tarda `latency` segundos."""
+
+    def __init__(self, path: str, latency: float):
+        self._file = open(path, "w", encoding="utf-8")
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text: str):
+        if self.latency:
+            time.sleep(self.latency)
+        self.lines += text.count("\n")
+        return self._file.write(text)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+async def publish(items: int, videos: int, flood_every: int) -> float:
+    """Registra lo que registraría una publicación de `items` fotos. Devuelve segundos en el bucle."""
+    log_setup.current_task_id.set("bench")
+    started = time.perf_counter()
+    for photo_index in range(items):
+        for video_index in range(videos):
+            logger.info(f"-1001: video {video_index + 1}/{videos} de la foto {photo_index + 1} enviado.")
+        if flood_every and photo_index % flood_every == 0:
+            logger.warning(f"Flood control en -1001: esperando 3s (foto {photo_index + 1}).")
+        if photo_index % 50 == 0:
+            await asyncio.sleep(0)
+    return time.perf_counter() - started
+
+
+def configure(name: str, sink: SlowSink):
+    root = logging.getLogger()
+    if name == "basic":
+        log_setup.stop_logging()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        logging.basicConfig(stream=sink, format=log_setup.TEXT_FORMAT, level=logging.INFO, force=True)
+    else:
+        log_setup.setup_logging(stream=sink, fmt="json", levels="root=INFO",
+                                sample_burst=log_setup.SAMPLE_BURST if name == "queue+sampling" else 0)
+
+
+def run(name: str, args, workdir: str) -> dict:
+    sink = SlowSink(os.path.join(workdir, f"{name.replace('+', '_')}.log"), args.sink_latency_ms / 1000)
+    configure(name, sink)
+    in_loop = asyncio.run(publish(args.items, args.videos, args.flood_every))
+    drain_started = time.perf_counter()
+    log_setup.stop_logging()  # Espera a que el hilo escriba lo encolado
+    drained = time.perf_counter() - drain_started
+    for handler in logging.getLogger().handlers[:]:
+        logging.getLogger().removeHandler(handler)
+    sink.close()
+    return {"name": name, "per_item_us": in_loop / args.items * 1e6, "in_loop": in_loop,
+            "drain": drained, "lines": sink.lines}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--videos", type=int, default=3, help="Videos (líneas de log) por item")
+    parser.add_argument("--flood-every", type=int, default=20, help="Un aviso de flood control cada N items (0 = ninguno)")
+    parser.add_argument("--sink-latency-ms", type=float, default=0.2, help="Latencia de cada escritura en la salida")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [run(name, args, workdir) for name in ("basic", "queue", "queue+sampling")]
+
+    print(f"{args.items} items × {args.videos} videos, salida con {args.sink_latency_ms} ms por escritura\n")
+    print(f"{'configuración':<16} {'µs/item en el bucle':>20} {'bucle (s)':>10} {'vaciado (s)':>12} {'líneas':>8}")
+    for r in results:
+        print(f"{r['name']:<16} {r['per_item_us']:>20.1f} {r['in_loop']:>10.3f} {r['drain']:>12.3f} {r['lines']:>8}")
+
+
+if __name__ == "__main__":
+    main()
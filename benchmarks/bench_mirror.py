@@ -0,0 +1,91 @@
+# benchmarks/bench_mirror.py
+"""
+Mide el rendimiento de pro_mode.run_mirror_task (Modo Pro) sin red, con el cliente de
+Telethon falso de fake_telethon.py: bloques/minuto, videos/minuto, tiempo hasta la primera
+publicación y FloodWaits encontrados.
+
+Las pausas de pro_mode (VIDEO_PAUSE_SECONDS, BLOCK_PAUSE_SECONDS) se escalan con
+--pause-scale: 1 reproduce el ritmo real, 0 mide solo el coste propio de la misión.
+
+Uso: python benchmarks/bench_mirror.py [--blocks 10] [--videos 3] [--latency-ms 50]
+                                       [--flood-wait-rate 0.02] [--pause-scale 1] [--source grabacion.jsonl]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "fake")
+os.environ.setdefault("SESSION_STRING", "fake")
+os.environ.setdefault("CHANNEL_ID", "-1001")
+
+from telethon.tl.types import MessageService
+
+import pro_mode
+from fake_telethon import SOURCE_CHANNEL_ID, FakeTelethonClient, recorded_source, synthetic_source
+
+
+class FakeBot:
+    """Lo mínimo de telegram.Bot que usa run_mirror_task para informar al usuario."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+    async def edit_message_text(self, text=None, **kwargs):
+        self.messages.append(text)
+
+
+async def run(args):
+    pro_mode.VIDEO_PAUSE_SECONDS *= args.pause_scale
+    pro_mode.BLOCK_PAUSE_SECONDS *= args.pause_scale
+
+    source = recorded_source(args.source) if args.source else synthetic_source(args.blocks, args.videos)
+    # Un bloque es un cambio de foto seguido de al menos un video
+    blocks = sum(1 for a, b in zip(source, source[1:]) if isinstance(a, MessageService) and not isinstance(b, MessageService))
+    latency = args.latency_ms / 1000
+    client = FakeTelethonClient(source, latency={"download_media": latency, "upload_file": latency * 2},
+                                default_latency=latency, flood_wait_rate=args.flood_wait_rate,
+                                flood_wait_seconds=args.flood_wait_seconds)
+    bot = FakeBot()
+
+    started = time.perf_counter()
+    await pro_mode.run_mirror_task(
+        user_chat_id=1, start_link=f"https://t.me/c/{SOURCE_CHANNEL_ID}/0", post_count=blocks,
+        bot=bot, status_message_id=1, completion_callback=None, client_factory=client.factory,
+    )
+    elapsed = time.perf_counter() - started
+
+    photos, videos = client.count("photo"), client.count("video")
+    minutes = elapsed / 60
+    print(f"Fuente: {'grabada' if args.source else 'sintética'} · {blocks} bloques · latencia {args.latency_ms} ms · "
+          f"FloodWait {args.flood_wait_rate:.1%} · pausas x{args.pause_scale}")
+    print(f"  Duración total:          {elapsed:.2f} s")
+    print(f"  Bloques/minuto:          {photos / minutes:.1f} ({photos} cambios de foto)")
+    print(f"  Videos/minuto:           {videos / minutes:.1f} ({videos} videos)")
+    if client.first_post_at:
+        print(f"  Primera publicación a:   {(client.first_post_at - started) * 1000:.0f} ms")
+    print(f"  FloodWaits inyectados:   {client.flood_waits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=10)
+    parser.add_argument("--videos", type=int, default=3, help="Videos por bloque (fuente sintética)")
+    parser.add_argument("--source", default="", help="Canal grabado en JSONL (ver fake_telethon.py)")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--flood-wait-rate", type=float, default=0.0)
+    parser.add_argument("--flood-wait-seconds", type=int, default=1)
+    parser.add_argument("--pause-scale", type=float, default=1.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_startup.py
+"""
+Mide el coste de un arranque en frío del bot:
+
+1. Tiempo de importación de bot.py (en un proceso nuevo, media de varias repeticiones).
+2. Tiempo hasta la primera respuesta: se lanza `python bot.py` en modo polling contra el
+   servidor falso de la Bot API con un /start pendiente, y se mide desde el arranque del
+   proceso hasta que llega el sendMessage de respuesta. MONGO_URI apunta a un host que no
+   responde, para comprobar que el /start no espera a Mongo ni al scheduler.
+
+Uso: python benchmarks/bench_startup.py [--repeat 5] [--max-import-ms 1500] [--max-first-response-ms 4000]
+Termina con código 1 si se superan los umbrales, para poder usarlo como control de regresión.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+ADMIN_ID = 4242
+
+
+def bot_env(extra: dict | None = None) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:FAKE",
+        "ADMIN_USER_ID": str(ADMIN_ID),
+        "CHANNEL_ID": "-1001",
+        # Host no enrutable: la conexión a Mongo tarda en fallar, como un Atlas lento
+        "MONGO_URI": "mongodb://10.255.255.1:27017/?serverSelectionTimeoutMS=5000",
+        "RENDER_EXTERNAL_URL": "",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.update(extra or {})
+    return env
+
+
+def measure_import(repeat: int) -> list[float]:
+    code = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=bot_env(),
+                             capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+async def measure_first_response() -> float:
+    api = await FakeBotAPI().start()
+    api.push_text(ADMIN_ID, "/start")
+    first_reply = api.wait_for("sendMessage")
+
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "bot.py", cwd=ROOT, env=bot_env({"TELEGRAM_API_BASE_URL": api.url}),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        replied_at = await asyncio.wait_for(first_reply, timeout=60)
+        return replied_at - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=1500)
+    parser.add_argument("--max-first-response-ms", type=float, default=4000)
+    args = parser.parse_args()
+
+    imports = measure_import(args.repeat)
+    import_ms = statistics.median(imports) * 1000
+    print(f"Importación de bot.py: mediana {import_ms:.0f} ms (min {min(imports) * 1000:.0f}, max {max(imports) * 1000:.0f})")
+
+    first_ms = asyncio.run(measure_first_response()) * 1000
+    print(f"Tiempo hasta la primera respuesta (/start): {first_ms:.0f} ms")
+
+    failed = import_ms > args.max_import_ms or first_ms > args.max_first_response_ms
+    if failed:
+        print("❌ Regresión: se superó algún umbral.")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
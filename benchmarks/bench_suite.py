@@ -0,0 +1,265 @@
+# benchmarks/bench_suite.py
+"""
+Suite de benchmarks sin red: ejecuta los handlers de bot.py contra el servidor falso de la
+Bot API (fake_bot_api.py) y un Mongo en memoria (mongomock), y la búsqueda de subtítulos
+contra una API de OpenSubtitles simulada.
+
+Escenarios:
+  publish     _publish_pack_logic sobre packs de 10/100/1000 fotos (con un video cada una)
+  ingest      ráfaga de fotos reenviadas en modo creación, pasando por todo el pipeline de updates
+  pagination  _get_pack_list_markup paginando sobre 10k packs
+  immediate   ráfaga de videos en modo inmediato (copyMessage al canal)
+  subtitles   _search_subtitles_logic contra la API simulada
+
+Uso: python benchmarks/bench_suite.py [--only publish,ingest] [--latency-ms 5] [--retry-after-rate 0]
+                                      [--publish-sizes 10,100,1000] [--burst 200] [--packs 10000]
+Requiere: pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+ADMIN_ID = 4242
+CHANNEL = "-1001"
+
+
+class FakeSubtitlesAPI:
+    """API de OpenSubtitles simulada (login, búsqueda y descarga) con latencia fija."""
+
+    def __init__(self, latency: float, results: int = 20):
+        latency_seconds, n_results = latency, results
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, payload: dict):
+                time.sleep(latency_seconds)
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("/login"):
+                    self._reply({"token": "fake-token"})
+                else:
+                    self._reply({"link": f"http://127.0.0.1:{self.server.server_port}/file.srt"})
+
+            def do_GET(self):
+                self._reply({"data": [{
+                    "id": str(i),
+                    "attributes": {"language": "es", "files": [{"file_id": 1000 + i}],
+                                   "feature_details": {"movie_name": f"Película {i}", "season_number": 1, "episode_number": i}},
+                } for i in range(n_results)]})
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}/api/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def configure_env(api: FakeBotAPI, subtitles_api: FakeSubtitlesAPI):
+    os.environ.update({
+        "BOT_TOKEN": "123456:FAKE",
+        "ADMIN_USER_ID": str(ADMIN_ID),
+        "CHANNEL_ID": CHANNEL,
+        "CHANNEL_IDS": CHANNEL,
+        "MONGO_URI": "mongodb://mongomock",
+        "RENDER_EXTERNAL_URL": "",
+        "TELEGRAM_API_BASE_URL": api.url,
+        "OPENSUBTITLES_API_KEY": "fake",
+        "OPENSUBTITLES_API_URL": subtitles_api.url,
+        "PACK_SUMMARY_CACHE": "0",
+    })
+
+
+def percentiles(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return f"p50 {p(0.50):.1f} ms · p99 {p(0.99):.1f} ms · max {ordered[-1] * 1000:.1f} ms"
+
+
+def photo_message(user_id: int, message_id: int, file_id: str) -> dict:
+    return {"message_id": message_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "admin"},
+            "photo": [{"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 90, "height": 90}]}
+
+
+def video_message(user_id: int, message_id: int, file_id: str) -> dict:
+    return {"message_id": message_id, "date": int(time.time()), "caption": "Capítulo @otro_canal",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "admin"},
+            "video": {"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1, "height": 1, "duration": 1}}
+
+
+async def wait_for_count(api: FakeBotAPI, method: str, target: int, timeout: float = 600):
+    deadline = time.perf_counter() + timeout
+    while api.count(method) < target:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Solo llegaron {api.count(method)}/{target} llamadas a {method}")
+        await asyncio.sleep(0.005)
+
+
+# --- Escenarios ---
+
+async def bench_publish(bot_module, application, api: FakeBotAPI, sizes: list[int]):
+    db = bot_module.db
+    print("\n[publish] _publish_pack_logic")
+    for size in sizes:
+        pack_name = f"bench_publish_{size}"
+        db.create_pack(pack_name, ADMIN_ID)
+        for i in range(size):
+            _, photo_id = db.add_photo_to_pack(pack_name, f"photo_{size}_{i}")
+            db.add_video_to_photo(pack_name, photo_id, f"video_{size}_{i}", "Capítulo @otro_canal")
+
+        calls_before, retries_before = len(api.calls), api.retry_afters
+        started = time.perf_counter()
+        await bot_module._publish_pack_logic(application.bot, pack_name, ADMIN_ID, 1, "bench")
+        elapsed = time.perf_counter() - started
+        calls = len(api.calls) - calls_before
+        print(f"  {size:>5} fotos: {elapsed:8.2f} s · {size / elapsed:7.1f} fotos/s · "
+              f"{calls} llamadas a la API ({calls / elapsed:.0f}/s) · {api.retry_afters - retries_before} RetryAfter")
+
+
+async def bench_ingest(bot_module, application, api: FakeBotAPI, burst: int):
+    print(f"\n[ingest] ráfaga de {burst} fotos en modo creación")
+    pack_name = "bench_ingest"
+    bot_module.db.create_pack(pack_name, ADMIN_ID)
+    application.user_data[ADMIN_ID].update({"state": "creating_pack", "pack_name": pack_name})
+
+    replies_before = api.count("sendMessage")
+    started = time.perf_counter()
+    for i in range(burst):
+        api.push_update({"message": photo_message(ADMIN_ID, 50_000 + i, f"ingest_{i}")})
+    await wait_for_count(api, "sendMessage", replies_before + burst)
+    elapsed = time.perf_counter() - started
+    stored = len(bot_module.db.get_pack_for_sending(pack_name))
+    print(f"  {burst} fotos en {elapsed:.2f} s · {burst / elapsed:.1f} updates/s · {stored} guardadas")
+    application.user_data[ADMIN_ID].clear()
+
+
+async def bench_pagination(bot_module, n_packs: int, pages: int = 200):
+    print(f"\n[pagination] _get_pack_list_markup sobre {n_packs} packs")
+    db = bot_module.db
+    now = datetime.now(timezone.utc)
+    db.packs_collection.insert_many([{"name": f"pack_{i:05d}", "user_id": ADMIN_ID, "created_at": now, "content": []}
+                                     for i in range(n_packs)])
+    last_page = n_packs // 5
+    samples = []
+    for i in range(pages):
+        page = (i * 7919) % last_page  # Páginas repartidas por todo el listado
+        started = time.perf_counter()
+        await bot_module._get_pack_list_markup(ADMIN_ID, page)
+        samples.append(time.perf_counter() - started)
+    print(f"  {pages} páginas: {percentiles(samples)}")
+
+
+async def bench_immediate(bot_module, application, api: FakeBotAPI, burst: int):
+    print(f"\n[immediate] ráfaga de {burst} videos en modo inmediato")
+    copies_before = api.count("copyMessage")
+    started = time.perf_counter()
+    for i in range(burst):
+        api.push_update({"message": video_message(ADMIN_ID, 80_000 + i, f"immediate_{i}")})
+    await wait_for_count(api, "copyMessage", copies_before + burst)
+    elapsed = time.perf_counter() - started
+    print(f"  {burst} videos en {elapsed:.2f} s · {burst / elapsed:.1f} videos/s")
+
+
+async def bench_subtitles(bot_module, application, searches: int = 50):
+    print(f"\n[subtitles] {searches} búsquedas contra la API simulada")
+
+    class StatusMessage:
+        async def edit_text(self, *args, **kwargs):
+            pass
+
+    samples = []
+    for i in range(searches):
+        started = time.perf_counter()
+        await bot_module._search_subtitles_logic(f"serie {i}", StatusMessage(), None)
+        samples.append(time.perf_counter() - started)
+    print(f"  {percentiles(samples)} · {searches / sum(samples):.1f} búsquedas/s")
+
+
+async def run(args):
+    import mongomock
+
+    api = await FakeBotAPI(default_latency=args.latency_ms / 1000, retry_after_rate=args.retry_after_rate).start()
+    subtitles_api = FakeSubtitlesAPI(latency=args.subtitle_latency_ms / 1000)
+    configure_env(api, subtitles_api)
+
+    import bot as bot_module
+    import drip
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+    drip.INTER_VIDEO_PAUSE = args.video_pause
+    bot_module.db.use_client(mongomock.MongoClient())
+    bot_module.db.setup_database()
+    bot_module.scheduler = AsyncIOScheduler(timezone=bot_module.TIMEZONE)
+    bot_module.scheduler.start()
+
+    application = bot_module.build_application()
+    bot_module._application = application
+    # Backends ya listos: no se ejecuta _post_init (que conectaría con el Mongo real)
+    bot_module._backends_ready = asyncio.Event()
+    bot_module._backends_ready.set()
+
+    only = set(args.only.split(",")) if args.only else None
+    wants = lambda name: only is None or name in only
+    print(f"Latencia Bot API {args.latency_ms} ms · RetryAfter {args.retry_after_rate:.1%} · pausa entre videos {args.video_pause}s")
+
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        try:
+            if wants("publish"):
+                await bench_publish(bot_module, application, api, [int(s) for s in args.publish_sizes.split(",")])
+            if wants("ingest"):
+                await bench_ingest(bot_module, application, api, args.burst)
+            if wants("pagination"):
+                await bench_pagination(bot_module, args.packs)
+            if wants("immediate"):
+                await bench_immediate(bot_module, application, api, args.burst)
+            if wants("subtitles"):
+                await bench_subtitles(bot_module, application)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            bot_module.scheduler.shutdown(wait=False)
+            await api.stop()
+            subtitles_api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default="", help="Escenarios separados por comas (por defecto, todos)")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Latencia simulada de cada llamada a la Bot API")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Probabilidad de responder 429")
+    parser.add_argument("--subtitle-latency-ms", type=float, default=50)
+    parser.add_argument("--video-pause", type=float, default=0.0, help="drip.INTER_VIDEO_PAUSE durante el benchmark")
+    parser.add_argument("--publish-sizes", default="10,100,1000")
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--packs", type=int, default=10_000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# benchmarks/bench_update_processor.py
+"""
+Mide la latencia p50/p99 de los handlers bajo una carga sintética de updates mezclados
+(texto rápido, llamadas a Mongo, descargas de subtítulos lentas) comparando el
+procesamiento secuencial por defecto con PerUserUpdateProcessor.
+
+Uso: python benchmarks/bench_update_processor.py [--updates 500] [--users 20] [--workers 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+# (nombre, probabilidad, duración simulada en segundos)
+LOAD_MIX = [
+    ("texto", 0.70, 0.005),
+    ("mongo", 0.25, 0.030),
+    ("subtitulo", 0.05, 0.800),
+]
+
+
+def build_update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name=f"u{user_id}", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat, from_user=user, text="x")
+    return Update(update_id=update_id, message=message)
+
+
+def build_load(n_updates: int, n_users: int, seed: int = 42):
+    rng = random.Random(seed)
+    load = []
+    for i in range(n_updates):
+        r = rng.random()
+        acc = 0.0
+        for name, prob, duration in LOAD_MIX:
+            acc += prob
+            if r <= acc:
+                break
+        load.append((build_update(i, rng.randint(1, n_users)), name, duration))
+    return load
+
+
+async def fake_handler(duration: float, arrived: float, latencies: list, order: dict, update: Update):
+    # Registra el orden de ejecución por usuario para verificar que se respeta
+    order.setdefault(update.effective_user.id, []).append(update.update_id)
+    await asyncio.sleep(duration)
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def run_sequential(load, arrival_gap: float):
+    latencies, order = [], {}
+    queue = asyncio.Queue()
+
+    async def producer():
+        for item in load:
+            await queue.put((item, time.perf_counter()))
+            await asyncio.sleep(arrival_gap)
+        await queue.put(None)
+
+    async def consumer():
+        while (entry := await queue.get()) is not None:
+            (update, _, duration), arrived = entry
+            await fake_handler(duration, arrived, latencies, order, update)
+
+    await asyncio.gather(producer(), consumer())
+    return latencies, order
+
+
+async def run_concurrent(load, arrival_gap: float, workers: int):
+    latencies, order = [], {}
+    processor = PerUserUpdateProcessor(workers)
+    tasks = []
+    async with processor:
+        for update, _, duration in load:
+            arrived = time.perf_counter()
+            coroutine = fake_handler(duration, arrived, latencies, order, update)
+            tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+            await asyncio.sleep(arrival_gap)
+        await asyncio.gather(*tasks)
+    return latencies, order
+
+
+def report(label: str, latencies: list, elapsed: float, order: dict):
+    ordered = all(ids == sorted(ids) for ids in order.values())
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{label:<28} p50={q[49] * 1000:8.1f} ms  p99={q[98] * 1000:8.1f} ms  "
+          f"total={elapsed:6.2f} s  orden_por_usuario={'OK' if ordered else 'ROTO'}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--gap-ms", type=float, default=5.0, help="Separación entre llegadas de updates")
+    args = parser.parse_args()
+
+    load = build_load(args.updates, args.users)
+    gap = args.gap_ms / 1000
+
+    start = time.perf_counter()
+    latencies, order = await run_sequential(load, gap)
+    report("Secuencial (por defecto)", latencies, time.perf_counter() - start, order)
+
+    start = time.perf_counter()
+    latencies, order = await run_concurrent(load, gap, args.workers)
+    report(f"PerUser ({args.workers} workers)", latencies, time.perf_counter() - start, order)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
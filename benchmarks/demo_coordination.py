@@ -0,0 +1,97 @@
+# benchmarks/demo_coordination.py
+"""
+Dos instancias del coordinador (coordination.py) en el mismo proceso contra una sola base de
+datos: comprueba la elección de líder, que solo una instancia obtiene el lease de una tarea y
+que, cuando el titular deja de latir, la otra instancia pasa a ser líder y retoma su tarea.
+
+Por defecto usa mongomock; con --mongo-uri se ejecuta contra un Mongo local real.
+
+Uso: python benchmarks/demo_coordination.py [--mongo-uri mongodb://localhost:27017] [--lease-seconds 2]
+Requiere: pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+from coordination import Coordinator
+
+
+def check(condition: bool, message: str):
+    print(f"  {'✔' if condition else '✘'} {message}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def wait_until(predicate, timeout: float):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run(args):
+    if args.mongo_uri:
+        import pymongo
+        db.use_client(pymongo.MongoClient(args.mongo_uri))
+    else:
+        import mongomock
+        db.use_client(mongomock.MongoClient())
+    db.setup_database()
+    db.leases_collection.delete_many({})
+
+    resumed = []
+    lost = []
+    a = Coordinator("instancia-a", lease_seconds=args.lease_seconds)
+    b = Coordinator("instancia-b", lease_seconds=args.lease_seconds)
+
+    print("Elección de líder")
+    a.start(on_orphan=lambda name, payload: resumed.append(("a", name, payload)))
+    await a.beat()
+    b.start(on_orphan=lambda name, payload: resumed.append(("b", name, payload)))
+    await b.beat()
+    check(a.is_leader and not b.is_leader, "solo la primera instancia es líder")
+
+    print("Lease de una tarea")
+    payload = {"kind": "publish", "pack_name": "demo", "user_chat_id": 1}
+    results = await asyncio.gather(asyncio.to_thread(a.claim, "pack:demo:1", payload, lambda: lost.append("a")),
+                                   asyncio.to_thread(b.claim, "pack:demo:1", payload, lambda: lost.append("b")))
+    check(results == [True, False], f"la tarea la obtiene una sola instancia (a={results[0]}, b={results[1]})")
+    await asyncio.sleep(args.lease_seconds * 1.5)
+    check(db.get_lease("pack:demo:1")["holder"] == "instancia-a", "el latido mantiene el lease más allá de su caducidad")
+
+    print("Caída del titular")
+    a._task.cancel()  # Deja de latir sin soltar nada, como un proceso que muere
+    took_over = await wait_until(lambda: b.is_leader and resumed, timeout=args.lease_seconds * 4)
+    check(took_over, "la otra instancia pasa a ser líder y retoma la tarea huérfana")
+    check(resumed[0] == ("b", "pack:demo:1", payload), f"retomada con su payload: {resumed[0] if resumed else None}")
+
+    print("Tarea terminada")
+    b.release("pack:demo:1")
+    check(not a.claim("pack:demo:1", payload), "una tarea recién terminada no se vuelve a ejecutar")
+
+    print("Parada ordenada")
+    c = Coordinator("instancia-c", lease_seconds=60)  # Un lease largo: solo lo toma si b lo cede
+    await c.beat()
+    check(not c.is_leader, "mientras b es líder, una instancia nueva no lo es")
+    await b.stop()
+    await c.beat()
+    check(c.is_leader, "al ceder b el liderazgo, la instancia nueva lo toma sin esperar a la caducidad")
+    print("Todo correcto.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="", help="Mongo real (por defecto, mongomock en memoria)")
+    parser.add_argument("--lease-seconds", type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
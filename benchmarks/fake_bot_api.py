@@ -0,0 +1,168 @@
+# benchmarks/fake_bot_api.py
+"""
+Servidor HTTP local que imita la Bot API de Telegram para los benchmarks.
+
+Responde a los métodos que usa el bot con datos mínimos pero válidos, puede simular
+latencia por método y devolver respuestas 429 (RetryAfter) con una probabilidad dada.
+Se apunta el bot a él con TELEGRAM_API_BASE_URL=http://127.0.0.1:<puerto>.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from urllib.parse import parse_qs
+
+FAKE_PHOTO_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2048  # Cabecera JPEG + relleno
+
+MESSAGE_METHODS = {"sendMessage", "sendVideo", "sendDocument", "sendPhoto", "editMessageText"}
+TRUE_METHODS = {"deleteWebhook", "setWebhook", "setChatPhoto", "answerCallbackQuery", "answerInlineQuery",
+                "editMessageReplyMarkup", "deleteMessage", "setMyCommands", "close", "logOut"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: dict[str, float] | None = None, default_latency: float = 0.0,
+                 retry_after_rate: float = 0.0, retry_after_seconds: int = 1, seed: int = 1234):
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.calls: list[tuple[float, str, dict]] = []
+        self.retry_afters = 0
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._listeners: dict[str, list[asyncio.Future]] = {}
+        self._server = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    # --- API para los benchmarks ---
+
+    def push_update(self, update: dict):
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.put_nowait(update)
+
+    def push_text(self, user_id: int, text: str):
+        self.push_update({"message": self._message(user_id, text, from_user=True)})
+
+    def wait_for(self, method: str) -> asyncio.Future:
+        """Futuro que se resuelve con el instante (perf_counter) de la próxima llamada a `method`."""
+        future = asyncio.get_running_loop().create_future()
+        self._listeners.setdefault(method, []).append(future)
+        return future
+
+    def count(self, method: str) -> int:
+        return sum(1 for _, m, _ in self.calls if m == method)
+
+    # --- Servidor HTTP mínimo (HTTP/1.1 con keep-alive) ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                verb, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload, content_type = await self._dispatch(verb, path, headers, body)
+                writer.write(f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, verb: str, path: str, headers: dict, body: bytes):
+        if path.startswith("/file/"):
+            return 200, FAKE_PHOTO_BYTES, "application/octet-stream"
+
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._parse_params(headers, body)
+        self.calls.append((time.perf_counter(), method, params))
+        for future in self._listeners.pop(method, []):
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+        delay = self.latency.get(method, self.default_latency)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method != "getUpdates" and self.retry_after_rate and self._rng.random() < self.retry_after_rate:
+            self.retry_afters += 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after_seconds}",
+                "parameters": {"retry_after": self.retry_after_seconds},
+            }).encode(), "application/json"
+
+        result = await self._result_for(method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode(), "application/json"
+
+    @staticmethod
+    def _parse_params(headers: dict, body: bytes) -> dict:
+        content_type = headers.get("content-type", "")
+        if "application/x-www-form-urlencoded" in content_type:
+            return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        if "application/json" in content_type and body:
+            return json.loads(body)
+        return {}  # multipart (subidas de archivos): no se analiza
+
+    def _message(self, chat_id, text: str = "", from_user: bool = False) -> dict:
+        chat_id = int(chat_id) if chat_id not in (None, "") else 1
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"}}
+        if text:
+            message["text"] = text
+        if from_user:
+            message["from"] = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        return message
+
+    async def _result_for(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method == "getUpdates":
+            timeout = float(params.get("timeout", 0) or 0)
+            updates = []
+            try:
+                updates.append(await asyncio.wait_for(self._updates.get(), timeout=max(timeout, 0.05)))
+                while not self._updates.empty():
+                    updates.append(self._updates.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            return updates
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {"file_id": file_id, "file_unique_id": f"u{abs(hash(file_id)) % 10**8}",
+                    "file_size": len(FAKE_PHOTO_BYTES), "file_path": f"photos/{abs(hash(file_id))}.jpg"}
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in MESSAGE_METHODS:
+            message = self._message(params.get("chat_id"), params.get("text", ""))
+            if method in ("sendVideo", "sendDocument"):
+                key = "video" if method == "sendVideo" else "document"
+                message[key] = {"file_id": str(params.get(key, "f")), "file_unique_id": f"u{next(self._message_ids)}"}
+                if key == "video":
+                    message[key].update({"width": 1, "height": 1, "duration": 1})
+            return message
+        if method in TRUE_METHODS:
+            return True
+        return True
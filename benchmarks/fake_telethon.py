@@ -0,0 +1,160 @@
+# benchmarks/fake_telethon.py
+"""
+Cliente de Telethon falso para ejecutar pro_mode.run_mirror_task sin red.
+
+Reproduce un canal de origen (sintético o grabado en JSONL) con los mismos tipos de mensaje
+que devuelve Telethon: MessageService de cambio de foto del canal seguidos de mensajes con
+video. Simula latencia por operación, inyecta FloodWaitError con una probabilidad dada y
+registra cada publicación en el canal destino (cambios de foto y videos) con su instante.
+
+Formato JSONL grabado, una línea por mensaje en orden cronológico:
+    {"id": 101, "type": "photo"}
+    {"id": 102, "type": "video", "text": "Capítulo 1 @canal_origen"}
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telethon.errors.rpcerrorlist import FloodWaitError
+from telethon.tl.types import (
+    Document, DocumentAttributeVideo, Message, MessageActionChatEditPhoto, MessageMediaDocument,
+    MessageService, PeerChannel, Photo, PhotoSize,
+)
+
+SOURCE_CHANNEL_ID = 777
+FAKE_PHOTO_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 2048
+
+
+def _photo(photo_id: int) -> Photo:
+    return Photo(id=photo_id, access_hash=0, file_reference=b"", date=datetime.now(timezone.utc),
+                 sizes=[PhotoSize(type="x", w=90, h=90, size=len(FAKE_PHOTO_BYTES))], dc_id=1)
+
+
+def _video(doc_id: int) -> MessageMediaDocument:
+    document = Document(id=doc_id, access_hash=0, file_reference=b"", date=datetime.now(timezone.utc),
+                        mime_type="video/mp4", size=10 * 1024 * 1024, dc_id=1,
+                        attributes=[DocumentAttributeVideo(duration=60, w=1280, h=720)])
+    return MessageMediaDocument(document=document)
+
+
+def photo_change(message_id: int) -> MessageService:
+    return MessageService(id=message_id, peer_id=PeerChannel(SOURCE_CHANNEL_ID), date=datetime.now(timezone.utc),
+                          action=MessageActionChatEditPhoto(photo=_photo(message_id)))
+
+
+def video_message(message_id: int, text: str) -> Message:
+    return Message(id=message_id, peer_id=PeerChannel(SOURCE_CHANNEL_ID), date=datetime.now(timezone.utc),
+                   message=text, media=_video(message_id))
+
+
+def synthetic_source(blocks: int, videos_per_block: int, start_id: int = 1) -> list:
+    """Canal con `blocks` cambios de foto, cada uno seguido de `videos_per_block` videos."""
+    messages, message_id = [], start_id
+    for block in range(blocks):
+        messages.append(photo_change(message_id))
+        message_id += 1
+        for video in range(videos_per_block):
+            messages.append(video_message(message_id, f"Serie {block + 1} - Capítulo {video + 1}\nVía @canal_origen"))
+            message_id += 1
+    # Cambio de foto final: cierra el último bloque como lo haría el siguiente bloque real
+    messages.append(photo_change(message_id))
+    return messages
+
+
+def recorded_source(path: str) -> list:
+    messages = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["type"] == "photo":
+                messages.append(photo_change(entry["id"]))
+            else:
+                messages.append(video_message(entry["id"], entry.get("text", "")))
+    return messages
+
+
+class FakeTelethonClient:
+    def __init__(self, source: list, latency: dict[str, float] | None = None, default_latency: float = 0.0,
+                 flood_wait_rate: float = 0.0, flood_wait_seconds: int = 1, seed: int = 1234):
+        self.source = source
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.flood_waits = 0
+        self.posts: list[tuple[float, str]] = []  # (perf_counter, "photo"/"video")
+        self._rng = random.Random(seed)
+
+    def factory(self, session_string: str, api_id: int, api_hash: str):
+        """Para pasar como client_factory a run_mirror_task."""
+        return self
+
+    @property
+    def first_post_at(self) -> float | None:
+        return self.posts[0][0] if self.posts else None
+
+    def count(self, kind: str) -> int:
+        return sum(1 for _, k in self.posts if k == kind)
+
+    async def _delay(self, operation: str):
+        delay = self.latency.get(operation, self.default_latency)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _maybe_flood(self, operation: str):
+        await self._delay(operation)
+        if self.flood_wait_rate and self._rng.random() < self.flood_wait_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+
+    # --- Superficie de TelegramClient que usa pro_mode ---
+
+    async def __aenter__(self):
+        await self._delay("connect")
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get_me(self):
+        return SimpleNamespace(id=1, first_name="AgenteFalso")
+
+    async def get_entity(self, entity):
+        await self._delay("get_entity")
+        return entity
+
+    async def iter_messages(self, entity, offset_id: int = 0, reverse: bool = False, wait_time: float = 0, **kwargs):
+        messages = [m for m in self.source if m.id > offset_id] if reverse else \
+                   [m for m in reversed(self.source) if not offset_id or m.id < offset_id]
+        for index, message in enumerate(messages):
+            if index and index % 100 == 0:
+                await self._delay("iter_messages")  # Una petición GetHistory cada 100 mensajes
+            yield message
+
+    async def download_media(self, media, file: str | None = None):
+        await self._delay("download_media")
+        path = file or f"./fake_{getattr(media, 'id', 0)}.jpg"
+        with open(path, "wb") as f:
+            f.write(FAKE_PHOTO_BYTES)
+        return path
+
+    async def upload_file(self, path: str):
+        await self._delay("upload_file")
+        return SimpleNamespace(name=os.path.basename(path), size=os.path.getsize(path))
+
+    async def __call__(self, request):
+        # Solo se usa para EditPhotoRequest
+        await self._maybe_flood("edit_photo")
+        self.posts.append((time.perf_counter(), "photo"))
+        return True
+
+    async def send_file(self, entity, media, caption: str = "", **kwargs):
+        await self._maybe_flood("send_file")
+        self.posts.append((time.perf_counter(), "video"))
+        return SimpleNamespace(id=len(self.posts))
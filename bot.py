@@ -3,43 +3,70 @@ import os
 import logging
 import re
 import asyncio
-import traceback
-import html
 import json
-import calendar
+import sys
+import time
+import signal
+import threading
+import importlib
+import glob
+import hashlib
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pytz
 from bson import ObjectId
-from dateutil.relativedelta import relativedelta
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.constants import ParseMode
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, TypeHandler,
+    InlineQueryHandler
 )
 from telegram.error import RetryAfter, BadRequest
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.mongodb import MongoDBJobStore
-
+# Modo Pro (telethon), subtítulos (requests) y APScheduler se importan la primera vez que
+# se usan: en el plan gratuito de Render cada arranque en frío paga estas importaciones.
 import database as db
-import subtitles as sub_api
-import pro_mode
+import channels
+import warmup
+import drip
+import metrics
+from bot_request import InstrumentedRequest
+from update_processor import PerUserUpdateProcessor
+from callback_codec import encode as cb, decode as decode_callback, ExpiredCallback
+from error_reporter import ErrorReporter
+from progress import ProgressReporter, format_duration
+from persistence import MongoPersistence
+from coordination import Coordinator, new_run_key, MISFIRE_GRACE_SECONDS
+from log_setup import setup_logging
+from task_manager import TaskManager, PRIORITY_MANUAL, PRIORITY_SCHEDULED, STATUS_LABELS, STATUS_QUEUED, STATUS_DEFERRED, parse_limits
 
 # --- Cargar y Configurar ---
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-CHANNEL_ID = os.getenv("CHANNEL_ID")
+CHANNEL_ID = channels.CHANNEL_ID
 REPLACEMENT_USERNAME = os.getenv("REPLACEMENT_USERNAME", "@estrenos_fh")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID"))
-MONGO_URI = os.getenv("MONGO_URI")
 TIMEZONE = pytz.timezone(os.getenv("TIMEZONE", "America/Havana"))
 RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL") 
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")  # Para un servidor local de la Bot API
 PORT = int(os.getenv("PORT", "8443"))
-jobstores = {'default': MongoDBJobStore(database="telegramBotDB", collection="jobs", host=MONGO_URI)}
-scheduler = AsyncIOScheduler(jobstores=jobstores, timezone=TIMEZONE)
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "8"))
+WARMUP_MINUTES = int(os.getenv("WARMUP_MINUTES", "10"))
+DRIP_SPACING_MINUTES = int(os.getenv("DRIP_SPACING_MINUTES", "30"))
+TASK_LIMITS = parse_limits(os.getenv("TASK_LIMITS"))
+SKIP_DUPLICATE_MEDIA = os.getenv("SKIP_DUPLICATE_MEDIA", "0") == "1"  # Valor inicial; se cambia con /duplicados
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # En polling, puerto opcional para /metrics
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))  # Render mata el proceso 30 s después del SIGTERM
+PERSIST_STATE = os.getenv("PERSIST_STATE", "1") != "0"  # Guardar user_data en Mongo para sobrevivir a reinicios
+PACK_ARCHIVE_DAYS = float(os.getenv("PACK_ARCHIVE_DAYS", "90"))  # Días desde la última publicación para archivar un pack (0 = nunca)
+ARCHIVE_SWEEP_HOURS = 6
+# Se crea en _init_backends, ya con el MongoClient compartido de database.py
+scheduler = None
+# Los registros se encolan y un hilo aparte los escribe en JSON; lo pendiente se vacía al salir (ver log_setup.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # --- Teclados Personalizados ---
@@ -47,59 +74,256 @@ MAIN_KEYBOARD = ReplyKeyboardMarkup([
     ["📦 Crear Pack"], 
     ["📋 Gestionar Packs"], 
     ["🔎 Buscar Subtítulos"],
-    ["🚀 Activar Modo Pro"]
+    ["🚀 Activar Modo Pro"],
+    ["🧵 Tareas"]
 ], resize_keyboard=True)
 EDITING_KEYBOARD = ReplyKeyboardMarkup([["✅ Terminar Creación/Edición"]], resize_keyboard=True)
 CANCEL_KEYBOARD = ReplyKeyboardMarkup([["❌ Cancelar"]], resize_keyboard=True)
 
+# --- ARRANQUE DIFERIDO ---
+_backends_ready = None  # asyncio.Event que se activa cuando Mongo y el scheduler están listos
+_backends_error = None
+
+# Updates que se pueden responder sin base de datos ni scheduler
+LIGHTWEIGHT_TEXTS = {"/start", "📦 Crear Pack", "🔎 Buscar Subtítulos", "🚀 Activar Modo Pro", "❌ Cancelar", "🧵 Tareas"}
+
+async def _lazy_import(name: str):
+    """Importa un módulo pesado la primera vez que se usa, sin bloquear el event loop."""
+    module = sys.modules.get(name)
+    if module is None:
+        module = await asyncio.to_thread(importlib.import_module, name)
+    return module
+
+def _init_backends_sync(loop: asyncio.AbstractEventLoop):
+    """Conecta con Mongo y arranca APScheduler. Corre en un hilo mientras el bot ya atiende updates."""
+    global scheduler
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.jobstores.mongodb import MongoDBJobStore
+
+    db.setup_database()
+    # Con el margen por defecto (misfire_grace_time de 1 s) los jobs que vencen durante un relevo de líder se descartan
+    job_defaults = {"misfire_grace_time": MISFIRE_GRACE_SECONDS, "coalesce": True}
+    scheduler = AsyncIOScheduler(timezone=TIMEZONE, event_loop=loop, job_defaults=job_defaults)
+    scheduler.add_jobstore(MongoDBJobStore(database="telegramBotDB", collection="jobs", client=db.get_client()), 'default')
+    # En pausa hasta que esta instancia sea líder (ver coordination.py): con dos instancias sobre
+    # el mismo job store solo una dispara los jobs. Los comandos pueden añadir jobs igualmente.
+    scheduler.start(paused=True)
+    # Los jobs guardados antes de estos valores conservan los suyos en el job store
+    for job in scheduler.get_jobs():
+        if job.misfire_grace_time != MISFIRE_GRACE_SECONDS or not job.coalesce:
+            job.modify(**job_defaults)
+    if PACK_ARCHIVE_DAYS > 0:
+        scheduler.add_job(archive_sweep_job, trigger='interval', hours=ARCHIVE_SWEEP_HOURS, id="archive_sweep",
+                          name="Archivar packs", replace_existing=True)
+    elif scheduler.get_job("archive_sweep"):
+        scheduler.remove_job("archive_sweep")
+
+def _on_elected():
+    # Lo que se estaba publicando desde la cola sin lease (caída anterior a los leases) no se
+    # reanuda a ciegas; lo que tiene lease lo retoma _resume_orphan cuando caduca
+    for entry in db.list_publish_queue(statuses=("running",)):
+        if db.get_lease(_drip_run_key(entry['_id'])) is None:
+            db.update_queue_entry(entry['_id'], status='interrupted', finished_at=datetime.now(timezone.utc))
+            logger.warning(f"La publicación en cola de '{entry['pack_name']}' quedó interrumpida por un reinicio.")
+    _replan_drip_queue()
+    scheduler.resume()
+
+def _on_demoted():
+    scheduler.pause()
+
+def _resume_orphan(run_key: str, payload: dict):
+    """Retoma una tarea de otra instancia que dejó de renovar su lease, sin repetir lo ya publicado."""
+    kind = payload.get("kind")
+    if kind == "publish":
+        asyncio.create_task(publish_pack_job(payload["pack_name"], payload["user_chat_id"], run_key=run_key, resumed=True))
+    elif kind == "drip":
+        db.update_queue_entry(payload["entry_id"], status='pending')
+        asyncio.create_task(drip_publish_job(payload["entry_id"], resumed=True))
+    elif kind == "mission":
+        asyncio.create_task(_start_mission(_application.bot, payload["user_chat_id"], payload["start_link"],
+                                           payload["post_count"], run_key=run_key, resumed=True))
+    else:
+        logger.error(f"Lease huérfano '{run_key}' de tipo desconocido: {payload}")
+        coordinator.release(run_key)
+
+async def _init_backends():
+    global _backends_error
+    started = time.monotonic()
+    try:
+        await asyncio.to_thread(_init_backends_sync, asyncio.get_running_loop())
+        logger.info(f"Base de datos y Scheduler iniciados correctamente en {time.monotonic() - started:.2f}s.")
+        coordinator.start(on_elected=_on_elected, on_demoted=_on_demoted, on_orphan=_resume_orphan)
+    except Exception as e:
+        _backends_error = e
+        logger.critical(f"FATAL: Error al iniciar la base de datos o el scheduler: {e}")
+    finally:
+        _backends_ready.set()
+
+async def _post_init(application: Application):
+    global _backends_ready
+    _backends_ready = asyncio.Event()
+    error_reporter.start(application.bot)
+    application.create_task(_init_backends())
+    if METRICS_PORT and not RENDER_EXTERNAL_URL:
+        webserver = await _lazy_import("webserver")
+        webserver.build_server().listen(METRICS_PORT)
+        logger.info(f"Métricas disponibles en http://0.0.0.0:{METRICS_PORT}/metrics")
+
+# Tipos de tarea con lease (ver _start_publish y _start_mission): si se aplazan, se retoman
+RESUMABLE_KINDS = {"publish", "mission"}
+
+async def _post_stop(application: Application):
+    """
+    Apagado ordenado, después de dejar de recibir updates: deja de aceptar trabajo (cede el
+    liderazgo, con lo que se pausa el scheduler, y aplaza lo que está en cola), espera hasta
+    SHUTDOWN_DRAIN_SECONDS a las tareas en curso y aplaza las que no acaben. Las aplazadas con
+    lease lo sueltan sin marcarlo como hecho, así que el próximo líder las retoma desde su
+    punto de reanudación. Después se cierran la coordinación y el scheduler, y se informa al admin.
+    """
+    started = time.monotonic()
+    await coordinator.hand_over()
+    deferred = task_manager.close()
+    drained, interrupted = await task_manager.drain(SHUTDOWN_DRAIN_SECONDS)
+    deferred += interrupted
+    await coordinator.stop()
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+
+    lines = [f"🔌 Apagado en {time.monotonic() - started:.1f}s: {len(drained)} tarea(s) terminadas a tiempo, {len(deferred)} aplazada(s)."]
+    lines += [f"✅ #{t.task_id} {t.description}" for t in drained]
+    lines += [f"⏸️ #{t.task_id} {t.description} "
+              f"({'se retomará al arrancar' if t.kind in RESUMABLE_KINDS else 'descartada'})" for t in deferred]
+    report = "\n".join(lines)
+    logger.info(report)
+    if drained or deferred:
+        try:
+            await asyncio.wait_for(application.bot.send_message(chat_id=ADMIN_USER_ID, text=report[:4000]), timeout=5)
+        except Exception as e:
+            logger.error(f"No se pudo enviar el informe de apagado: {e}")
+    await error_reporter.stop()
+
+async def _post_shutdown(application: Application):
+    # Después de Application.shutdown(), que hace el último volcado de la persistencia a Mongo
+    db.close_client()
+    # Fotos temporales del Modo Pro y del modo inmediato que hubieran quedado a medias
+    for path in glob.glob("./temp_*.jpg"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    logger.info("Conexión con MongoDB cerrada. Apagado completo.")
+
+async def await_backends(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Primer handler de cada update (grupo -1). Los updates ligeros pasan enseguida; el resto
+    espera a que terminen de inicializarse Mongo y el scheduler.
+    """
+    message = update.effective_message
+    if update.message and message.text and message.text.split("@")[0] in LIGHTWEIGHT_TEXTS:
+        return
+    await _backends_ready.wait()
+    if _backends_error:
+        if message:
+            await message.reply_text("❌ El bot no pudo conectar con la base de datos. Revisa los logs.")
+        raise ApplicationHandlerStop
+
 # --- GESTOR DE TAREAS Y ERRORES ---
+task_manager = TaskManager(TASK_LIMITS)
+error_reporter = ErrorReporter(ADMIN_USER_ID)
+coordinator = Coordinator()
+_application = None  # Application en ejecución; lo usan los jobs de APScheduler
+
+TASK_KIND_LABELS = {"publish": "Publicación", "mission": "Misión Modo Pro", "search": "Búsqueda de subtítulos", "warmup": "Precalentamiento", "profile": "Perfilado", "transfer": "Exportación/importación"}
+
+def _cancel_markup(task_id: str, label: str = "❌ Cancelar") -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=cb("cancel_task", task_id))]])
+
+def _queue_notice(kind: str) -> str:
+    """Texto a añadir al mensaje de estado si una tarea nueva de este tipo va a quedar en cola."""
+    if not task_manager.is_saturated(kind):
+        return ""
+    return f"\n\n⏳ En cola: hay {task_manager.running_count(kind) + task_manager.queued_count(kind)} tarea(s) de este tipo por delante."
+
+def _describe_task(managed) -> str:
+    line = f"#{managed.task_id} · {TASK_KIND_LABELS.get(managed.kind, managed.kind)} · {STATUS_LABELS[managed.status]}"
+    if managed.status == STATUS_QUEUED:
+        line += f" (posición {task_manager.queue_position(managed.task_id)})"
+    return f"{line}\n    {managed.description}"
+
+def _get_tasks_markup() -> tuple[str, InlineKeyboardMarkup]:
+    tasks = task_manager.list_tasks()
+    keyboard = []
+    if not tasks:
+        text = "No hay tareas en ejecución ni en cola."
+    else:
+        text = "Tareas activas:\n\n" + "\n".join(_describe_task(t) for t in tasks)
+        for t in tasks:
+            keyboard.append([InlineKeyboardButton(f"ℹ️ #{t.task_id}", callback_data=cb("task_info", t.task_id)),
+                             InlineKeyboardButton(f"❌ Cancelar #{t.task_id}", callback_data=cb("cancel_task", t.task_id))])
+    keyboard.append([InlineKeyboardButton("🔄 Actualizar", callback_data=cb("tasks_list"))])
+    return text, InlineKeyboardMarkup(keyboard)
 
-def _store_task(context: ContextTypes.DEFAULT_TYPE, user_id: int, task: asyncio.Task):
-    if 'tasks' not in context.bot_data:
-        context.bot_data['tasks'] = {}
-    context.bot_data['tasks'][user_id] = task
+async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text, reply_markup = _get_tasks_markup()
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
-def _get_task(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> asyncio.Task | None:
-    return context.bot_data.get('tasks', {}).get(user_id)
+async def tasks_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    text, reply_markup = _get_tasks_markup()
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest:
+        pass  # Sin cambios desde la última vez
 
-def _clear_task(context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    if 'tasks' in context.bot_data and user_id in context.bot_data['tasks']:
-        del context.bot_data['tasks'][user_id]
-        logger.info(f"Tarea para el usuario {user_id} limpiada.")
+async def task_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    task_id = context.args[0]
+    managed = task_manager.get(task_id)
+    if not managed:
+        await query.edit_message_text("Esa tarea ya no existe.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Volver", callback_data=cb("tasks_list"))]]))
+        return
+    fmt = lambda ts: datetime.fromtimestamp(ts, TIMEZONE).strftime("%d/%m %H:%M:%S") if ts else "-"
+    text = (f"{_describe_task(managed)}\n\n"
+            f"Prioridad: {'programada' if managed.priority >= PRIORITY_SCHEDULED else 'manual'}\n"
+            f"Encolada: {fmt(managed.created_at)}\n"
+            f"Iniciada: {fmt(managed.started_at)}\n"
+            f"Terminada: {fmt(managed.finished_at)}")
+    keyboard = []
+    if managed.is_active:
+        keyboard.append([InlineKeyboardButton(f"❌ Cancelar #{task_id}", callback_data=cb("cancel_task", task_id))])
+    keyboard.append([InlineKeyboardButton("⬅️ Volver", callback_data=cb("tasks_list"))])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def cancel_task_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Manejador unificado para cancelar cualquier tarea en ejecución."""
+    """Manejador unificado para cancelar una tarea (en cola o en ejecución) por su ID."""
     query = update.callback_query
-    user_id = update.effective_user.id
-    
-    task = _get_task(context, user_id)
-    if task and not task.done():
-        task.cancel()
+    task_id = context.args[0]
+    managed = task_manager.get(task_id)
+    was_queued = managed is not None and managed.status == STATUS_QUEUED
+
+    if task_manager.cancel(task_id):
         await query.answer("Enviando señal de cancelación...")
-        _clear_task(context, user_id)
+        if was_queued:
+            # Nunca llegó a ejecutarse, así que nadie más actualizará su mensaje de estado
+            try:
+                await query.edit_message_text(f"🛑 Tarea #{task_id} cancelada antes de empezar.")
+            except BadRequest:
+                pass
     else:
-        await query.answer("No hay ninguna tarea activa para cancelar.", show_alert=True)
+        await query.answer("Esa tarea ya no está activa.", show_alert=True)
         try:
             await query.edit_message_reply_markup(reply_markup=None)
         except BadRequest:
             pass
-        _clear_task(context, user_id)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
-    user_id = update.effective_user.id if hasattr(update, 'effective_user') and update.effective_user else ADMIN_USER_ID
-    _clear_task(context, user_id)
 
-    tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
-    tb_string = "".join(tb_list)
+    # El informe lo envía error_reporter en segundo plano (agrupado y con presupuesto propio)
     update_str = str(update.to_dict()) if isinstance(update, Update) else str(update)
-    error_message = (f"Ocurrió una excepción:\n\n<pre>update = {html.escape(update_str)}</pre>\n\n<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n<pre>{html.escape(tb_string)}</pre>")
-    message_parts = [error_message[i:i + 4000] for i in range(0, len(error_message), 4000)]
-    for part in message_parts:
-        try:
-            await context.bot.send_message(chat_id=ADMIN_USER_ID, text=part, parse_mode=ParseMode.HTML)
-        except BadRequest as e:
-            logger.error(f"No se pudo enviar parte del log de error: {e}")
+    error_reporter.report(context.error, f"update = {update_str}\n\ncontext.user_data = {context.user_data}")
     if isinstance(update, Update) and update.effective_chat:
         try:
             await update.effective_chat.send_message("❌ Ups, algo salió mal. Tarea cancelada. Volviendo al menú principal.", reply_markup=MAIN_KEYBOARD)
@@ -112,110 +336,283 @@ def clean_caption(original_caption: str | None) -> str:
     pattern = r'@\w+|https?://t\.me/\S+'
     return re.sub(pattern, REPLACEMENT_USERNAME, original_caption)
 
+# --- DUPLICADOS ---
+def _skip_duplicates() -> bool:
+    """Si está activo, publicaciones y misiones se saltan los videos ya publicados en el canal."""
+    return bool(db.get_setting("skip_duplicate_media", SKIP_DUPLICATE_MEDIA))
+
+def _duplicate_warning(file_unique_id: str, pack_name: str) -> str:
+    """Aviso para añadir a la respuesta si el archivo ya está en otro pack o ya se publicó."""
+    media = db.find_media(file_unique_id)
+    if not media:
+        return ""
+    notes = []
+    packs = media.get("packs", [])
+    other_packs = [p for p in packs if p != pack_name]
+    if other_packs:
+        notes.append(f"ya está en {'el pack' if len(other_packs) == 1 else 'los packs'} {', '.join(repr(p) for p in other_packs[:5])}")
+    elif pack_name in packs:
+        notes.append("ya está en este mismo pack")
+    for channel_id, posted_at in media["posted"].items():
+        notes.append(f"ya se publicó en {channel_id} el {posted_at.astimezone(TIMEZONE).strftime('%d/%m/%Y %H:%M')}")
+    return "\n⚠️ Posible duplicado: " + "; ".join(notes) if notes else ""
+
+async def duplicates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/duplicados [on|off]: activa o muestra el modo que omite videos ya publicados."""
+    if context.args and context.args[0].lower() in ("on", "off"):
+        db.set_setting("skip_duplicate_media", context.args[0].lower() == "on")
+    state = "activado" if _skip_duplicates() else "desactivado"
+    await update.message.reply_text(
+        f"Omitir videos ya publicados en el canal: {state}.\n"
+        "Afecta a las publicaciones de packs y a las misiones del Modo Pro.\nUso: /duplicados on|off")
+
 # --- LÓGICA DE PUBLICACIÓN DE PACKS (CANCELABLE) ---
-async def _publish_pack_logic(bot, pack_name: str, user_chat_id: int, status_message_id: int, completion_callback: callable):
+async def _publish_to_channel(bot, channel_id: str, pack_content: list, progress: ProgressReporter,
+                              skip_duplicates: bool = False) -> int:
+    """
+    Publica el pack completo en un canal. Se ejecuta dentro del carril del canal, así que nunca se intercala con otra publicación.
+    Devuelve cuántos videos se omitieron por estar ya publicados en el canal (solo con skip_duplicates).
+    """
+    if channels.lane_busy(channel_id):
+        progress.set_line(channel_id, "⏳ Esperando a que termine otra publicación en este canal")
+
+    already_posted = set()
+    if skip_duplicates:
+        file_unique_ids = [v.get('file_unique_id') for item in pack_content for v in item.get('videos', [])]
+        already_posted = {uid for uid, media in db.find_media_many(file_unique_ids).items() if channel_id in media["posted"]}
+    posted_now = []  # file_unique_ids enviados, para el índice de duplicados (una escritura al final)
+    skipped = 0
+
+    async with channels.lane(channel_id):
+        try:
+            for photo_index, item in enumerate(pack_content):
+                progress.set_line(channel_id, f"Foto {photo_index + 1}/{len(pack_content)}")
+
+                broken_reason = warmup.photo_cache.broken_reason(item['photo_file_id'])
+                if broken_reason:
+                    progress.note(f"⚠️ {channel_id}: foto {photo_index + 1} marcada como rota ({broken_reason[:60]}), saltada.")
+                    progress.advance()
+                    continue
+
+                videos = item.get('videos', [])
+                if already_posted and videos and all(v.get('file_unique_id') in already_posted for v in videos):
+                    # Todo el bloque ya está en el canal: ni siquiera se cambia la foto
+                    skipped += len(videos)
+                    progress.advance()
+                    continue
+
+                photo_sent = False
+                video_index = 0
+                for attempt in range(5):
+                    try:
+                        if not photo_sent:
+                            # Si el precalentamiento ya descargó la foto, se sube directamente
+                            photo_bytes = warmup.photo_cache.get(item['photo_file_id'])
+                            if photo_bytes is None:
+                                photo_file_obj = await bot.get_file(item['photo_file_id'])
+                                photo_bytes = bytes(await photo_file_obj.download_as_bytearray())
+                            sent_at = time.monotonic()
+                            await bot.set_chat_photo(chat_id=channel_id, photo=photo_bytes)
+                            drip.latency_tracker.record("photo", time.monotonic() - sent_at)
+                            photo_sent = True
+
+                        while video_index < len(videos):
+                            video = videos[video_index]
+                            broken_reason = warmup.photo_cache.broken_reason(video['file_id'])
+                            if broken_reason:
+                                progress.note(f"⚠️ {channel_id}: un adjunto de la foto {photo_index + 1} está marcado como roto ({broken_reason[:60]}), saltado.")
+                                video_index += 1
+                                continue
+                            if video.get('file_unique_id') in already_posted:
+                                skipped += 1
+                                video_index += 1
+                                continue
+                            sent_at = time.monotonic()
+                            if video.get('caption', '').startswith("SUBTITLE:"):
+                                message = await bot.send_document(chat_id=channel_id, document=video['file_id'], caption=video['caption'].replace("SUBTITLE:", "Subtítulo:"))
+                            else:
+                                message = await bot.send_video(chat_id=channel_id, video=video['file_id'], caption=clean_caption(video.get('caption')))
+                            drip.latency_tracker.record("video", time.monotonic() - sent_at)
+                            logger.debug(f"{channel_id}: video {video_index + 1}/{len(videos)} de la foto {photo_index + 1} enviado.")
+                            sent_media = message.video or message.document
+                            posted_now.append(video.get('file_unique_id') or (sent_media.file_unique_id if sent_media else None))
+                            video_index += 1
+                            await asyncio.sleep(drip.INTER_VIDEO_PAUSE)
+                        break
+                    except RetryAfter as e:
+                        metrics.observe("retry_after_seconds", e.retry_after)  # Para las estimaciones (drip.simulate_publish)
+                        logger.warning(f"Flood control en {channel_id}: esperando {e.retry_after + 1}s (foto {photo_index + 1}).")
+                        progress.note(f"⏳ Telegram ocupado ({channel_id}). Reintentando en {e.retry_after + 1} segundos...")
+                        await asyncio.sleep(e.retry_after + 1)
+                    except Exception as e:
+                        logger.error(f"Error publicando la foto {photo_index + 1} en {channel_id}: {e}")
+                        progress.note(f"⚠️ {channel_id}: error grave en la foto {photo_index + 1}, saltada.")
+                        break
+
+                progress.advance()
+                await asyncio.sleep(0.01)
+        finally:
+            # También si se cancela a medias: lo que ya salió cuenta como publicado
+            try:
+                db.record_media_posted([uid for uid in posted_now if uid], channel_id)
+            except Exception as e:
+                logger.error(f"No se pudo actualizar el índice de duplicados para {channel_id}: {e}")
+
+        progress.set_line(channel_id, "✅ Completado")
+    return skipped
+
+async def _publish_pack_logic(bot, pack_name: str, user_chat_id: int, status_message_id: int, task_id: str,
+                              channel_ids: list[str] | None = None, skip_duplicates: bool | None = None):
+    """
+    Publica un pack en todos los canales configurados: en paralelo entre canales y en orden
+    dentro de cada uno. El mensaje de estado muestra el progreso de cada canal.
+    """
+    channel_ids = channel_ids or channels.CHANNEL_IDS
     task_cancelled = False
+    progress = ProgressReporter(bot, user_chat_id, status_message_id, f"🚀 Publicando pack '{pack_name}'...",
+                                unit="fotos", reply_markup=_cancel_markup(task_id, "❌ Cancelar Publicación"))
+    for channel_id in channel_ids:
+        progress.set_line(channel_id, "⏳ En espera")
+
     try:
         pack_content = db.get_pack_for_sending(pack_name)
         if not pack_content:
             await bot.send_message(chat_id=user_chat_id, text=f"❌ Error: El pack '{pack_name}' está vacío o no existe.")
             return
 
-        for photo_index, item in enumerate(pack_content):
-            await bot.edit_message_text(
-                chat_id=user_chat_id,
-                message_id=status_message_id,
-                text=f"🚀 Publicando pack '{pack_name}'...\n\n"
-                     f"Progreso: Foto {photo_index + 1}/{len(pack_content)}",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar Publicación", callback_data="cancel_task")]])
-            )
-            
-            photo_sent = False
-            video_index = 0
-            for attempt in range(5):
-                try:
-                    if not photo_sent:
-                        temp_photo_path = None
-                        try:
-                            photo_file_obj = await bot.get_file(item['photo_file_id'])
-                            temp_photo_path = f"./{photo_file_obj.file_unique_id}.jpg"
-                            await photo_file_obj.download_to_drive(custom_path=temp_photo_path)
-                            with open(temp_photo_path, 'rb') as photo_to_upload:
-                                await bot.set_chat_photo(chat_id=CHANNEL_ID, photo=photo_to_upload)
-                            photo_sent = True
-                        finally:
-                            if temp_photo_path and os.path.exists(temp_photo_path):
-                                os.remove(temp_photo_path)
-                    
-                    videos = item.get('videos', [])
-                    while video_index < len(videos):
-                        video = videos[video_index]
-                        if video.get('caption', '').startswith("SUBTITLE:"):
-                            await bot.send_document(chat_id=CHANNEL_ID, document=video['file_id'], caption=video['caption'].replace("SUBTITLE:", "Subtítulo:"))
-                        else:
-                            await bot.send_video(chat_id=CHANNEL_ID, video=video['file_id'], caption=clean_caption(video.get('caption')))
-                        video_index += 1
-                        await asyncio.sleep(1.5)
-                    break
-                except RetryAfter as e:
-                    await bot.send_message(chat_id=user_chat_id, text=f"⏳ Telegram ocupado. Reintentando en {e.retry_after + 1} segundos...")
-                    await asyncio.sleep(e.retry_after + 1)
-                except Exception as e:
-                    await bot.send_message(chat_id=user_chat_id, text=f"⚠️ Ocurrió un error grave publicando un item. Saltando al siguiente.")
-                    break
-            
-            await asyncio.sleep(0.01)
-
-        await bot.send_message(chat_id=user_chat_id, text=f"✅ Publicación del pack '{pack_name}' finalizada.", reply_markup=MAIN_KEYBOARD)
+        if skip_duplicates is None:
+            skip_duplicates = _skip_duplicates()
+        progress.total = len(pack_content) * len(channel_ids)
+        progress.start()
+        results = await asyncio.gather(
+            *(_publish_to_channel(bot, channel_id, pack_content, progress, skip_duplicates) for channel_id in channel_ids),
+            return_exceptions=True
+        )
+        failed = [cid for cid, result in zip(channel_ids, results) if isinstance(result, Exception)]
+        for channel_id, result in zip(channel_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"La publicación de '{pack_name}' en {channel_id} falló: {result}")
+
+        if len(failed) < len(channel_ids):
+            db.mark_pack_published(pack_name, ADMIN_USER_ID)
+        summary = f"✅ Publicación del pack '{pack_name}' finalizada en {len(channel_ids) - len(failed)}/{len(channel_ids)} canal(es)."
+        if failed:
+            summary += f"\n❌ Fallaron: {', '.join(failed)}"
+        skipped = sum(result for result in results if isinstance(result, int))
+        if skipped:
+            summary += f"\n♻️ Videos omitidos por estar ya publicados: {skipped}"
+        await bot.send_message(chat_id=user_chat_id, text=summary, reply_markup=MAIN_KEYBOARD)
 
     except asyncio.CancelledError:
         task_cancelled = True
         await bot.send_message(chat_id=user_chat_id, text=f"🛑 Publicación del pack '{pack_name}' cancelada por el usuario.")
     
     finally:
-        if completion_callback:
-            completion_callback()
-        try:
-            final_text = f"Publicación {'cancelada' if task_cancelled else 'finalizada'}: '{pack_name}'"
-            await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=final_text)
-        except BadRequest:
-            pass
+        await progress.close(f"Publicación {'cancelada' if task_cancelled else 'finalizada'}: '{pack_name}'")
 
-async def publish_pack_job(pack_name: str, user_chat_id: int):
-    application = Application.builder().token(BOT_TOKEN).build()
-    await _publish_pack_logic(application.bot, pack_name, user_chat_id, -1, None)
+async def _warmup_pack_logic(bot, pack_name: str, user_chat_id: int, status_message_id: int):
+    try:
+        pack_content = db.get_pack_for_sending(pack_name)
+        if not pack_content:
+            await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=f"❌ El pack '{pack_name}' está vacío o no existe.")
+            return
+        report = await warmup.warm_up_pack(bot, pack_content)
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=report.to_text(pack_name))
+    except asyncio.CancelledError:
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=f"🛑 Precalentamiento de '{pack_name}' cancelado.")
+
+async def _submit_warmup(bot, pack_name: str, user_chat_id: int, priority: int):
+    task_id = task_manager.new_task_id()
+    status_message = await bot.send_message(
+        chat_id=user_chat_id,
+        text=f"🔥 Precalentando el pack '{pack_name}' (resolviendo y descargando archivos)...{_queue_notice('warmup')}",
+        reply_markup=_cancel_markup(task_id)
+    )
+    task_manager.submit(
+        "warmup",
+        lambda t: _warmup_pack_logic(bot, pack_name, user_chat_id, status_message.message_id),
+        owner_id=user_chat_id, description=f"Precalentar '{pack_name}'", priority=priority, task_id=task_id
+    )
 
-async def send_pack_now_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    _, pack_name = query.data.split(":", 1)
-    user_id = update.effective_user.id
+async def warmup_pack_job(pack_name: str, user_chat_id: int):
+    await _submit_warmup(_application.bot, pack_name, user_chat_id, PRIORITY_SCHEDULED)
 
-    if _get_task(context, user_id):
-        await query.answer("⚠️ Ya tienes otra tarea en ejecución.", show_alert=True)
-        return
+async def warmup_pack_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("Precalentamiento encolado.")
+    pack_name = context.args[0]
+    await _submit_warmup(context.bot, pack_name, update.effective_chat.id, PRIORITY_MANUAL)
+
+def _release_run(run_key: str, t):
+    # Una tarea aplazada por el apagado deja su lease caducado: el próximo líder la retoma
+    coordinator.release(run_key, done=t.status != STATUS_DEFERRED)
+
+async def _start_publish(bot, pack_name: str, user_chat_id: int, run_key: str, payload: dict, *, status_text: str,
+                         description: str, priority: int, send_status: callable = None, on_done: callable = None,
+                         skip_duplicates: bool | None = None) -> bool:
+    """
+    Toma el lease `run_key`, crea el mensaje de estado (con `send_status(texto, markup)` o un
+    mensaje nuevo) y encola la publicación. Devuelve False si otra instancia ya la tiene.
+    """
+    task_id = task_manager.new_task_id()
+    if not coordinator.claim(run_key, payload, on_lost=lambda: task_manager.cancel(task_id)):
+        logger.info(f"'{run_key}' ya la ejecuta (o la ejecutó hace poco) otra instancia.")
+        return False
+
+    def finish(t):
+        owned = run_key in coordinator.held  # Si se perdió el lease, la tarea sigue en otra instancia
+        _release_run(run_key, t)
+        if on_done and owned and t.status != STATUS_DEFERRED:
+            on_done(t)
 
-    status_message = await query.edit_message_text(
-        f"🚀 Preparando la publicación del pack '{pack_name}'...",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar Publicación", callback_data="cancel_task")]])
+    try:
+        markup = _cancel_markup(task_id, "❌ Cancelar Publicación")
+        if send_status:
+            status_message = await send_status(status_text, markup)
+        else:
+            status_message = await bot.send_message(chat_id=user_chat_id, text=status_text, reply_markup=markup)
+        task_manager.submit(
+            "publish",
+            lambda t: _publish_pack_logic(bot, pack_name, user_chat_id, status_message.message_id, t.task_id,
+                                          skip_duplicates=skip_duplicates),
+            owner_id=user_chat_id, description=description, priority=priority, task_id=task_id, on_done=finish
+        )
+    except Exception:
+        coordinator.release(run_key)
+        raise
+    return True
+
+async def publish_pack_job(pack_name: str, user_chat_id: int, run_key: str | None = None, resumed: bool = False):
+    # Los jobs anteriores a los leases no traen run_key: se usa uno por pack y ventana de 5 minutos
+    run_key = run_key or f"pack:{pack_name}:{int(time.time() // 300)}"
+    origin = "retomada" if resumed else "programada"
+    await _start_publish(
+        _application.bot, pack_name, user_chat_id, run_key,
+        {"kind": "publish", "pack_name": pack_name, "user_chat_id": user_chat_id},
+        status_text=f"🗓️ Publicación {origin} del pack '{pack_name}' en preparación...{_queue_notice('publish')}",
+        description=f"Publicar '{pack_name}' ({origin})", priority=PRIORITY_SCHEDULED,
+        # Al retomar, lo que la otra instancia ya publicó se omite por el índice de duplicados
+        skip_duplicates=True if resumed else None
     )
-    
-    def completion_callback():
-        _clear_task(context, user_id)
 
-    task = asyncio.create_task(
-        _publish_pack_logic(context.bot, pack_name, user_id, status_message.message_id, completion_callback)
+async def send_pack_now_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    pack_name = context.args[0]
+    user_id = update.effective_user.id
+
+    await _start_publish(
+        context.bot, pack_name, user_id, new_run_key("publish"),
+        {"kind": "publish", "pack_name": pack_name, "user_chat_id": user_id},
+        status_text=f"🚀 Preparando la publicación del pack '{pack_name}'...{_queue_notice('publish')}",
+        description=f"Publicar '{pack_name}'", priority=PRIORITY_MANUAL,
+        send_status=lambda text, markup: query.edit_message_text(text, reply_markup=markup)
     )
-    _store_task(context, user_id, task)
 
 # --- GESTORES CENTRALES DE MENSAJES ---
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     state = context.user_data.get('state')
-    user_id = update.effective_user.id
-    
-    if _get_task(context, user_id) and state not in ['awaiting_source_link', 'awaiting_post_count', 'awaiting_subtitle_search', 'awaiting_subtitle_search_independent']:
-        await update.message.reply_text("⏳ Hay una tarea en ejecución. Por favor, espera a que termine o cancelala.")
-        return
     
     if text == "📦 Crear Pack":
         await pack_create_start(update, context)
@@ -229,6 +626,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await subtitle_search_independent_start(update, context)
     elif text == "🚀 Activar Modo Pro":
         await start_modo_pro(update, context)
+    elif text == "🧵 Tareas":
+        await tasks_command(update, context)
     elif state == 'awaiting_pack_name':
         await pack_await_name(update, context)
     elif state in ['awaiting_subtitle_search', 'awaiting_subtitle_search_independent']:
@@ -237,6 +636,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_source_link(update, context)
     elif state == 'awaiting_post_count':
         await handle_post_count(update, context)
+    elif state == 'awaiting_merge_sources':
+        await handle_merge_sources(update, context)
+    elif state == 'awaiting_split_index':
+        await handle_split_index(update, context)
+    elif state == 'awaiting_derived_name':
+        await handle_derived_name(update, context)
     elif state in ['creating_pack', 'editing_pack']:
         await update.message.reply_text("Estoy esperando una foto o un video. Si no quieres añadir más, pulsa 'Terminar Creación/Edición'.")
 
@@ -257,14 +662,11 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('state') == 'awaiting_subtitle':
         await add_subtitle_to_photo_flow(update, context)
+    elif context.user_data.get('state') == 'awaiting_import_file':
+        await import_file_flow(update, context)
 
 # --- MODO PRO (CANCELABLE) ---
 async def start_modo_pro(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if _get_task(context, user_id):
-        await update.message.reply_text("⚠️ Ya hay una tarea del Modo Pro en ejecución. Por favor, cancelala primero o espera a que termine.")
-        return
-            
     context.user_data.clear()
     context.user_data['state'] = 'awaiting_source_link'
     await update.message.reply_text(
@@ -293,41 +695,75 @@ async def handle_post_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     start_link = context.user_data['start_link']
     user_id = update.effective_user.id
-    
-    status_message = await update.message.reply_text(
-        f"⏳ Iniciando tarea para procesar {count} bloques. Puedes cancelarla en cualquier momento.",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar Proceso", callback_data="cancel_task")]])
-    )
-    
     context.user_data.clear()
+    await _start_mission(context.bot, user_id, start_link, count, run_key=new_run_key("mission"),
+                         send_status=lambda text, markup: update.message.reply_text(text, reply_markup=markup))
     await update.message.reply_text("Volviendo al menú principal...", reply_markup=MAIN_KEYBOARD)
-    
-    def completion_callback():
-        _clear_task(context, user_id)
-
-    task = asyncio.create_task(
-        pro_mode.run_mirror_task(
-            user_chat_id=user_id,
-            start_link=start_link,
-            post_count=count,
-            bot=context.bot,
-            status_message_id=status_message.message_id,
-            completion_callback=completion_callback
+
+async def _start_mission(bot, user_id: int, start_link: str, count: int, run_key: str, resumed: bool = False,
+                         send_status: callable = None):
+    """Toma el lease de la misión, crea su mensaje de estado y la encola (ver _start_publish)."""
+    pro_mode = await _lazy_import("pro_mode")
+    task_id = task_manager.new_task_id()
+    payload = {"kind": "mission", "user_chat_id": user_id, "start_link": start_link, "post_count": count}
+    if not coordinator.claim(run_key, payload, on_lost=lambda: task_manager.cancel(task_id)):
+        return
+    source_channel_id, _ = pro_mode.parse_private_link(start_link)
+
+    def checkpoint(offset_id: int, processed: int):
+        # Al retomarla, la misión empieza en el siguiente bloque y solo procesa los que faltan
+        coordinator.checkpoint(run_key, start_link=f"https://t.me/c/{source_channel_id}/{offset_id}",
+                               post_count=count - processed)
+    try:
+        markup = _cancel_markup(task_id, "❌ Cancelar Proceso")
+        origin = "Retomando la" if resumed else "Iniciando"
+        status_text = f"⏳ {origin} tarea para procesar {count} bloques. Puedes cancelarla en cualquier momento.{_queue_notice('mission')}"
+        if send_status:
+            status_message = await send_status(status_text, markup)
+        else:
+            status_message = await bot.send_message(chat_id=user_id, text=status_text, reply_markup=markup)
+        task_manager.submit(
+            "mission",
+            lambda t: pro_mode.run_mirror_task(
+                user_chat_id=user_id,
+                start_link=start_link,
+                post_count=count,
+                bot=bot,
+                status_message_id=status_message.message_id,
+                completion_callback=None,
+                # Al retomar, lo que la otra instancia ya publicó se omite por el índice de duplicados
+                skip_duplicates=True if resumed else _skip_duplicates(),
+                status_markup=markup,
+                checkpoint=checkpoint
+            ),
+            owner_id=user_id, description=f"Modo Pro: {count} bloques desde {start_link}", task_id=task_id,
+            on_done=lambda t: _release_run(run_key, t)
         )
-    )
-    _store_task(context, user_id, task)
+    except Exception:
+        coordinator.release(run_key)
+        raise
 
 # --- MODO INMEDIATO ---
+# El handler no espera al carril: mientras espera, los demás updates del admin (incluido el
+# botón de cancelar la publicación que lo ocupa) se quedarían en cola detrás de él
+LANE_BUSY_TEXT = "⏳ Canal ocupado por otra publicación, reintenta cuando termine."
+
 async def handle_immediate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for attempt in range(3):
         try:
             await update.message.reply_text("Procesando foto (Modo Inmediato)...")
             temp_photo_path = None
             photo_file_obj = await update.message.photo[-1].get_file()
-            temp_photo_path = f"./{photo_file_obj.file_unique_id}.jpg"
+            temp_photo_path = f"./temp_{photo_file_obj.file_unique_id}.jpg"
             await photo_file_obj.download_to_drive(custom_path=temp_photo_path)
+            # Sin await entre la comprobación y el lock: si el carril está libre se toma sin esperar
+            if channels.lane_busy(CHANNEL_ID):
+                await update.message.reply_text(LANE_BUSY_TEXT)
+                os.remove(temp_photo_path)
+                return
             with open(temp_photo_path, 'rb') as photo_to_upload:
-                await context.bot.set_chat_photo(chat_id=CHANNEL_ID, photo=photo_to_upload)
+                async with channels.lane(CHANNEL_ID):
+                    await context.bot.set_chat_photo(chat_id=CHANNEL_ID, photo=photo_to_upload)
             await update.message.reply_text("✅ Foto de perfil actualizada.")
             if temp_photo_path and os.path.exists(temp_photo_path): os.remove(temp_photo_path)
             return
@@ -346,7 +782,11 @@ async def handle_immediate_video(update: Update, context: ContextTypes.DEFAULT_T
     new_caption = clean_caption(update.message.caption)
     for attempt in range(3):
         try:
-            await context.bot.copy_message(chat_id=CHANNEL_ID, from_chat_id=update.message.chat_id, message_id=update.message.message_id, caption=new_caption)
+            if channels.lane_busy(CHANNEL_ID):
+                await update.message.reply_text(LANE_BUSY_TEXT)
+                return
+            async with channels.lane(CHANNEL_ID):
+                await context.bot.copy_message(chat_id=CHANNEL_ID, from_chat_id=update.message.chat_id, message_id=update.message.message_id, caption=new_caption)
             await update.message.reply_text("✅ Video enviado al canal (Modo Inmediato).")
             return
         except RetryAfter as e:
@@ -362,7 +802,6 @@ async def handle_immediate_video(update: Update, context: ContextTypes.DEFAULT_T
 # --- MENÚS Y COMANDOS PRINCIPALES ---
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
-    _clear_task(context, update.effective_user.id)
     await update.message.reply_text("👋 ¡Hola! Soy tu asistente de contenido.", reply_markup=MAIN_KEYBOARD)
 
 async def list_packs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -386,23 +825,24 @@ async def _get_pack_list_markup(user_id: int, page: int = 0) -> tuple[str, Inlin
     end_index = start_index + packs_per_page
     packs_to_show = all_packs[start_index:end_index]
     if not all_packs:
-        return "No tienes packs creados.", InlineKeyboardMarkup([[InlineKeyboardButton("Ir al Menú Principal", callback_data="main_menu_from_empty")]])
+        return "No tienes packs creados.", InlineKeyboardMarkup([[InlineKeyboardButton("Ir al Menú Principal", callback_data=cb("main_menu"))]])
     text = "Selecciona un pack para gestionar:"
     keyboard = []
     for name in packs_to_show:
         display_name = name + (f" (🗓️ {scheduled_packs[name]})" if name in scheduled_packs else "")
-        keyboard.append([InlineKeyboardButton(display_name, callback_data=f"pack_select:{name}")])
+        keyboard.append([InlineKeyboardButton(display_name, callback_data=cb("pack_select", name))])
     pagination_row = []
-    if page > 0: pagination_row.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"pack_list_{page-1}"))
-    if end_index < len(all_packs): pagination_row.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"pack_list_{page+1}"))
+    if page > 0: pagination_row.append(InlineKeyboardButton("⬅️ Anterior", callback_data=cb("pack_list", page-1)))
+    if end_index < len(all_packs): pagination_row.append(InlineKeyboardButton("Siguiente ➡️", callback_data=cb("pack_list", page+1)))
     if pagination_row: keyboard.append(pagination_row)
-    keyboard.append([InlineKeyboardButton("⬅️ Volver al Menú", callback_data="main_menu_from_empty")])
+    keyboard.append([InlineKeyboardButton("📥 Cola de Publicación", callback_data=cb("queue_view"))])
+    keyboard.append([InlineKeyboardButton("⬅️ Volver al Menú", callback_data=cb("main_menu"))])
     return text, InlineKeyboardMarkup(keyboard)
 
 async def list_packs_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    page = int(query.data.split('_')[2])
+    page = int(context.args[0])
     text, reply_markup = await _get_pack_list_markup(user_id=ADMIN_USER_ID, page=page)
     await query.edit_message_text(text, reply_markup=reply_markup)
 
@@ -412,39 +852,172 @@ async def main_menu_from_empty_callback(update: Update, context: ContextTypes.DE
     await query.delete_message()
     await query.message.reply_text("Menú principal:", reply_markup=MAIN_KEYBOARD)
 
+def _get_pack_actions_markup(pack_name: str) -> tuple[str, InlineKeyboardMarkup]:
+    keyboard = [
+        [InlineKeyboardButton("🚀 Publicar Ahora", callback_data=cb("pack_send_now", pack_name)),
+         InlineKeyboardButton("🧪 Simular", callback_data=cb("pack_dry_run", pack_name))],
+        [InlineKeyboardButton("🗓️ Programar", callback_data=cb("schedule_start", pack_name))],
+        [InlineKeyboardButton("📥 Añadir a la Cola", callback_data=cb("pack_enqueue", pack_name))],
+        [InlineKeyboardButton("🔥 Precalentar", callback_data=cb("pack_warmup", pack_name))],
+        [InlineKeyboardButton("✏️ Editar Contenido", callback_data=cb("edit_pack_start", pack_name))],
+        [InlineKeyboardButton("🧬 Clonar", callback_data=cb("pack_clone_start", pack_name)),
+         InlineKeyboardButton("🔗 Fusionar", callback_data=cb("pack_merge_start", pack_name)),
+         InlineKeyboardButton("✂️ Dividir", callback_data=cb("pack_split_start", pack_name))],
+        [InlineKeyboardButton("🗑️ Eliminar Pack", callback_data=cb("pack_delete_confirm", pack_name))],
+        [InlineKeyboardButton("⬅️ Volver a la Lista", callback_data=cb("pack_list", 0))]]
+    text = f"Acciones para el pack: *{pack_name}*"
+    try:
+        estimate = _estimate_pack(pack_name)
+        if estimate.total_calls:
+            text += f"\n⏱️ Publicación estimada: ~{format_duration(estimate.seconds)} · {estimate.total_calls} llamadas a la API"
+    except Exception as e:
+        logger.error(f"No se pudo estimar la publicación de '{pack_name}': {e}")
+    return text, InlineKeyboardMarkup(keyboard)
+
 async def select_pack_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     context.user_data.clear()
-    _, pack_name = query.data.split(":", 1)
-    keyboard = [
-        [InlineKeyboardButton("🚀 Publicar Ahora", callback_data=f"pack_send_now:{pack_name}")],
-        [InlineKeyboardButton("🗓️ Programar", callback_data=f"schedule_start:{pack_name}")],
-        [InlineKeyboardButton("✏️ Editar Contenido", callback_data=f"edit_pack_start:{pack_name}")],
-        [InlineKeyboardButton("🗑️ Eliminar Pack", callback_data=f"pack_delete_confirm:{pack_name}")],
-        [InlineKeyboardButton("⬅️ Volver a la Lista", callback_data="pack_list_0")]]
-    await query.edit_message_text(f"Acciones para el pack: *{pack_name}*", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    pack_name = context.args[0]
+    text, reply_markup = _get_pack_actions_markup(pack_name)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def pack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/pack <nombre>: abre el menú de acciones del pack (es lo que envían los resultados inline)."""
+    pack_name = " ".join(context.args)
+    if not pack_name:
+        await update.message.reply_text(f"Uso: /pack <nombre>\nO busca escribiendo @{context.bot.username} <nombre> en cualquier chat.")
+        return
+    if db.get_pack_summary(pack_name, ADMIN_USER_ID) is None:
+        await update.message.reply_text(f"❌ No existe el pack '{pack_name}'.")
+        return
+    context.user_data.clear()
+    text, reply_markup = _get_pack_actions_markup(pack_name)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def inline_pack_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Modo inline: @bot <prefijo> lista los packs cuyo nombre empieza por ese texto."""
+    inline_query = update.inline_query
+    if inline_query.from_user.id != ADMIN_USER_ID:
+        await inline_query.answer([], cache_time=3600, is_personal=True)
+        return
+    packs = db.search_packs(ADMIN_USER_ID, inline_query.query, limit=50)
+    results = [
+        InlineQueryResultArticle(
+            id=hashlib.md5(pack["name"].encode()).hexdigest(),
+            title=pack["name"],
+            description=f"{pack['photos']} foto(s) · pulsa para abrir sus acciones",
+            input_message_content=InputTextMessageContent(f"/pack {pack['name']}"),
+        )
+        for pack in packs
+    ]
+    await inline_query.answer(results, cache_time=5, is_personal=True)
 
 async def delete_pack_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    _, pack_name = query.data.split(":", 1)
-    keyboard = [[InlineKeyboardButton(f"SÍ, ELIMINAR '{pack_name}'", callback_data=f"pack_delete_do:{pack_name}")], [InlineKeyboardButton("NO, CANCELAR", callback_data=f"pack_select:{pack_name}")]]
+    pack_name = context.args[0]
+    keyboard = [[InlineKeyboardButton(f"SÍ, ELIMINAR '{pack_name}'", callback_data=cb("pack_delete_do", pack_name))], [InlineKeyboardButton("NO, CANCELAR", callback_data=cb("pack_select", pack_name))]]
     await query.edit_message_text(f"⚠️ ¿Seguro que quieres eliminar *{pack_name}*? Esta acción es irreversible.", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def delete_pack_do_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    _, pack_name = query.data.split(":", 1)
+    pack_name = context.args[0]
     if db.delete_pack(pack_name, ADMIN_USER_ID):
+        removed_calendar_run = False
         for job in scheduler.get_jobs():
-            if job.id.startswith(f"pack:{pack_name}:"):
+            if job.id.startswith(f"pack:{pack_name}:") or job.id.startswith(f"warmup:{pack_name}:"):
                 job.remove()
+                removed_calendar_run |= job.id.startswith("pack:") and ":drip-" not in job.id
                 logger.info(f"Tarea programada para '{pack_name}' eliminada.")
+        # La cola se replanifica también si deja libre un hueco del calendario (_calendar_busy_intervals)
+        if db.remove_pack_from_queue(pack_name) or removed_calendar_run:
+            _replan_drip_queue()
         await query.answer(f"Pack '{pack_name}' eliminado.")
     else:
         await query.answer(f"❌ No se pudo eliminar.", show_alert=True)
     text, reply_markup = await _get_pack_list_markup(user_id=ADMIN_USER_ID, page=0)
     await query.edit_message_text(text, reply_markup=reply_markup)
 
+# --- CLONAR, FUSIONAR Y DIVIDIR ---
+# Se piden los datos por texto (state 'awaiting_merge_sources', 'awaiting_split_index' y, para
+# las tres, 'awaiting_derived_name'); la operación es una sola escritura en Mongo (database.py).
+
+async def pack_clone_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    pack_name = context.args[0]
+    context.user_data.clear()
+    context.user_data.update(state='awaiting_derived_name', pack_op='clone', pack_name=pack_name)
+    await query.message.reply_text(f"🧬 ¿Qué nombre le ponemos a la copia de '{pack_name}'?", reply_markup=CANCEL_KEYBOARD)
+
+async def pack_merge_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    pack_name = context.args[0]
+    context.user_data.clear()
+    context.user_data.update(state='awaiting_merge_sources', pack_op='merge', pack_name=pack_name)
+    await query.message.reply_text(
+        f"🔗 Escribe los packs que quieres unir a '{pack_name}', separados por comas y en el orden en que irán detrás de él.",
+        reply_markup=CANCEL_KEYBOARD)
+
+async def pack_split_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    pack_name = context.args[0]
+    photos = db.get_pack_summary(pack_name, ADMIN_USER_ID) or []
+    if len(photos) < 2:
+        await query.answer("El pack necesita al menos 2 fotos para dividirlo.", show_alert=True)
+        return
+    await query.answer()
+    context.user_data.clear()
+    context.user_data.update(state='awaiting_split_index', pack_op='split', pack_name=pack_name, photo_count=len(photos))
+    await query.message.reply_text(
+        f"✂️ '{pack_name}' tiene {len(photos)} fotos. ¿Desde qué foto (2-{len(photos)}) pasan al pack nuevo?",
+        reply_markup=CANCEL_KEYBOARD)
+
+async def handle_merge_sources(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    names = [name.strip() for name in update.message.text.split(",") if name.strip()]
+    pack_name = context.user_data['pack_name']
+    missing = [name for name in names if db.get_pack_summary(name, ADMIN_USER_ID) is None]
+    if not names or missing:
+        await update.message.reply_text(f"❌ No existe: {', '.join(missing)}. Vuelve a escribirlos." if missing else "Escribe al menos un pack.")
+        return
+    context.user_data['sources'] = [pack_name] + [name for name in names if name != pack_name]
+    context.user_data['state'] = 'awaiting_derived_name'
+    await update.message.reply_text(f"OK: {' + '.join(context.user_data['sources'])}. ¿Qué nombre le ponemos al pack resultante?")
+
+async def handle_split_index(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    photo_count = context.user_data['photo_count']
+    try:
+        position = int(update.message.text.strip())
+        if not 2 <= position <= photo_count:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"Escribe un número entre 2 y {photo_count}.")
+        return
+    context.user_data['split_index'] = position - 1
+    context.user_data['state'] = 'awaiting_derived_name'
+    await update.message.reply_text(f"OK, las fotos {position}-{photo_count} irán al pack nuevo. ¿Qué nombre le ponemos?")
+
+async def handle_derived_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    new_name = update.message.text.strip()
+    if not new_name:
+        await update.message.reply_text("El nombre no puede estar vacío.")
+        return
+    operation, pack_name = context.user_data['pack_op'], context.user_data['pack_name']
+    if operation == 'clone':
+        success, message = await asyncio.to_thread(db.clone_pack, pack_name, new_name, ADMIN_USER_ID)
+    elif operation == 'merge':
+        success, message = await asyncio.to_thread(db.merge_packs, context.user_data['sources'], new_name, ADMIN_USER_ID)
+    else:
+        success, message = await asyncio.to_thread(db.split_pack, pack_name, context.user_data['split_index'], new_name, ADMIN_USER_ID)
+    if not success:
+        await update.message.reply_text(f"{message} Elige otro nombre." if "Ya existe" in message else f"❌ {message}")
+        return
+    context.user_data.clear()
+    await update.message.reply_text(f"✅ {message}", reply_markup=MAIN_KEYBOARD)
+    text, reply_markup = _get_pack_actions_markup(new_name)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
 # --- FLUJO DE CREACIÓN Y EDICIÓN ---
 async def pack_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['state'] = 'awaiting_pack_name'
@@ -469,7 +1042,7 @@ async def pack_await_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def edit_pack_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name = query.data.split(":", 1)
+    pack_name = context.args[0]
     context.user_data['state'] = 'editing_pack'
     context.user_data['pack_name'] = pack_name
     context.user_data['last_photo_id'] = None 
@@ -479,23 +1052,22 @@ async def edit_pack_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.delete_message()
 
 async def _get_pack_edit_markup(pack_name: str) -> tuple[str, InlineKeyboardMarkup]:
-    pack = db.get_pack_details(pack_name, ADMIN_USER_ID)
+    photos = db.get_pack_summary(pack_name, ADMIN_USER_ID)
     text = f"Contenido actual del pack *{pack_name}*:"
     keyboard = []
-    if pack and pack.get('content'):
-        for i, photo_data in enumerate(pack['content']):
+    if photos:
+        for i, photo_data in enumerate(photos):
             photo_id_str = str(photo_data['photo_id'])
-            num_videos = len(photo_data.get('videos', []))
-            label = f"Foto {i+1} ({num_videos} adjuntos)"
-            keyboard.append([InlineKeyboardButton(label, callback_data=f"photo_manage:{pack_name}:{photo_id_str}")])
-    keyboard.append([InlineKeyboardButton("➕ Agregar Foto", callback_data=f"photo_add_start:{pack_name}")])
-    keyboard.append([InlineKeyboardButton("⬅️ Volver a Acciones", callback_data=f"pack_select:{pack_name}")])
+            label = f"Foto {i+1} ({photo_data['attachments']} adjuntos)"
+            keyboard.append([InlineKeyboardButton(label, callback_data=cb("photo_manage", pack_name, photo_id_str))])
+    keyboard.append([InlineKeyboardButton("➕ Agregar Foto", callback_data=cb("photo_add_start", pack_name))])
+    keyboard.append([InlineKeyboardButton("⬅️ Volver a Acciones", callback_data=cb("pack_select", pack_name))])
     return text, InlineKeyboardMarkup(keyboard)
 
 async def photo_add_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name = query.data.split(":", 1)
+    pack_name = context.args[0]
     context.user_data['state'] = 'editing_pack'
     context.user_data['pack_name'] = pack_name
     await query.message.reply_text(f"OK, envía la nueva foto para el pack *{pack_name}*.", reply_markup=EDITING_KEYBOARD, parse_mode="Markdown")
@@ -514,10 +1086,11 @@ async def add_photo_to_pack_flow(update: Update, context: ContextTypes.DEFAULT_T
 async def add_video_to_photo_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pack_name = context.user_data['pack_name']
     photo_id = context.user_data['last_photo_id']
-    video_file_id = update.message.video.file_id
+    video = update.message.video
     caption = update.message.caption or ""
-    if db.add_video_to_photo(pack_name, photo_id, video_file_id, caption):
-        await update.message.reply_text("📹 Video añadido.", quote=True)
+    warning = _duplicate_warning(video.file_unique_id, pack_name)
+    if db.add_video_to_photo(pack_name, photo_id, video.file_id, caption, video.file_unique_id):
+        await update.message.reply_text(f"📹 Video añadido.{warning}", quote=True)
     else:
         await update.message.reply_text("❌ Error al guardar el video.", quote=True)
 
@@ -534,45 +1107,46 @@ async def manage_photo_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     context.user_data.clear()
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     text, reply_markup = await _get_photo_manage_markup(pack_name, photo_id_str)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def _get_photo_manage_markup(pack_name: str, photo_id_str: str) -> tuple[str, InlineKeyboardMarkup]:
     text = f"Gestionando una foto del pack *{pack_name}*."
     keyboard = [
-        [InlineKeyboardButton("➕ Agregar Videos", callback_data=f"video_add_start:{pack_name}:{photo_id_str}")],
-        [InlineKeyboardButton("📜 Adjuntar Subtítulo (.srt)", callback_data=f"subtitle_add_start:{pack_name}:{photo_id_str}")],
-        [InlineKeyboardButton("🔎 Buscar Subtítulo Online", callback_data=f"subtitle_search_start:{pack_name}:{photo_id_str}")],
-        [InlineKeyboardButton("🗑️ Eliminar esta Foto", callback_data=f"photo_delete:{pack_name}:{photo_id_str}")],
-        [InlineKeyboardButton("⬅️ Volver al Pack", callback_data=f"edit_pack_start:{pack_name}")]]
+        [InlineKeyboardButton("➕ Agregar Videos", callback_data=cb("video_add_start", pack_name, photo_id_str))],
+        [InlineKeyboardButton("📜 Adjuntar Subtítulo (.srt)", callback_data=cb("subtitle_add_start", pack_name, photo_id_str))],
+        [InlineKeyboardButton("🔎 Buscar Subtítulo Online", callback_data=cb("subtitle_search_start", pack_name, photo_id_str))],
+        [InlineKeyboardButton("🗑️ Eliminar esta Foto", callback_data=cb("photo_delete", pack_name, photo_id_str))],
+        [InlineKeyboardButton("⬅️ Volver al Pack", callback_data=cb("edit_pack_start", pack_name))]]
     return text, InlineKeyboardMarkup(keyboard)
 
 async def video_add_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     context.user_data['state'] = 'awaiting_videos'
     context.user_data['pack_name'] = pack_name
     context.user_data['last_photo_id'] = ObjectId(photo_id_str)
-    keyboard = [[InlineKeyboardButton("✅ Terminé de añadir videos", callback_data=f"video_add_done:{pack_name}:{photo_id_str}")]]
+    keyboard = [[InlineKeyboardButton("✅ Terminé de añadir videos", callback_data=cb("video_add_done", pack_name, photo_id_str))]]
     await query.edit_message_text("OK. Estoy en modo de adición de videos.\n\n**Envíame todos los videos que quieras para esta foto.**\n\nCuando termines, pulsa el botón.",
                                   reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
 async def pack_add_video_in_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pack_name = context.user_data['pack_name']
     photo_id = context.user_data['last_photo_id']
-    video_file_id = update.message.video.file_id
+    video = update.message.video
     caption = update.message.caption or ""
-    if db.add_video_to_photo(pack_name, photo_id, video_file_id, caption):
-        await update.message.reply_text("📹 Video añadido.", quote=True)
+    warning = _duplicate_warning(video.file_unique_id, pack_name)
+    if db.add_video_to_photo(pack_name, photo_id, video.file_id, caption, video.file_unique_id):
+        await update.message.reply_text(f"📹 Video añadido.{warning}", quote=True)
     else:
         await update.message.reply_text("❌ Error al guardar el video.", quote=True)
 
 async def video_add_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     context.user_data.clear()
     await query.edit_message_text("✅ Videos guardados.")
     await asyncio.sleep(1)
@@ -582,12 +1156,12 @@ async def video_add_done_callback(update: Update, context: ContextTypes.DEFAULT_
 async def subtitle_add_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     context.user_data['state'] = 'awaiting_subtitle'
     context.user_data['pack_name'] = pack_name
     context.user_data['photo_id'] = photo_id_str
     await query.edit_message_text("OK. Envíame el archivo de subtítulos (.srt, .ass, etc.).",
-                                  reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar", callback_data=f"cancel_subtitle_add:{pack_name}:{photo_id_str}")]]))
+                                  reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar", callback_data=cb("cancel_subtitle_add", pack_name, photo_id_str))]]))
 
 async def add_subtitle_to_photo_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pack_name = context.user_data['pack_name']
@@ -595,7 +1169,7 @@ async def add_subtitle_to_photo_flow(update: Update, context: ContextTypes.DEFAU
     photo_id = ObjectId(photo_id_str)
     document = update.message.document
     caption = f"SUBTITLE:{document.file_name}"
-    if db.add_video_to_photo(pack_name, photo_id, document.file_id, caption):
+    if db.add_video_to_photo(pack_name, photo_id, document.file_id, caption, document.file_unique_id):
         await update.message.reply_text("📜 Subtítulo añadido.", quote=True)
     else:
         await update.message.reply_text("❌ Error al guardar el subtítulo.", quote=True)
@@ -606,7 +1180,7 @@ async def add_subtitle_to_photo_flow(update: Update, context: ContextTypes.DEFAU
 async def cancel_subtitle_add_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str = query.data.split(":", 2)
+    pack_name, photo_id_str = context.args
     context.user_data.clear()
     text, reply_markup = await _get_photo_manage_markup(pack_name, photo_id_str)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
@@ -614,7 +1188,7 @@ async def cancel_subtitle_add_callback(update: Update, context: ContextTypes.DEF
 async def subtitle_search_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     context.user_data['state'] = 'awaiting_subtitle_search'
     context.user_data['pack_name'] = pack_name
     context.user_data['photo_id'] = photo_id_str
@@ -627,28 +1201,29 @@ async def subtitle_search_independent_start(update: Update, context: ContextType
 
 async def handle_subtitle_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if _get_task(context, user_id):
-        await update.message.reply_text("⚠️ Ya tienes otra tarea en ejecución.")
-        return
-        
     query_text = update.message.text
+    # El destino se fija ahora: si la búsqueda queda en cola, user_data puede haber cambiado al ejecutarse
+    if context.user_data.get('state') == 'awaiting_subtitle_search_independent':
+        target = None
+    else:
+        target = (context.user_data['pack_name'], context.user_data['photo_id'])
+
+    task_id = task_manager.new_task_id()
     status_message = await update.message.reply_text(
-        f"🔎 Buscando subtítulos para '{query_text}'...",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar Búsqueda", callback_data="cancel_task")]])
+        f"🔎 Buscando subtítulos para '{query_text}'...{_queue_notice('search')}",
+        reply_markup=_cancel_markup(task_id, "❌ Cancelar Búsqueda")
     )
-    
-    def completion_callback():
-        _clear_task(context, user_id)
-
-    task = asyncio.create_task(
-        _search_subtitles_logic(query_text, status_message, update, context, completion_callback)
+    task_manager.submit(
+        "search",
+        lambda t: _search_subtitles_logic(query_text, status_message, target),
+        owner_id=user_id, description=f"Buscar subtítulos: '{query_text}'", task_id=task_id
     )
-    _store_task(context, user_id, task)
 
-async def _search_subtitles_logic(query_text: str, status_message, update: Update, context: ContextTypes.DEFAULT_TYPE, completion_callback: callable):
+async def _search_subtitles_logic(query_text: str, status_message, target: tuple[str, str] | None):
     task_cancelled = False
     try:
         # CORRECCIÓN: Usar asyncio.to_thread para no bloquear el bot
+        sub_api = await _lazy_import("subtitles")
         subtitles, error_msg = await asyncio.to_thread(sub_api.search_subtitles, query_text)
 
         if error_msg:
@@ -659,20 +1234,18 @@ async def _search_subtitles_logic(query_text: str, status_message, update: Updat
             return
 
         keyboard = []
-        state = context.user_data.get('state')
         for sub in subtitles[:10]:
             season = f" S{sub['season']:02d}" if sub['season'] else ""
             episode = f"E{sub['episode']:02d}" if sub['episode'] else ""
             label = f"({sub['language']}) {sub['movie_name']}{season}{episode}"
-            if state == 'awaiting_subtitle_search_independent':
-                callback_data = f"sub_download_independent:{sub['file_id']}"
+            if target is None:
+                callback_data = cb("sub_download_independent", sub['file_id'])
             else:
-                pack_name = context.user_data['pack_name']
-                photo_id_str = context.user_data['photo_id']
-                callback_data = f"sub_download_pack:{pack_name}:{photo_id_str}:{sub['file_id']}"
+                pack_name, photo_id_str = target
+                callback_data = cb("sub_download_pack", pack_name, photo_id_str, sub['file_id'])
             keyboard.append([InlineKeyboardButton(label, callback_data=callback_data)])
         
-        keyboard.append([InlineKeyboardButton("❌ Cancelar Búsqueda", callback_data="cancel_subtitle_search")])
+        keyboard.append([InlineKeyboardButton("❌ Cancelar Búsqueda", callback_data=cb("cancel_subtitle_search"))])
         await status_message.edit_text("Resultados encontrados. Selecciona uno:", reply_markup=InlineKeyboardMarkup(keyboard))
 
     except asyncio.CancelledError:
@@ -680,8 +1253,6 @@ async def _search_subtitles_logic(query_text: str, status_message, update: Updat
         await status_message.edit_text("🛑 Búsqueda de subtítulos cancelada.")
     
     finally:
-        if completion_callback:
-            completion_callback()
         if task_cancelled:
             try:
                 await status_message.edit_text("🛑 Búsqueda cancelada.")
@@ -692,14 +1263,15 @@ async def _search_subtitles_logic(query_text: str, status_message, update: Updat
 async def subtitle_download_independent_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, api_file_id_str = query.data.split(':')
+    api_file_id_str = context.args[0]
     api_file_id = int(api_file_id_str)
     await query.edit_message_text("📥 Descargando subtítulo...")
-    download_link, error_msg = sub_api.request_download_link(api_file_id)
+    sub_api = await _lazy_import("subtitles")
+    download_link, error_msg = await asyncio.to_thread(sub_api.request_download_link, api_file_id)
     if error_msg:
         await query.edit_message_text(f"❌ Error: {error_msg}")
         return
-    subtitle_content, error_msg = sub_api.download_subtitle_content(download_link)
+    subtitle_content, error_msg = await asyncio.to_thread(sub_api.download_subtitle_content, download_link)
     if error_msg:
         await query.edit_message_text(f"❌ Error: {error_msg}")
         return
@@ -712,14 +1284,15 @@ async def subtitle_download_independent_callback(update: Update, context: Contex
 async def subtitle_download_pack_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name, photo_id_str, api_file_id_str = query.data.split(':')
+    pack_name, photo_id_str, api_file_id_str = context.args
     api_file_id = int(api_file_id_str)
     await query.edit_message_text("📥 Descargando y añadiendo al pack...")
-    download_link, error_msg = sub_api.request_download_link(api_file_id)
+    sub_api = await _lazy_import("subtitles")
+    download_link, error_msg = await asyncio.to_thread(sub_api.request_download_link, api_file_id)
     if error_msg:
         await query.edit_message_text(f"❌ Error: {error_msg}")
         return
-    subtitle_content, error_msg = sub_api.download_subtitle_content(download_link)
+    subtitle_content, error_msg = await asyncio.to_thread(sub_api.download_subtitle_content, download_link)
     if error_msg:
         await query.edit_message_text(f"❌ Error: {error_msg}")
         return
@@ -728,7 +1301,7 @@ async def subtitle_download_pack_callback(update: Update, context: ContextTypes.
     telegram_file_id = sent_doc.document.file_id
     photo_id = ObjectId(photo_id_str)
     caption = f"SUBTITLE:{file_name}"
-    if db.add_video_to_photo(pack_name, photo_id, telegram_file_id, caption):
+    if db.add_video_to_photo(pack_name, photo_id, telegram_file_id, caption, sent_doc.document.file_unique_id):
         await query.edit_message_text("✅ ¡Subtítulo descargado y añadido al pack!")
     else:
         await query.edit_message_text("❌ Error al guardar el subtítulo en la base de datos.")
@@ -747,7 +1320,7 @@ async def cancel_subtitle_search_callback(update: Update, context: ContextTypes.
 async def delete_photo_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer("Eliminando foto...")
-    _, pack_name, photo_id_str = query.data.split(':', 2)
+    pack_name, photo_id_str = context.args
     db.delete_photo_from_pack(pack_name, photo_id_str)
     text, reply_markup = await _get_pack_edit_markup(pack_name)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
@@ -756,27 +1329,29 @@ async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
 
 async def create_calendar(year, month, pack_name):
+    import calendar
+    from dateutil.relativedelta import relativedelta
     markup = []
-    markup.append([InlineKeyboardButton(f"{datetime(year, month, 1).strftime('%B %Y')}", callback_data="noop")])
-    markup.append([InlineKeyboardButton(day, callback_data="noop") for day in ["Lu", "Ma", "Mi", "Ju", "Vi", "Sa", "Do"]])
+    markup.append([InlineKeyboardButton(f"{datetime(year, month, 1).strftime('%B %Y')}", callback_data=cb("noop"))])
+    markup.append([InlineKeyboardButton(day, callback_data=cb("noop")) for day in ["Lu", "Ma", "Mi", "Ju", "Vi", "Sa", "Do"]])
     my_calendar = calendar.monthcalendar(year, month)
     for week in my_calendar:
         row = []
         for day in week:
-            if day == 0: row.append(InlineKeyboardButton(" ", callback_data="noop"))
-            else: row.append(InlineKeyboardButton(str(day), callback_data=f"cal_day:{year}:{month}:{day}"))
+            if day == 0: row.append(InlineKeyboardButton(" ", callback_data=cb("noop")))
+            else: row.append(InlineKeyboardButton(str(day), callback_data=cb("cal_day", year, month, day)))
         markup.append(row)
     prev_month = datetime(year, month, 1) - relativedelta(months=1)
     next_month = datetime(year, month, 1) + relativedelta(months=1)
-    markup.append([InlineKeyboardButton("<<", callback_data=f"cal_nav:{prev_month.year}:{prev_month.month}"),
-                   InlineKeyboardButton("Cancelar", callback_data=f"cal_cancel:{pack_name}"),
-                   InlineKeyboardButton(">>", callback_data=f"cal_nav:{next_month.year}:{next_month.month}")])
+    markup.append([InlineKeyboardButton("<<", callback_data=cb("cal_nav", prev_month.year, prev_month.month)),
+                   InlineKeyboardButton("Cancelar", callback_data=cb("cal_cancel", pack_name)),
+                   InlineKeyboardButton(">>", callback_data=cb("cal_nav", next_month.year, next_month.month))])
     return InlineKeyboardMarkup(markup)
 
 async def schedule_pack_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name = query.data.split(":", 1)
+    pack_name = context.args[0]
     context.user_data['state'] = 'scheduling'
     context.user_data['pack_to_schedule'] = pack_name
     now = datetime.now(TIMEZONE)
@@ -786,7 +1361,7 @@ async def schedule_pack_start(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def calendar_nav_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, year, month = query.data.split(":")
+    year, month = context.args
     pack_name = context.user_data.get('pack_to_schedule', 'este pack')
     await query.edit_message_text(f"🗓️ Programando pack *{pack_name}*.\n\nPor favor, selecciona una fecha:",
                                   reply_markup=await create_calendar(int(year), int(month), pack_name), parse_mode='Markdown')
@@ -794,26 +1369,26 @@ async def calendar_nav_callback(update: Update, context: ContextTypes.DEFAULT_TY
 async def calendar_day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, year, month, day = query.data.split(":")
+    year, month, day = context.args
     context.user_data['schedule_date'] = {'year': int(year), 'month': int(month), 'day': int(day)}
-    keyboard = [[InlineKeyboardButton(f"{h:02d}", callback_data=f"cal_hour:{h}") for h in range(start, start + 6)] for start in range(0, 24, 6)]
-    keyboard.append([InlineKeyboardButton("⬅️ Volver al Calendario", callback_data=f"schedule_start:{context.user_data['pack_to_schedule']}")])
+    keyboard = [[InlineKeyboardButton(f"{h:02d}", callback_data=cb("cal_hour", h)) for h in range(start, start + 6)] for start in range(0, 24, 6)]
+    keyboard.append([InlineKeyboardButton("⬅️ Volver al Calendario", callback_data=cb("schedule_start", context.user_data['pack_to_schedule']))])
     await query.edit_message_text(f"Fecha seleccionada: {day}/{month}/{year}.\n\nAhora, selecciona la hora:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def time_hour_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, hour = query.data.split(":")
+    hour = context.args[0]
     context.user_data['schedule_date']['hour'] = int(hour)
-    keyboard = [[InlineKeyboardButton(f"{m:02d}", callback_data=f"cal_min:{m}") for m in [0, 15, 30, 45]]]
+    keyboard = [[InlineKeyboardButton(f"{m:02d}", callback_data=cb("cal_min", m)) for m in [0, 15, 30, 45]]]
     date_info = context.user_data['schedule_date']
-    keyboard.append([InlineKeyboardButton("⬅️ Volver a Horas", callback_data=f"cal_day:{date_info['year']}:{date_info['month']}:{date_info['day']}")])
+    keyboard.append([InlineKeyboardButton("⬅️ Volver a Horas", callback_data=cb("cal_day", date_info['year'], date_info['month'], date_info['day']))])
     await query.edit_message_text(f"Hora seleccionada: {hour}:XX. \n\nAhora, selecciona los minutos:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def time_minute_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, minute = query.data.split(":")
+    minute = context.args[0]
     date_info = context.user_data['schedule_date']
     date_info['minute'] = int(minute)
     pack_name = context.user_data['pack_to_schedule']
@@ -821,12 +1396,24 @@ async def time_minute_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         local_dt = TIMEZONE.localize(datetime(year=date_info['year'], month=date_info['month'], day=date_info['day'], hour=date_info['hour'], minute=date_info['minute']))
         if local_dt < datetime.now(TIMEZONE):
             await query.edit_message_text("❌ Esa fecha y hora ya han pasado. Por favor, empieza de nuevo.",
-                                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Reintentar", callback_data=f"schedule_start:{pack_name}")]]))
+                                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Reintentar", callback_data=cb("schedule_start", pack_name))]]))
             return
+        estimate = _estimate_pack(pack_name)
+        collisions = _collision_lines(local_dt, estimate.seconds)
         job_id = f"pack:{pack_name}:{local_dt.timestamp()}"
         job_kwargs = {'pack_name': pack_name, 'user_chat_id': update.effective_chat.id}
-        scheduler.add_job(publish_pack_job, trigger='date', run_date=local_dt, id=job_id, name=f"Publish {pack_name}", kwargs=job_kwargs, replace_existing=True)
-        await query.edit_message_text(f"✅ Pack *{pack_name}* programado para el *{local_dt.strftime('%d/%m/%Y a las %H:%M')}*.", parse_mode='Markdown')
+        # run_key: el lease de esta ejecución, para que no se publique dos veces con dos instancias
+        scheduler.add_job(publish_pack_job, trigger='date', run_date=local_dt, id=job_id, name=f"Publish {pack_name}",
+                          kwargs={**job_kwargs, 'run_key': job_id}, replace_existing=True)
+        # Precalentamiento automático unos minutos antes para que la publicación arranque con todo descargado
+        warmup_dt = local_dt - timedelta(minutes=WARMUP_MINUTES)
+        if warmup_dt > datetime.now(TIMEZONE):
+            scheduler.add_job(warmup_pack_job, trigger='date', run_date=warmup_dt, id=f"warmup:{pack_name}:{local_dt.timestamp()}",
+                              name=f"Warmup {pack_name}", kwargs=job_kwargs, replace_existing=True)
+        # Las entradas de la cola ya planificadas no deben solaparse con esta publicación
+        _replan_drip_queue()
+        await query.edit_message_text(f"✅ Pack '{pack_name}' programado para el {local_dt.strftime('%d/%m/%Y a las %H:%M')}.\n\n"
+                                      + _estimate_text(estimate, local_dt) + "".join(f"\n{line}" for line in collisions))
     except Exception as e:
         await query.edit_message_text(f"❌ Error al programar la tarea: {e}")
     finally:
@@ -836,24 +1423,614 @@ async def time_minute_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 async def calendar_cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, pack_name = query.data.split(":", 1)
+    pack_name = context.args[0]
     context.user_data.clear()
     await query.edit_message_text("Programación cancelada.")
     await select_pack_callback(update, context)
 
-# --- FUNCIÓN PRINCIPAL Y ARRANQUE ---
-def main() -> None:
+# --- COLA DE PUBLICACIÓN (DRIP) ---
+def _drip_settings() -> tuple[datetime, timedelta]:
+    start_at = db.get_setting("drip_start_at") or datetime.now(TIMEZONE)
+    spacing = timedelta(minutes=db.get_setting("drip_spacing_minutes", DRIP_SPACING_MINUTES))
+    return start_at, spacing
+
+def _estimate_pack(pack_name: str) -> "drip.PublishEstimate":
+    """Estimación de la publicación a partir de los conteos del pack (sin cargar su contenido)."""
+    photos = db.get_pack_summary(pack_name, ADMIN_USER_ID) or []
+    return drip.estimate_from_counts(len(photos), sum(p['attachments'] for p in photos), len(channels.CHANNEL_IDS))
+
+def _estimate_pack_seconds(pack_name: str) -> float:
+    return _estimate_pack(pack_name).seconds
+
+def _calendar_busy_intervals() -> list[tuple[datetime, datetime]]:
+    """Publicaciones programadas desde el calendario (fuera de la cola) con su duración estimada."""
+    busy = []
+    for job in scheduler.get_jobs():
+        if job.id.startswith("pack:") and ":drip-" not in job.id and job.next_run_time:
+            duration = timedelta(seconds=_estimate_pack_seconds(job.kwargs.get('pack_name', '')))
+            busy.append((job.next_run_time, job.next_run_time + duration))
+    return busy
+
+def _drip_job_ids(entry: dict) -> tuple[str, str]:
+    return f"pack:{entry['pack_name']}:drip-{entry['_id']}", f"warmup:{entry['pack_name']}:drip-{entry['_id']}"
+
+def _replan_drip_queue() -> list:
+    """Recalcula los huecos de todas las entradas pendientes y reprograma sus jobs."""
+    from apscheduler.jobstores.base import JobLookupError
+    start_at, spacing = _drip_settings()
+    now = datetime.now(TIMEZONE)
+    plan = drip.plan_slots(db.list_publish_queue(), start_at, spacing,
+                           lambda entry: _estimate_pack_seconds(entry['pack_name']), now, _calendar_busy_intervals())
+    for entry, start, end in plan:
+        db.update_queue_entry(entry['_id'], planned_start=start, planned_end=end)
+        publish_job_id, warmup_job_id = _drip_job_ids(entry)
+        scheduler.add_job(drip_publish_job, trigger='date', run_date=start, id=publish_job_id,
+                          name=f"Drip {entry['pack_name']}", kwargs={'entry_id': str(entry['_id'])}, replace_existing=True)
+        warmup_dt = start - timedelta(minutes=WARMUP_MINUTES)
+        if warmup_dt > now:
+            scheduler.add_job(warmup_pack_job, trigger='date', run_date=warmup_dt, id=warmup_job_id, name=f"Warmup {entry['pack_name']}",
+                              kwargs={'pack_name': entry['pack_name'], 'user_chat_id': entry['user_chat_id']}, replace_existing=True)
+        else:
+            try:
+                scheduler.remove_job(warmup_job_id)
+            except JobLookupError:
+                pass
+    return plan
+
+def _finish_drip_entry(entry_id):
+    db.update_queue_entry(entry_id, status='done', finished_at=datetime.now(timezone.utc))
+    _replan_drip_queue()
+
+def _drip_run_key(entry_id) -> str:
+    return f"drip:{entry_id}"
+
+async def drip_publish_job(entry_id: str, resumed: bool = False):
+    entry = db.get_queue_entry(entry_id)
+    if not entry or entry['status'] != 'pending' or db.list_publish_queue(statuses=("running",)):
+        if entry and entry['status'] == 'pending':
+            # La ejecución anterior va con retraso: al terminar se replanificará esta entrada
+            logger.info(f"Entrada de cola {entry_id} aplazada: hay otra publicación de la cola en curso.")
+        if resumed:
+            # Sigue 'pending': la cola la replanificará y su job debe poder tomar el lease enseguida
+            coordinator.release(_drip_run_key(entry_id), keep_seconds=0)
+        return
+
+    # Solo una ejecución pasa la entrada de 'pending' a 'running'; la que lo consigue es la
+    # responsable de devolverla a 'pending' si no llega a arrancar la publicación
+    if not db.update_queue_entry(entry_id, expected_status='pending', status='running', started_at=datetime.now(timezone.utc)):
+        logger.info(f"Entrada de cola {entry_id}: ya la ha tomado otra ejecución.")
+        if resumed:
+            coordinator.release(_drip_run_key(entry_id), keep_seconds=0)
+        return
+    origin = "retomada" if resumed else "en cola"
     try:
-        db.setup_database()
-        scheduler.start()
-        logger.info("Base de datos y Scheduler iniciados correctamente.")
+        started = await _start_publish(
+            _application.bot, entry['pack_name'], entry['user_chat_id'], _drip_run_key(entry_id),
+            {"kind": "drip", "entry_id": str(entry_id)},
+            status_text=f"📥 Publicación {origin} del pack '{entry['pack_name']}' en preparación...{_queue_notice('publish')}",
+            description=f"Publicar '{entry['pack_name']}' ({origin})", priority=PRIORITY_SCHEDULED,
+            on_done=lambda t: _finish_drip_entry(entry_id), skip_duplicates=True if resumed else None
+        )
     except Exception as e:
-        logger.critical(f"FATAL: Error al iniciar: {e}")
+        # Si siguiera 'running', todas las entradas posteriores se aplazarían para siempre
+        logger.exception(f"Entrada de cola {entry_id}: no se pudo iniciar la publicación: {e}")
+        db.update_queue_entry(entry_id, expected_status='running', status='failed', finished_at=datetime.now(timezone.utc))
+        _replan_drip_queue()
+        return
+    if not started:
+        logger.info(f"Entrada de cola {entry_id}: la publica otra instancia.")
+        db.update_queue_entry(entry_id, expected_status='running', status='pending')
+        _replan_drip_queue()
+
+def _get_drip_queue_markup() -> tuple[str, InlineKeyboardMarkup]:
+    start_at, spacing = _drip_settings()
+    entries = db.list_publish_queue()
+    lines = []
+    keyboard = []
+    for position, entry in enumerate(entries, start=1):
+        if entry['status'] == 'running':
+            lines.append(f"{position}. ▶️ {entry['pack_name']} (publicándose)")
+            continue
+        slot = "sin planificar"
+        if entry.get('planned_start'):
+            start = entry['planned_start'].astimezone(TIMEZONE)
+            minutes = (entry['planned_end'] - entry['planned_start']).total_seconds() / 60
+            slot = f"{start.strftime('%d/%m %H:%M')} (~{minutes:.0f} min)"
+        lines.append(f"{position}. {entry['pack_name']} — {slot}")
+        keyboard.append([InlineKeyboardButton(f"🗑️ Quitar {entry['pack_name']}", callback_data=cb("queue_remove", entry['_id']))])
+    text = (f"📥 Cola de publicación\n"
+            f"Inicio: {start_at.astimezone(TIMEZONE).strftime('%d/%m/%Y %H:%M')} · Espaciado mínimo: {spacing.total_seconds() / 60:.0f} min\n\n"
+            + ("\n".join(lines) if lines else "La cola está vacía.")
+            + "\n\nConfigura con /cola_inicio DD/MM/AAAA HH:MM y /cola_espaciado MINUTOS.")
+    keyboard.append([InlineKeyboardButton("🔄 Actualizar", callback_data=cb("queue_view"))])
+    keyboard.append([InlineKeyboardButton("⬅️ Volver a la Lista", callback_data=cb("pack_list", 0))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text, reply_markup = _get_drip_queue_markup()
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def queue_view_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    text, reply_markup = _get_drip_queue_markup()
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest:
+        pass
+
+async def pack_enqueue_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    pack_name = context.args[0]
+    entry_id = db.enqueue_pack(pack_name, ADMIN_USER_ID, update.effective_chat.id)
+    plan = _replan_drip_queue()
+    slot = next(((start, end) for entry, start, end in plan if entry['_id'] == entry_id), None)
+    if slot:
+        await query.answer(f"Añadido a la cola. Hueco previsto: {slot[0].astimezone(TIMEZONE).strftime('%d/%m %H:%M')}", show_alert=True)
+    else:
+        await query.answer("Añadido a la cola.", show_alert=True)
+    text, reply_markup = _get_drip_queue_markup()
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def queue_remove_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from apscheduler.jobstores.base import JobLookupError
+    query = update.callback_query
+    entry_id = context.args[0]
+    entry = db.get_queue_entry(entry_id)
+    if entry and db.remove_queue_entry(entry_id):
+        for job_id in _drip_job_ids(entry):
+            try:
+                scheduler.remove_job(job_id)
+            except JobLookupError:
+                pass
+        _replan_drip_queue()
+        await query.answer("Quitado de la cola.")
+    else:
+        await query.answer("No se pudo quitar (¿ya se está publicando?).", show_alert=True)
+    text, reply_markup = _get_drip_queue_markup()
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def queue_start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        local_dt = TIMEZONE.localize(datetime.strptime(" ".join(context.args), "%d/%m/%Y %H:%M"))
+    except ValueError:
+        await update.message.reply_text("Uso: /cola_inicio DD/MM/AAAA HH:MM")
+        return
+    db.set_setting("drip_start_at", local_dt)
+    _replan_drip_queue()
+    text, reply_markup = _get_drip_queue_markup()
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def queue_spacing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        minutes = int(context.args[0])
+        if minutes < 0: raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text("Uso: /cola_espaciado MINUTOS")
+        return
+    db.set_setting("drip_spacing_minutes", minutes)
+    _replan_drip_queue()
+    text, reply_markup = _get_drip_queue_markup()
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# --- MÉTRICAS ---
+def _metrics_gauges() -> list:
+    """Valores instantáneos que se exportan junto al resto de métricas en /metrics."""
+    gauges = []
+    for kind in TASK_KIND_LABELS:
+        gauges.append(("tasks_queued", {"kind": kind}, task_manager.queued_count(kind)))
+        gauges.append(("tasks_running", {"kind": kind}, task_manager.running_count(kind)))
+    for key, value in db.get_pool_stats().items():
+        gauges.append((f"mongo_pool_{key}", {}, value))
+    gauges.append(("photo_cache_bytes", {}, warmup.photo_cache.size_bytes))
+    gauges.extend(coordinator.gauges())
+    return gauges
+
+metrics.register_gauges(_metrics_gauges)
+
+def _format_histograms(name: str, label: str, title: str, limit: int = 8) -> str:
+    rows = sorted(metrics.histograms(name).items(), key=lambda item: item[1].count, reverse=True)
+    if not rows:
+        return f"{title}: sin datos"
+    lines = [f"{title}:"]
+    for labels, hist in rows[:limit]:
+        label_value = dict(labels).get(label, "?")
+        lines.append(f"  • {label_value}: n={hist.count} p50={hist.quantile(0.5) * 1000:.0f}ms "
+                     f"p99={hist.quantile(0.99) * 1000:.0f}ms max={hist.max * 1000:.0f}ms")
+    return "\n".join(lines)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Resumen de las métricas del proceso (lo mismo que /metrics, legible desde Telegram)."""
+    retry_after = {}
+    for labels, value in metrics.counters("retry_after_total").items():
+        source = dict(labels).get("source", "?")
+        retry_after[source] = retry_after.get(source, 0) + value
+    api_errors = sum(metrics.counters("bot_api_errors_total").values())
+
+    cache_lines = []
+    cache_results = {}
+    for labels, value in metrics.counters("cache_requests_total").items():
+        labels = dict(labels)
+        cache_results.setdefault(labels["cache"], {})[labels["result"]] = value
+    for cache, results in sorted(cache_results.items()):
+        total = results.get("hit", 0) + results.get("miss", 0)
+        cache_lines.append(f"  • {cache}: {results.get('hit', 0) / total:.0%} aciertos de {total:.0f}")
+
+    pool = db.get_pool_stats()
+    queues = ", ".join(f"{TASK_KIND_LABELS[k]} {task_manager.running_count(k)}/{task_manager.queued_count(k)}" for k in TASK_KIND_LABELS)
+    sections = [
+        "📊 Estadísticas del bot",
+        _format_histograms("handler_seconds", "handler", "Handlers"),
+        _format_histograms("bot_api_seconds", "method", "Bot API"),
+        _format_histograms("db_call_seconds", "function", "MongoDB"),
+        _format_histograms("subtitle_api_seconds", "function", "API de subtítulos"),
+        f"Errores de la Bot API: {api_errors:.0f}\n"
+        f"Esperas por límite: " + (", ".join(f"{k} {v:.0f}" for k, v in retry_after.items()) or "ninguna"),
+        f"Tareas (en curso/en cola): {queues}",
+        "Caches:\n" + ("\n".join(cache_lines) or "  sin datos") +
+        f"\n  • fotos precalentadas: {warmup.photo_cache.size_bytes / 1024 / 1024:.1f} MB",
+        f"Pool de Mongo: {pool['open_connections']} abiertas, {pool['checked_out']} en uso (máx. {pool['max_pool_size']}), "
+        f"{pool['checkout_failures']} fallos",
+    ]
+    text = "\n\n".join(sections)
+    for i in range(0, len(text), 4000):
+        await update.message.reply_text(text[i:i + 4000])
+
+async def _profile_logic(bot, mode: str, seconds: int, top: int, user_chat_id: int, status_message_id: int):
+    profiling = await _lazy_import("profiling")
+    try:
+        file_name, report = await profiling.capture(mode, seconds, top)
+    except asyncio.CancelledError:
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text="🛑 Captura de perfil cancelada.")
+        return
+    await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=f"✅ Perfil '{mode}' de {seconds}s capturado.")
+    await bot.send_document(chat_id=ADMIN_USER_ID, document=report, filename=file_name, caption=f"Perfil {mode} ({seconds}s, top {top})")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perfil <cpu|mem|all> <segundos> [top]: perfila el bot con el tráfico real y envía el informe."""
+    usage = "Uso: /perfil <cpu|mem|all> <segundos> [top]\nEj: /perfil cpu 30 40"
+    args = context.args
+    if len(args) < 2 or args[0] not in ("cpu", "mem", "all") or not args[1].isdigit() or (len(args) > 2 and not args[2].isdigit()):
+        await update.message.reply_text(usage)
+        return
+    mode, seconds = args[0], min(int(args[1]), 300)
+    top = int(args[2]) if len(args) > 2 else 30
+
+    # Se ejecuta como tarea en segundo plano: si la captura bloqueara el handler, los updates
+    # del admin quedarían serializados detrás de ella y no aparecerían en el perfil
+    task_id = task_manager.new_task_id()
+    status_message = await update.message.reply_text(
+        f"🔬 Capturando perfil '{mode}' durante {seconds}s...{_queue_notice('profile')}",
+        reply_markup=_cancel_markup(task_id)
+    )
+    task_manager.submit(
+        "profile",
+        lambda t: _profile_logic(context.bot, mode, seconds, top, update.effective_chat.id, status_message.message_id),
+        owner_id=update.effective_user.id, description=f"Perfil {mode} de {seconds}s", task_id=task_id
+    )
+
+# --- SIMULACIÓN DE PUBLICACIÓN ---
+def _simulate_pack(pack_content: list, channel_ids: list[str] | None = None,
+                   broken_file_ids: set[str] = frozenset()) -> "drip.PublishEstimate":
+    """
+    Estimación de _publish_pack_logic con el estado actual (cache, rotos, duplicados) sin llamar
+    a la API. Carga el pack entero: solo para 🧪 Simular; el resto usa _estimate_pack.
+    `broken_file_ids` son los rotos que ha encontrado la simulación, además de los ya marcados.
+    """
+    channel_ids = channel_ids or channels.CHANNEL_IDS
+    posted_by_channel = None
+    if _skip_duplicates():
+        media = db.find_media_many([v.get('file_unique_id') for item in pack_content for v in item.get('videos', [])])
+        posted_by_channel = {channel_id: {uid for uid, entry in media.items() if channel_id in entry["posted"]}
+                             for channel_id in channel_ids}
+
+    def is_broken(file_id: str) -> bool:
+        return file_id in broken_file_ids or bool(warmup.photo_cache.broken_reason(file_id))
+
+    return drip.simulate_publish(pack_content, channel_ids, is_broken=is_broken,
+                                 is_cached=warmup.photo_cache.has, posted_by_channel=posted_by_channel)
+
+def _scheduled_runs() -> list[tuple[str, datetime, datetime]]:
+    """Publicaciones ya previstas (calendario y cola) como (pack, inicio, fin estimado)."""
+    runs = []
+    for job in scheduler.get_jobs():
+        if job.id.startswith("pack:") and ":drip-" not in job.id and job.next_run_time:
+            name = job.kwargs.get('pack_name', '')
+            runs.append((name, job.next_run_time, job.next_run_time + timedelta(seconds=_estimate_pack_seconds(name))))
+    for entry in db.list_publish_queue():
+        if entry.get('planned_start') and entry.get('planned_end'):
+            runs.append((entry['pack_name'], entry['planned_start'], entry['planned_end']))
+    return runs
+
+def _collision_lines(start: datetime, seconds: float) -> list[str]:
+    end = start + timedelta(seconds=seconds)
+    return [f"⚠️ Coincide con '{name}' ({run_start.astimezone(TIMEZONE).strftime('%d/%m %H:%M')}–"
+            f"{run_end.astimezone(TIMEZONE).strftime('%H:%M')})"
+            for name, run_start, run_end in _scheduled_runs() if run_start < end and start < run_end]
+
+def _estimate_text(estimate: "drip.PublishEstimate", start: datetime) -> str:
+    end = start + timedelta(seconds=estimate.seconds)
+    lines = [f"⏱️ Duración estimada: ~{format_duration(estimate.seconds)} (terminaría hacia las {end.astimezone(TIMEZONE).strftime('%H:%M')})",
+             f"📡 Llamadas a la API: {estimate.total_calls} ("
+             + ", ".join(f"{method} {count}" for method, count in estimate.calls.most_common()) + ")"]
+    if estimate.retry_seconds >= 1:
+        lines.append(f"⏳ Incluye ~{format_duration(estimate.retry_seconds)} de esperas por RetryAfter, según las medidas")
+    if not estimate.measured:
+        lines.append("ℹ️ Aún no hay latencias medidas: se usan los valores por defecto.")
+    return "\n".join(lines)
+
+async def _dry_run_logic(bot, pack_name: str, user_chat_id: int, status_message_id: int):
+    """Simula la publicación: valida los file_ids con getFile (sin descargar ni enviar) y estima su duración."""
+    try:
+        pack_content = db.get_pack_for_sending(pack_name)
+        if not pack_content:
+            await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=f"❌ El pack '{pack_name}' está vacío o no existe.")
+            return
+        report = await warmup.warm_up_pack(bot, pack_content, download_photos=False, mark_broken=False)
+        estimate = _simulate_pack(pack_content, broken_file_ids=report.broken_file_ids)
+        now = datetime.now(TIMEZONE)
+        lines = [f"🧪 Simulación de la publicación de '{pack_name}' en {len(channels.CHANNEL_IDS)} canal(es), sin enviar nada.",
+                 f"✅ Archivos válidos: {report.files_checked - len(report.broken)}/{report.files_checked}",
+                 f"🖼️ Fotos a enviar: {estimate.photos} · 📹 Videos/subtítulos: {estimate.videos}"]
+        if estimate.skipped_posted:
+            lines.append(f"♻️ Se omitirían {estimate.skipped_posted} videos ya publicados")
+        lines.append(_estimate_text(estimate, now))
+        lines += _collision_lines(now, estimate.seconds)
+        for photo_number, kind, reason in report.broken[:10]:
+            lines.append(f"  • Foto {photo_number} ({kind}) rota, se saltaría: {reason}")
+        if len(report.broken) > 10:
+            lines.append(f"  • ... y {len(report.broken) - 10} más")
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text="\n".join(lines)[:4096],
+                                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Volver al Pack", callback_data=cb("pack_select", pack_name))]]))
+    except asyncio.CancelledError:
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=f"🛑 Simulación de '{pack_name}' cancelada.")
+
+async def pack_dry_run_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    pack_name = context.args[0]
+    task_id = task_manager.new_task_id()
+    await query.edit_message_text(f"🧪 Simulando la publicación de '{pack_name}' (comprobando archivos)...{_queue_notice('warmup')}",
+                                  reply_markup=_cancel_markup(task_id))
+    task_manager.submit(
+        "warmup",
+        lambda t: _dry_run_logic(context.bot, pack_name, update.effective_chat.id, query.message.message_id),
+        owner_id=update.effective_user.id, description=f"Simular '{pack_name}'", task_id=task_id
+    )
+
+# --- ARCHIVO DE PACKS ---
+def _packs_in_use() -> set[str]:
+    """Packs con una publicación o precalentamiento programados o en la cola: no se archivan."""
+    names = {entry['pack_name'] for entry in db.list_publish_queue()}
+    for job in scheduler.get_jobs():
+        if job.id.startswith(("pack:", "warmup:")):
+            names.add(job.id.split(":", 2)[1])
+    return names
+
+async def archive_sweep_job():
+    """Mueve al archivo, por lotes, los packs publicados hace más de PACK_ARCHIVE_DAYS."""
+    older_than = timedelta(days=PACK_ARCHIVE_DAYS)
+    exclude = await asyncio.to_thread(_packs_in_use)
+    total = 0
+    conflicts = set()
+    while True:
+        archived, clashing = await asyncio.to_thread(db.archive_stale_packs, older_than, exclude | conflicts)
+        conflicts.update(clashing)
+        if not archived and not clashing:
+            break
+        total += len(archived)
+        metrics.inc("packs_archived_total", len(archived))
+    if conflicts:
+        logger.warning(f"No se archivan {len(conflicts)} pack(s) porque ya hay uno archivado con el mismo nombre: "
+                       f"{', '.join(sorted(conflicts))}.")
+    if total:
+        logger.info(f"{total} pack(s) publicados hace más de {PACK_ARCHIVE_DAYS:g} días movidos al archivo.")
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/archivo [texto]: lista los packs archivados (o los que empiezan por el texto) para restaurarlos."""
+    text = " ".join(context.args)
+    packs = db.list_archived_packs(ADMIN_USER_ID, text)
+    if not packs:
+        await update.message.reply_text("No hay packs archivados" + (f" que empiecen por '{text}'." if text else "."))
+        return
+    total = db.count_archived_packs(ADMIN_USER_ID)
+    policy = f"después de {PACK_ARCHIVE_DAYS:g} días sin publicarse" if PACK_ARCHIVE_DAYS > 0 else "desactivado (PACK_ARCHIVE_DAYS=0)"
+    keyboard = []
+    for pack in packs:
+        published = pack['last_published_at'].astimezone(TIMEZONE).strftime('%d/%m/%y') if pack.get('last_published_at') else "?"
+        label = f"♻️ {pack['name']} ({pack['photos']} fotos, {published})"
+        keyboard.append([InlineKeyboardButton(label, callback_data=cb("pack_restore", pack['name']))])
+    await update.message.reply_text(
+        f"🗄️ Packs archivados: {total} (archivado automático {policy}).\n"
+        f"Mostrando {len(packs)}{'; usa /archivo <texto> para filtrar' if total > len(packs) else ''}. Pulsa uno para restaurarlo:",
+        reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def pack_restore_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    pack_name = context.args[0]
+    success, message = await asyncio.to_thread(db.restore_pack, pack_name, ADMIN_USER_ID)
+    if not success:
+        await query.answer(f"❌ {message}", show_alert=True)
+        return
+    await query.answer(message)
+    text, reply_markup = _get_pack_actions_markup(pack_name)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+# --- EXPORTACIÓN E IMPORTACIÓN ---
+MAX_IMPORT_BYTES = 20 * 1024 * 1024  # Límite de descarga de la Bot API
+
+async def _run_in_thread_cancellable(func, *args) -> tuple[object, bool]:
+    """
+    Ejecuta func(*args, cancel_event) en un hilo. Si la tarea se cancela, activa el evento y
+    espera a que el hilo pare (en su siguiente punto de control). Devuelve (resultado, cancelada).
+    """
+    cancel_event = threading.Event()
+    work = asyncio.ensure_future(asyncio.to_thread(func, *args, cancel_event))
+    try:
+        return await asyncio.shield(work), False
+    except asyncio.CancelledError:
+        cancel_event.set()
+        return await work, True
+
+async def _export_logic(bot, user_chat_id: int, status_message_id: int, name_prefix: str):
+    pack_transfer = await _lazy_import("pack_transfer")
+    path = f"./temp_export_{status_message_id}.jsonl"
+    try:
+        stats, cancelled = await _run_in_thread_cancellable(pack_transfer.export_packs, ADMIN_USER_ID, path, name_prefix)
+        if cancelled:
+            await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id,
+                                        text=f"🛑 Exportación cancelada tras {stats['packs']} packs.")
+            return
+        rate = stats["packs"] / stats["seconds"] if stats["seconds"] else 0
+        summary = (f"📤 {stats['packs']} packs · {stats['photos']} fotos · {stats['videos']} adjuntos · "
+                   f"{stats['bytes'] / 1024:.0f} KiB en {stats['seconds']:.1f}s ({rate:.0f} packs/s)")
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=summary)
+        with open(path, "rb") as f:
+            await bot.send_document(chat_id=user_chat_id, document=f, caption=summary,
+                                    filename=f"packs_{datetime.now(TIMEZONE).strftime('%Y%m%d_%H%M')}.jsonl")
+    except asyncio.CancelledError:
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text="🛑 Exportación cancelada.")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/exportar [prefijo]: envía los packs (o los que empiezan por el prefijo) como JSON Lines."""
+    name_prefix = " ".join(context.args)
+    task_id = task_manager.new_task_id()
+    status_message = await update.message.reply_text(f"📤 Exportando packs...{_queue_notice('transfer')}", reply_markup=_cancel_markup(task_id))
+    task_manager.submit(
+        "transfer",
+        lambda t: _export_logic(context.bot, update.effective_chat.id, status_message.message_id, name_prefix),
+        owner_id=update.effective_user.id, description=f"Exportar packs{f' ({name_prefix}*)' if name_prefix else ''}", task_id=task_id
+    )
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/importar [omitir|reemplazar]: espera un archivo .jsonl como el de /exportar."""
+    pack_transfer = await _lazy_import("pack_transfer")
+    mode = context.args[0].lower() if context.args else "omitir"
+    if mode not in pack_transfer.MODES:
+        await update.message.reply_text("Uso: /importar [omitir|reemplazar]\n"
+                                        "omitir: los packs que ya existen no se tocan (por defecto).\n"
+                                        "reemplazar: su contenido se sustituye por el del archivo.")
         return
-            
-    builder = Application.builder().token(BOT_TOKEN)
-    application = builder.build()
+    context.user_data.clear()
+    context.user_data['state'] = 'awaiting_import_file'
+    context.user_data['import_mode'] = mode
+    await update.message.reply_text(f"📥 Envíame el archivo .jsonl con los packs (modo: {mode}).", reply_markup=CANCEL_KEYBOARD)
+
+async def _import_logic(bot, user_chat_id: int, status_message_id: int, file_id: str, mode: str):
+    pack_transfer = await _lazy_import("pack_transfer")
+    path = f"./temp_import_{status_message_id}.jsonl"
+    try:
+        file = await bot.get_file(file_id)
+        await file.download_to_drive(custom_path=path)
+        report, cancelled = await _run_in_thread_cancellable(pack_transfer.import_packs, ADMIN_USER_ID, path, pack_transfer.MODES[mode])
+        summary = (f"{'🛑 Importación cancelada' if cancelled else '📥 Importación'} ({mode}): {report['inserted']} creados · {report['replaced']} reemplazados · "
+                   f"{report['skipped']} omitidos · {report['invalid'] + report['failed']} con errores\n"
+                   f"{report['lines']} packs en {report['seconds']}s ({report['packs_per_second'] or 0} packs/s, "
+                   f"{report['photos_per_second'] or 0} fotos/s)")
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text=summary)
+        await bot.send_document(chat_id=user_chat_id, document=json.dumps(report, ensure_ascii=False, indent=2).encode(),
+                                filename="informe_importacion.json", caption=summary[:1024])
+    except asyncio.CancelledError:
+        # Cancelada durante la descarga: todavía no se había escrito nada
+        await bot.edit_message_text(chat_id=user_chat_id, message_id=status_message_id, text="🛑 Importación cancelada.")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def import_file_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    mode = context.user_data.get('import_mode', 'omitir')
+    if not (document.file_name or "").lower().endswith((".jsonl", ".json")):
+        await update.message.reply_text("❌ El archivo debe ser .jsonl (un pack por línea, como el de /exportar).")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await update.message.reply_text("❌ El archivo supera los 20 MB que permite descargar la Bot API. Divídelo en varios.")
+        return
+    context.user_data.clear()
+    task_id = task_manager.new_task_id()
+    status_message = await update.message.reply_text(f"📥 Importando '{document.file_name}'...{_queue_notice('transfer')}",
+                                                     reply_markup=_cancel_markup(task_id))
+    await update.message.reply_text("Volviendo al menú principal...", reply_markup=MAIN_KEYBOARD)
+    task_manager.submit(
+        "transfer",
+        lambda t: _import_logic(context.bot, update.effective_chat.id, status_message.message_id, document.file_id, mode),
+        owner_id=update.effective_user.id, description=f"Importar '{document.file_name}' ({mode})", task_id=task_id
+    )
+
+# --- DESPACHO DE BOTONES INLINE ---
+CALLBACK_ROUTES = {
+    "noop": noop_callback,
+    "cancel_task": cancel_task_callback,
+    "tasks_list": tasks_list_callback,
+    "task_info": task_info_callback,
+    "pack_list": list_packs_callback,
+    "main_menu": main_menu_from_empty_callback,
+    "pack_select": select_pack_callback,
+    "pack_send_now": send_pack_now_callback,
+    "pack_warmup": warmup_pack_callback,
+    "pack_enqueue": pack_enqueue_callback,
+    "pack_delete_confirm": delete_pack_confirm_callback,
+    "pack_delete_do": delete_pack_do_callback,
+    "pack_clone_start": pack_clone_start_callback,
+    "pack_merge_start": pack_merge_start_callback,
+    "pack_split_start": pack_split_start_callback,
+    "pack_restore": pack_restore_callback,
+    "pack_dry_run": pack_dry_run_callback,
+    "edit_pack_start": edit_pack_start,
+    "photo_add_start": photo_add_start_callback,
+    "photo_manage": manage_photo_callback,
+    "photo_delete": delete_photo_callback,
+    "video_add_start": video_add_start_callback,
+    "video_add_done": video_add_done_callback,
+    "subtitle_add_start": subtitle_add_start_callback,
+    "cancel_subtitle_add": cancel_subtitle_add_callback,
+    "subtitle_search_start": subtitle_search_start_callback,
+    "sub_download_independent": subtitle_download_independent_callback,
+    "sub_download_pack": subtitle_download_pack_callback,
+    "cancel_subtitle_search": cancel_subtitle_search_callback,
+    "queue_view": queue_view_callback,
+    "queue_remove": queue_remove_callback,
+    "schedule_start": schedule_pack_start,
+    "cal_nav": calendar_nav_callback,
+    "cal_day": calendar_day_callback,
+    "cal_hour": time_hour_callback,
+    "cal_min": time_minute_callback,
+    "cal_cancel": calendar_cancel_callback,
+}
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Decodifica el callback_data, deja los argumentos en context.args y llama al handler de la acción."""
+    query = update.callback_query
+    if query.from_user.id != ADMIN_USER_ID:
+        await query.answer()
+        return
+    try:
+        action, context.args = decode_callback(query.data or "")
+    except ExpiredCallback:
+        await query.answer("Este botón ha caducado. Vuelve a abrir el menú.", show_alert=True)
+        return
+    callback = CALLBACK_ROUTES[action]
+    with metrics.timed("handler_seconds", handler=callback.__name__):
+        await callback(update, context)
+
+# --- FUNCIÓN PRINCIPAL Y ARRANQUE ---
+def build_application() -> Application:
+    # Updates en paralelo, pero serializados por usuario/chat (ver update_processor.py)
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    # Cliente HTTP que mide la latencia de cada método de la Bot API (ver bot_request.py)
+    builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot").base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    # Mongo y el scheduler se inicializan en segundo plano: el bot responde antes de que terminen
+    # user_data sobrevive a los reinicios: se guarda en Mongo por lotes (ver persistence.py)
+    if PERSIST_STATE:
+        builder = builder.persistence(MongoPersistence())
+    application = builder.post_init(_post_init).post_stop(_post_stop).post_shutdown(_post_shutdown).build()
     
+    application.add_handler(TypeHandler(Update, await_backends), group=-1)
     application.add_error_handler(error_handler)
     
     admin_filter = filters.User(user_id=ADMIN_USER_ID)
@@ -862,48 +2039,68 @@ def main() -> None:
     application.add_handler(CommandHandler("start", start_command, filters=admin_filter))
     application.add_handler(MessageHandler(filters.TEXT & admin_filter, handle_text))
     
-    # MANEJADOR DE CANCELACIÓN UNIFICADO
-    application.add_handler(CallbackQueryHandler(cancel_task_callback, pattern="^cancel_task$"))
-    
-    # Handlers para menús inline
-    application.add_handler(CallbackQueryHandler(list_packs_callback, pattern="^pack_list_"))
-    application.add_handler(CallbackQueryHandler(main_menu_from_empty_callback, pattern="^main_menu_from_empty$"))
-    application.add_handler(CallbackQueryHandler(select_pack_callback, pattern="^pack_select:"))
-    application.add_handler(CallbackQueryHandler(send_pack_now_callback, pattern="^pack_send_now:"))
-    application.add_handler(CallbackQueryHandler(delete_pack_confirm_callback, pattern="^pack_delete_confirm:"))
-    application.add_handler(CallbackQueryHandler(delete_pack_do_callback, pattern="^pack_delete_do:"))
-    application.add_handler(CallbackQueryHandler(edit_pack_start, pattern="^edit_pack_start:"))
-    application.add_handler(CallbackQueryHandler(manage_photo_callback, pattern="^photo_manage:"))
-    application.add_handler(CallbackQueryHandler(delete_photo_callback, pattern="^photo_delete:"))
-    application.add_handler(CallbackQueryHandler(video_add_start_callback, pattern="^video_add_start:"))
-    application.add_handler(CallbackQueryHandler(video_add_done_callback, pattern="^video_add_done:"))
-    application.add_handler(CallbackQueryHandler(subtitle_add_start_callback, pattern="^subtitle_add_start:"))
-    application.add_handler(CallbackQueryHandler(cancel_subtitle_add_callback, pattern="^cancel_subtitle_add:"))
-    application.add_handler(CallbackQueryHandler(subtitle_search_start_callback, pattern="^subtitle_search_start:"))
-    application.add_handler(CallbackQueryHandler(subtitle_download_independent_callback, pattern="^sub_download_independent:"))
-    application.add_handler(CallbackQueryHandler(subtitle_download_pack_callback, pattern="^sub_download_pack:"))
-    application.add_handler(CallbackQueryHandler(cancel_subtitle_search_callback, pattern="^cancel_subtitle_search:"))
-    application.add_handler(CallbackQueryHandler(photo_add_start_callback, pattern="^photo_add_start:"))
-
-    # Handlers para el calendario
-    application.add_handler(CallbackQueryHandler(schedule_pack_start, pattern="^schedule_start:"))
-    application.add_handler(CallbackQueryHandler(calendar_nav_callback, pattern="^cal_nav:"))
-    application.add_handler(CallbackQueryHandler(calendar_day_callback, pattern="^cal_day:"))
-    application.add_handler(CallbackQueryHandler(time_hour_callback, pattern="^cal_hour:"))
-    application.add_handler(CallbackQueryHandler(time_minute_callback, pattern="^cal_min:"))
-    application.add_handler(CallbackQueryHandler(calendar_cancel_callback, pattern="^cal_cancel:"))
-    
-    application.add_handler(CallbackQueryHandler(noop_callback, pattern="^noop$"))
+    # Todos los botones inline pasan por un único handler que decodifica el callback_data
+    # y despacha por tabla (ver CALLBACK_ROUTES y callback_codec.py)
+    application.add_handler(CallbackQueryHandler(dispatch_callback))
+
+    application.add_handler(CommandHandler("tareas", tasks_command, filters=admin_filter))
+    application.add_handler(CommandHandler("pack", pack_command, filters=admin_filter))
+    application.add_handler(InlineQueryHandler(inline_pack_search))
+    application.add_handler(CommandHandler("cola", queue_command, filters=admin_filter))
+    application.add_handler(CommandHandler("cola_inicio", queue_start_command, filters=admin_filter))
+    application.add_handler(CommandHandler("cola_espaciado", queue_spacing_command, filters=admin_filter))
+    application.add_handler(CommandHandler("stats", stats_command, filters=admin_filter))
+    application.add_handler(CommandHandler("perfil", profile_command, filters=admin_filter))
+    application.add_handler(CommandHandler("duplicados", duplicates_command, filters=admin_filter))
+    application.add_handler(CommandHandler("archivo", archive_command, filters=admin_filter))
+    application.add_handler(CommandHandler("exportar", export_command, filters=admin_filter))
+    application.add_handler(CommandHandler("importar", import_command, filters=admin_filter))
 
     # Handlers genéricos para media
     application.add_handler(MessageHandler(filters.PHOTO & admin_filter, handle_photo), group=1)
     application.add_handler(MessageHandler(filters.VIDEO & admin_filter, handle_video), group=1)
     application.add_handler(MessageHandler(filters.Document.ALL & admin_filter, handle_document), group=1)
-    
+
+    # Histograma de duración por handler
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = metrics.instrument_handler(handler.callback)
+    return application
+
+async def _run_webhook(application: Application, webhook_url: str):
+    """
+    Equivalente a run_webhook, pero con nuestro propio servidor (webserver.py) para poder
+    servir también /metrics y /healthz en el puerto que expone Render.
+    """
+    import webserver
+
+    server = webserver.build_server(application, url_path=BOT_TOKEN)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        await _post_init(application)
+        await application.start()
+        server.listen(PORT, address="0.0.0.0")
+        await application.bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES)
+        await stop_event.wait()
+        logger.info("Deteniendo el bot...")
+        server.stop()  # Primero, dejar de recibir updates
+        await application.stop()
+        await _post_stop(application)
+    await _post_shutdown(application)
+
+def main() -> None:
+    global _application
+    application = build_application()
+    _application = application
+
     if RENDER_EXTERNAL_URL:
         webhook_url = f"{RENDER_EXTERNAL_URL}/{BOT_TOKEN}"
         logger.info(f"Iniciando bot con webhook en Render. URL: {webhook_url}")
-        application.run_webhook(listen="0.0.0.0", port=PORT, url_path=BOT_TOKEN, webhook_url=webhook_url)
+        asyncio.run(_run_webhook(application, webhook_url))
     else:
         logger.info("Iniciando bot con polling para desarrollo local.")
         application.run_polling()
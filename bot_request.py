@@ -0,0 +1,43 @@
+# bot_request.py
+import time
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+import metrics
+
+# Métodos de la Bot API (los alias camelCase de Bot: sendMessage, getFile...). Cualquier otra
+# URL se etiqueta "other" para que el número de histogramas no crezca sin límite.
+API_METHODS = frozenset(name for name in dir(Bot) if name[0].islower() and name != name.lower() and "_" not in name)
+
+
+def method_label(url: str) -> str:
+    """Etiqueta `method` de una petición: el método de la API, "download" o "other"."""
+    if "/file/bot" in url:
+        return "download"  # Descargas de archivos: la ruta del archivo no es una etiqueta válida
+    name = url.rstrip("/").rsplit("/", 1)[-1]
+    return name if name in API_METHODS else "other"
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest que mide cada llamada a la Bot API (histograma por método) y cuenta las
+    respuestas de error, en particular los 429 (RetryAfter).
+    """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = method_label(url)
+        start = time.perf_counter()
+        try:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics.inc("bot_api_errors_total", method=api_method, code="network")
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", time.perf_counter() - start, method=api_method)
+
+        if status_code == 429:
+            metrics.inc("retry_after_total", source="bot_api", method=api_method)
+        if status_code != 200:
+            metrics.inc("bot_api_errors_total", method=api_method, code=str(status_code))
+        return status_code, payload
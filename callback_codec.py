@@ -0,0 +1,151 @@
+# callback_codec.py
+import os
+import re
+import time
+import base64
+import secrets
+import logging
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Código corto de cada acción de los botones inline. Cambiar un código invalida los botones
+# ya enviados con el código anterior.
+OPCODES = {
+    "noop": "0",
+    "cancel_task": "ct",
+    "tasks_list": "tl",
+    "task_info": "ti",
+    "pack_list": "pl",
+    "main_menu": "mm",
+    "pack_select": "ps",
+    "pack_send_now": "pn",
+    "pack_warmup": "pw",
+    "pack_enqueue": "pq",
+    "pack_delete_confirm": "pd",
+    "pack_delete_do": "pD",
+    "pack_clone_start": "pc",
+    "pack_merge_start": "pm",
+    "pack_split_start": "px",
+    "pack_restore": "pr",
+    "pack_dry_run": "pt",
+    "edit_pack_start": "ep",
+    "photo_add_start": "fa",
+    "photo_manage": "fm",
+    "photo_delete": "fd",
+    "video_add_start": "va",
+    "video_add_done": "vd",
+    "subtitle_add_start": "sa",
+    "cancel_subtitle_add": "sc",
+    "subtitle_search_start": "ss",
+    "sub_download_independent": "si",
+    "sub_download_pack": "sp",
+    "cancel_subtitle_search": "sx",
+    "queue_view": "qv",
+    "queue_remove": "qr",
+    "schedule_start": "cs",
+    "cal_nav": "cn",
+    "cal_day": "cd",
+    "cal_hour": "ch",
+    "cal_min": "cm",
+    "cal_cancel": "cc",
+}
+_NAMES = {code: name for name, code in OPCODES.items()}
+
+MAX_CALLBACK_BYTES = 64  # Límite de Telegram para callback_data
+TOKEN_TTL_SECONDS = float(os.getenv("CALLBACK_TOKEN_TTL_HOURS", "48")) * 3600
+
+_SEP = "|"
+_OBJECT_ID = "!"  # ObjectId empaquetado: 12 bytes en base64url (16 caracteres en vez de 24)
+_INT = "#"        # Entero en base 36
+_TOKEN = "~"      # Texto largo guardado en el registro
+_RAW_UNSAFE = re.compile(r"^[!#~]|\|")
+_HEX_OBJECT_ID = re.compile(r"^[0-9a-f]{24}$")
+
+# Registro de textos largos: token -> (caducidad, valor) y valor -> token para reutilizarlos
+_tokens: dict[str, tuple[float, str]] = {}
+_token_by_value: dict[str, str] = {}
+
+
+class ExpiredCallback(Exception):
+    """El botón es de un formato antiguo o su token ya caducó."""
+
+
+def _to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    sign, number = ("-", -number) if number < 0 else ("", number)
+    out = ""
+    while True:
+        number, rest = divmod(number, 36)
+        out = digits[rest] + out
+        if not number:
+            return sign + out
+
+
+def _purge_expired():
+    now = time.monotonic()
+    for token in [t for t, (expires, _) in _tokens.items() if expires < now]:
+        _, value = _tokens.pop(token)
+        _token_by_value.pop(value, None)
+
+
+def _tokenize(value: str) -> str:
+    token = _token_by_value.get(value)
+    if token is None:
+        if len(_tokens) % 256 == 0:
+            _purge_expired()
+        token = secrets.token_urlsafe(6)  # 8 caracteres
+        _token_by_value[value] = token
+    _tokens[token] = (time.monotonic() + TOKEN_TTL_SECONDS, value)
+    return _TOKEN + token
+
+
+def _encode_arg(value) -> str:
+    text = str(value)
+    if isinstance(value, ObjectId) or _HEX_OBJECT_ID.match(text):
+        return _OBJECT_ID + base64.urlsafe_b64encode(bytes.fromhex(text)).decode()
+    if isinstance(value, int) or (text.lstrip("-").isdigit() and str(int(text)) == text):
+        return _INT + _to_base36(int(text))
+    if _RAW_UNSAFE.search(text):
+        return _tokenize(text)
+    return text
+
+
+def _decode_arg(part: str) -> str:
+    if part.startswith(_OBJECT_ID):
+        return base64.urlsafe_b64decode(part[1:]).hex()
+    if part.startswith(_INT):
+        return str(int(part[1:], 36))
+    if part.startswith(_TOKEN):
+        entry = _tokens.get(part[1:])
+        if not entry or entry[0] < time.monotonic():
+            raise ExpiredCallback(part)
+        return entry[1]
+    return part
+
+
+def encode(action: str, *args) -> str:
+    """
+    callback_data compacto para `action` con sus argumentos. Los textos que no caben en los
+    64 bytes de Telegram (empezando por el más largo) se sustituyen por un token del registro.
+    """
+    parts = [OPCODES[action]] + [_encode_arg(arg) for arg in args]
+    data = _SEP.join(parts)
+    while len(data.encode()) > MAX_CALLBACK_BYTES:
+        candidates = [i for i, p in enumerate(parts) if i and not p.startswith((_OBJECT_ID, _INT, _TOKEN))]
+        if not candidates:
+            raise ValueError(f"callback_data demasiado largo incluso con tokens: {data!r}")
+        longest = max(candidates, key=lambda i: len(parts[i].encode()))
+        parts[longest] = _tokenize(parts[longest])
+        data = _SEP.join(parts)
+    return data
+
+
+def decode(data: str) -> tuple[str, list[str]]:
+    """Devuelve (acción, argumentos como texto). Lanza ExpiredCallback si no se puede decodificar."""
+    code, *parts = data.split(_SEP)
+    action = _NAMES.get(code)
+    if action is None:
+        raise ExpiredCallback(data)
+    return action, [_decode_arg(part) for part in parts]
@@ -0,0 +1,39 @@
+# channels.py
+import os
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def parse_channel_ids(value: str | None) -> list[str]:
+    """Convierte '-1001, -1002' en ['-1001', '-1002'] sin duplicados y respetando el orden."""
+    ids = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if part and part not in ids:
+            ids.append(part)
+    return ids
+
+
+# Canal principal (Modo Inmediato y Modo Pro) y lista de canales a los que se publican los packs.
+# Si CHANNEL_IDS no está definida, los packs se publican solo en CHANNEL_ID.
+CHANNEL_ID = os.getenv("CHANNEL_ID")
+CHANNEL_IDS = parse_channel_ids(os.getenv("CHANNEL_IDS")) or parse_channel_ids(CHANNEL_ID)
+
+# --- Carriles de publicación ---
+# Un lock por canal: todo lo que publica en un canal (packs, Modo Inmediato, bloques del
+# Modo Pro) pasa por su carril, así dos publicaciones nunca se intercalan en el mismo canal.
+_lanes: dict[str, asyncio.Lock] = {}
+
+
+def lane(channel_id) -> asyncio.Lock:
+    """Devuelve el carril (lock) de un canal. Acepta el ID como int o str."""
+    key = str(channel_id)
+    if key not in _lanes:
+        _lanes[key] = asyncio.Lock()
+    return _lanes[key]
+
+
+def lane_busy(channel_id) -> bool:
+    return lane(channel_id).locked()
@@ -0,0 +1,173 @@
+# coordination.py
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Callable
+
+import database as db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Identificador de esta instancia en los leases (en Render, dos durante el solapamiento de un deploy)
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+# Un lease caduca si su titular no lo renueva en este tiempo; se renueva cada LEASE_SECONDS / 3
+LEASE_SECONDS = float(os.getenv("LEASE_SECONDS", "30"))
+# Tras terminar una tarea, su lease sigue marcado como hecho este tiempo para que un segundo
+# disparo del mismo job (otra instancia con el scheduler activo a la vez) no la repita
+DONE_RETENTION_SECONDS = 600
+LEADER_LEASE = "leader"
+# El scheduler está en pausa durante el relevo de líder: el lease del anterior tarda hasta
+# LEASE_SECONDS en caducar y el nuevo lo ve en la siguiente ronda (LEASE_SECONDS / 3). Los jobs
+# que venzan mientras tanto deben seguir ejecutándose al reanudarlo (ver job_defaults en bot.py).
+MISFIRE_GRACE_SECONDS = int(LEASE_SECONDS * 2)
+
+
+def new_run_key(kind: str) -> str:
+    """Nombre de lease para una ejecución que no tiene uno natural (tareas manuales)."""
+    return f"{kind}:{uuid.uuid4().hex[:12]}"
+
+
+class Coordinator:
+    """
+    Coordina varias instancias del bot sobre el mismo Mongo con leases (ver database.py):
+
+    - Elección de líder: solo la instancia con el lease "leader" tiene el scheduler activo
+      (on_elected / on_demoted) y revisa los leases huérfanos.
+    - Leases por tarea: claim() antes de ejecutar una publicación o misión; el latido los
+      renueva mientras la tarea vive. Si uno se pierde se llama a su on_lost (cancelar la tarea)
+      y, si su titular deja de renovarlo, el líder lo toma y llama a on_orphan(nombre, payload)
+      para retomar la tarea.
+    """
+
+    def __init__(self, instance_id: str = INSTANCE_ID, lease_seconds: float = LEASE_SECONDS):
+        self.instance_id = instance_id
+        self.lease_seconds = lease_seconds
+        self.is_leader = False
+        self._held: dict[str, Callable[[], None] | None] = {}
+        self._task: asyncio.Task | None = None
+        self._handing_over = False
+        self._on_elected = self._on_demoted = self._on_orphan = None
+
+    # --- Leases de tareas (síncronos, como el resto de llamadas a database.py) ---
+
+    def claim(self, name: str, payload: dict | None = None, on_lost: Callable[[], None] | None = None) -> bool:
+        """Toma el lease de una tarea. False si otra instancia la tiene (o la terminó hace poco)."""
+        if not db.acquire_lease(name, self.instance_id, self.lease_seconds, payload):
+            metrics.inc("lease_claims_total", result="taken")
+            return False
+        self._held[name] = on_lost
+        metrics.inc("lease_claims_total", result="acquired")
+        return True
+
+    def release(self, name: str, done: bool = True, keep_seconds: float | None = None):
+        """
+        Suelta el lease. done=False lo deja caducado para que otra instancia retome la tarea; con
+        done=True se conserva como hecho DONE_RETENTION_SECONDS (o `keep_seconds`).
+        """
+        if self._held.pop(name, False) is False:
+            return
+        if keep_seconds is None:
+            keep_seconds = DONE_RETENTION_SECONDS if done else 0
+        try:
+            db.release_lease(name, self.instance_id, done=done, keep_seconds=keep_seconds)
+        except Exception as e:
+            logger.error(f"No se pudo soltar el lease '{name}' (caducará solo): {e}")
+
+    def checkpoint(self, name: str, **fields):
+        """Guarda en el payload del lease por dónde va la tarea, para retomarla desde ahí."""
+        if name not in self._held:
+            return
+        try:
+            db.update_lease_payload(name, self.instance_id, **fields)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el punto de reanudación de '{name}': {e}")
+
+    @property
+    def held(self) -> list[str]:
+        return list(self._held)
+
+    # --- Latido ---
+
+    def start(self, on_elected: Callable[[], None] | None = None, on_demoted: Callable[[], None] | None = None,
+              on_orphan: Callable[[str, dict], None] | None = None):
+        self._on_elected, self._on_demoted, self._on_orphan = on_elected, on_demoted, on_orphan
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Coordinación iniciada como instancia '{self.instance_id}'.")
+
+    async def hand_over(self):
+        """
+        Primer paso del apagado: cede el liderazgo (el scheduler se pausa con on_demoted) y deja
+        de retomar tareas huérfanas, pero sigue renovando los leases de las tareas en curso.
+        """
+        self._handing_over = True
+        if self.is_leader:
+            self._set_leader(False)
+            await asyncio.to_thread(db.release_lease, LEADER_LEASE, self.instance_id, False)
+
+    async def stop(self):
+        """Deja de latir y cede el liderazgo para que otra instancia lo tome sin esperar a que caduque."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            self._set_leader(False)
+            await asyncio.to_thread(db.release_lease, LEADER_LEASE, self.instance_id, False)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.beat()
+            except Exception as e:
+                # Sin Mongo no hay forma de saber si otra instancia es líder: mejor no serlo
+                logger.error(f"Error en el latido de coordinación: {e}")
+                if self.is_leader:
+                    self._set_leader(False)
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def beat(self):
+        """Una pasada: renueva los leases, disputa el liderazgo y, si es líder, retoma huérfanos."""
+        names = list(self._held)
+        if names:
+            renewed = await asyncio.to_thread(db.renew_leases, names, self.instance_id, self.lease_seconds)
+            for name in names:
+                if name in renewed or name not in self._held:
+                    continue
+                on_lost = self._held.pop(name)
+                logger.warning(f"Lease '{name}' perdido: otra instancia se ha quedado con la tarea.")
+                metrics.inc("leases_lost_total")
+                if on_lost:
+                    on_lost()
+
+        if self._handing_over:
+            return
+        leader = await asyncio.to_thread(db.acquire_lease, LEADER_LEASE, self.instance_id, self.lease_seconds)
+        if leader != self.is_leader:
+            self._set_leader(leader)
+
+        if self.is_leader and self._on_orphan:
+            for doc in await asyncio.to_thread(db.list_orphan_leases):
+                if await asyncio.to_thread(self.claim, doc["_id"]):
+                    logger.warning(f"Retomando la tarea huérfana '{doc['_id']}' (titular anterior: {doc.get('holder')}).")
+                    metrics.inc("leases_taken_over_total")
+                    self._on_orphan(doc["_id"], doc.get("payload") or {})
+
+    def _set_leader(self, leader: bool):
+        self.is_leader = leader
+        logger.info(f"Instancia '{self.instance_id}' {'elegida líder' if leader else 'deja de ser líder'}.")
+        callback = self._on_elected if leader else self._on_demoted
+        if callback:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error en el cambio de liderazgo.")
+
+    def gauges(self) -> list:
+        return [("coordination_is_leader", {"instance": self.instance_id}, int(self.is_leader)),
+                ("coordination_leases_held", {}, len(self._held))]
@@ -1,51 +1,225 @@
 # database.py
 import os
-import pymongo
+import re
+import time
+import secrets
 import logging
-from datetime import datetime, timezone
+import threading
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId # Importante para buscar y manejar IDs únicos
 
+import metrics
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 
 # --- Conexión a la Base de Datos ---
+# Un único MongoClient para todo el bot (colecciones de database.py y job store de
+# APScheduler): un solo pool de conexiones, un solo juego de hilos de monitorización.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# zlib viene con Python; zstd/snappy requieren paquetes extra
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+
 client = None
+_client_lock = threading.Lock()  # setup_database y la carga del estado (otro hilo) pueden pedirlo a la vez
 db = None
 packs_collection = None
+queue_collection = None
+settings_collection = None
+media_collection = None
+leases_collection = None
+archive_collection = None
 
-def setup_database():
-    """Establece la conexión con MongoDB Atlas y obtiene la colección."""
-    global client, db, packs_collection
-    
+_pool_stats = {
+    "connections_created": 0,
+    "connections_closed": 0,
+    "checked_out": 0,
+    "checkouts_total": 0,
+    "checkout_failures": 0,
+    "pool_clears": 0,
+}
+
+def _make_pool_listener():
+    """Crea el listener que alimenta _pool_stats (pymongo se importa aquí, no al cargar el módulo)."""
+    from pymongo import monitoring
+
+    class PoolStatsListener(monitoring.ConnectionPoolListener):
+        def pool_created(self, event): pass
+        def pool_ready(self, event): pass
+        def pool_closed(self, event): pass
+        def connection_ready(self, event): pass
+        def connection_check_out_started(self, event): pass
+
+        def pool_cleared(self, event):
+            _pool_stats["pool_clears"] += 1
+
+        def connection_created(self, event):
+            _pool_stats["connections_created"] += 1
+
+        def connection_closed(self, event):
+            _pool_stats["connections_closed"] += 1
+
+        def connection_check_out_failed(self, event):
+            _pool_stats["checkout_failures"] += 1
+
+        def connection_checked_out(self, event):
+            _pool_stats["checked_out"] += 1
+            _pool_stats["checkouts_total"] += 1
+
+        def connection_checked_in(self, event):
+            _pool_stats["checked_out"] -= 1
+
+    return PoolStatsListener()
+
+def get_client():
+    """Devuelve el MongoClient compartido, creándolo la primera vez que se pide."""
+    global client
+    if client is not None:
+        return client
+    with _client_lock:
+        if client is None:
+            client = _create_client()
+    return client
+
+def _create_client():
     mongo_uri = os.getenv("MONGO_URI")
     if not mongo_uri:
         raise ValueError("MONGO_URI no está configurada en el entorno.")
+
+    import pymongo  # Diferido: importar pymongo no debe retrasar el arranque del bot
+    return pymongo.MongoClient(
+        mongo_uri,
+        appname="telegrampackbot",
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        compressors=MONGO_COMPRESSORS,
+        retryWrites=True,
+        retryReads=True,
+        event_listeners=[_make_pool_listener()],
+    )
+
+def use_client(mongo_client):
+    """
+    Usa un cliente ya creado en lugar de conectar con MONGO_URI (p. ej. mongomock en los
+    benchmarks). Hay que llamarla antes de setup_database().
+    """
+    global client
+    client = mongo_client
+    return client
+
+def get_pool_stats():
+    """Estadísticas del pool de conexiones del cliente compartido."""
+    stats = dict(_pool_stats)
+    stats["open_connections"] = stats["connections_created"] - stats["connections_closed"]
+    stats["max_pool_size"] = MONGO_MAX_POOL_SIZE
+    return stats
+
+def close_client():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+# --- Caché de resúmenes de packs ---
+# Cache de lectura para get_pack_summary. Se invalida en cada función de escritura de este
+# módulo; lo que escriba otra instancia (ver coordination.py) se ve como mucho
+# SUMMARY_CACHE_SECONDS después. Los packs inexistentes no se cachean.
+SUMMARY_CACHE_ENABLED = os.getenv("PACK_SUMMARY_CACHE", "1") != "0"
+SUMMARY_CACHE_SECONDS = float(os.getenv("PACK_SUMMARY_CACHE_SECONDS", "10"))
+SUMMARY_CACHE_SIZE = 500  # Packs distintos; al llenarse se descarta el más antiguo
+_summary_cache = {}  # pack -> {user_id: (instante, resumen)}
+
+def _invalidate_summary(pack_name):
+    """Elimina del cache los resúmenes de un pack (para todos los usuarios)."""
+    _summary_cache.pop(pack_name, None)
+
+# --- Búsqueda de packs por nombre ---
+# Prefijo sobre name_lower (índice user_id + name_lower) y, opcionalmente, texto en los
+# captions (índice de texto). Los resultados se cachean unos segundos por prefijo para que
+# escribir rápido en el modo inline no lance una consulta por tecla.
+PACK_SEARCH_CAPTIONS = os.getenv("PACK_SEARCH_CAPTIONS", "0") == "1"
+PACK_SEARCH_CACHE_SECONDS = float(os.getenv("PACK_SEARCH_CACHE_SECONDS", "30"))
+_search_cache = {}  # (user_id, prefijo) -> (instante, resultados, completos)
+
+def setup_database():
+    """Establece la conexión con MongoDB Atlas y obtiene la colección."""
+    global db, packs_collection, queue_collection, settings_collection, media_collection, leases_collection, archive_collection
     
     try:
-        client = pymongo.MongoClient(mongo_uri)
-        db = client.get_database("telegramBotDB") 
+        db = get_client().get_database("telegramBotDB")
         packs_collection = db.get_collection("packs")
         packs_collection.create_index([("name", 1), ("user_id", 1)], unique=True)
+        packs_collection.create_index([("user_id", 1), ("name_lower", 1)])
+        if PACK_SEARCH_CAPTIONS:
+            packs_collection.create_index([("content.videos.caption", "text")], default_language="spanish")
+        packs_collection.create_index("last_published_at", sparse=True)
+        archive_collection = db.get_collection("packs_archive")
+        archive_collection.create_index([("name", 1), ("user_id", 1)], unique=True)
+        archive_collection.create_index([("user_id", 1), ("name_lower", 1)])
+        queue_collection = db.get_collection("publish_queue")
+        queue_collection.create_index([("status", 1), ("created_at", 1)])
+        settings_collection = db.get_collection("settings")
+        media_collection = db.get_collection("media_index")
+        media_collection.create_index("packs")
+        leases_collection = db.get_collection("leases")
+        leases_collection.create_index([("done", 1), ("expires_at", 1)])
+        _migrate()
         logger.info("Conexión a MongoDB establecida correctamente.")
     except Exception as e:
         logger.error(f"No se pudo conectar a MongoDB: {e}")
         raise
 
+# Migraciones de datos: cada una se ejecuta una sola vez, no en cada arranque. La versión
+# aplicada se guarda en settings ("schema_version").
+SCHEMA_VERSION = 1
+
+def _migrate():
+    version = get_setting("schema_version", 0)
+    if version < 1:
+        # Packs creados antes de existir name_lower
+        packs_collection.update_many({"name_lower": {"$exists": False}}, [{"$set": {"name_lower": {"$toLower": "$name"}}}])
+    if version < SCHEMA_VERSION:
+        set_setting("schema_version", SCHEMA_VERSION)
+        logger.info(f"Datos migrados de la versión {version} a la {SCHEMA_VERSION}.")
+
 # --- Operaciones CRUD de Packs ---
 
+def _archived_names(user_id, names):
+    """Los de `names` que ya usa un pack archivado: no pueden reutilizarse mientras siga en el archivo."""
+    if not names:
+        return set()
+    return set(archive_collection.distinct("name", {"user_id": user_id, "name": {"$in": list(names)}}))
+
+@metrics.timed_function("db_call_seconds")
 def create_pack(pack_name, user_id):
     """Crea un nuevo documento de pack."""
+    from pymongo.errors import DuplicateKeyError
+    if _archived_names(user_id, [pack_name]):
+        return False, f"Ya hay un pack archivado con el nombre '{pack_name}' (/archivo para restaurarlo)."
     try:
         packs_collection.insert_one({
             "name": pack_name,
+            "name_lower": pack_name.lower(),
             "user_id": user_id,
             "created_at": datetime.now(timezone.utc),
             "content": []
         })
+        _invalidate_summary(pack_name)
+        _search_cache.clear()
         return True, f"Pack '{pack_name}' creado."
-    except pymongo.errors.DuplicateKeyError:
+    except DuplicateKeyError:
         return False, f"Ya existe un pack con el nombre '{pack_name}'."
 
+@metrics.timed_function("db_call_seconds")
 def add_photo_to_pack(pack_name, photo_file_id):
     """Añade un objeto de foto al array 'content' de un pack, dándole un ID único."""
     photo_document = {
@@ -57,48 +231,640 @@ def add_photo_to_pack(pack_name, photo_file_id):
         {"name": pack_name},
         {"$push": {"content": photo_document}}
     )
+    _invalidate_summary(pack_name)
+    _search_cache.clear()
     return result.modified_count > 0, photo_document["photo_id"]
 
-def add_video_to_photo(pack_name, photo_id, video_file_id, caption):
+@metrics.timed_function("db_call_seconds")
+def add_video_to_photo(pack_name, photo_id, video_file_id, caption, file_unique_id=None):
     """Añade un video a una foto específica dentro de un pack."""
     video_document = {
         "file_id": video_file_id,
         "caption": caption
     }
+    if file_unique_id:
+        video_document["file_unique_id"] = file_unique_id
     result = packs_collection.update_one(
         {"name": pack_name, "content.photo_id": photo_id},
         {"$push": {"content.$.videos": video_document}}
     )
+    _invalidate_summary(pack_name)
+    if result.modified_count > 0 and file_unique_id:
+        record_media_in_pack(file_unique_id, pack_name)
     return result.modified_count > 0
 
+@metrics.timed_function("db_call_seconds")
 def list_all_packs(user_id):
     """Lista los nombres de todos los packs de un usuario."""
     packs_cursor = packs_collection.find({"user_id": user_id}, {"name": 1, "_id": 0}).sort("created_at", -1)
     return [pack['name'] for pack in packs_cursor]
 
+def _cached_search(user_id, prefix):
+    """Resultados en cache para el prefijo o, si están completos, para uno más corto."""
+    now = time.monotonic()
+    for length in range(len(prefix), -1, -1):
+        entry = _search_cache.get((user_id, prefix[:length]))
+        if not entry or now - entry[0] > PACK_SEARCH_CACHE_SECONDS:
+            continue
+        _, results, complete = entry
+        if length == len(prefix):
+            return results
+        if complete:
+            # El prefijo corto trajo todos sus packs: basta con filtrarlos
+            return [r for r in results if r["name"].lower().startswith(prefix)]
+    return None
+
+@metrics.timed_function("db_call_seconds")
+def search_packs(user_id, text, limit=50):
+    """
+    Packs del usuario cuyo nombre empieza por `text` (sin distinguir mayúsculas), como
+    [{"name", "photos"}]. Con PACK_SEARCH_CAPTIONS también busca el texto en los captions.
+    """
+    prefix = text.strip().lower()
+    cached = _cached_search(user_id, prefix)
+    if cached is not None:
+        metrics.inc("cache_requests_total", cache="pack_search", result="hit")
+        return cached[:limit]
+    metrics.inc("cache_requests_total", cache="pack_search", result="miss")
+
+    projection = {"_id": 0, "name": 1, "photos": {"$size": {"$ifNull": ["$content", []]}}}
+    query = {"user_id": user_id}
+    if prefix:
+        query["name_lower"] = {"$regex": f"^{re.escape(prefix)}"}  # Anclado: usa el índice
+    results = list(packs_collection.find(query, projection).sort("name_lower", 1).limit(limit + 1))
+    complete = len(results) <= limit
+    results = results[:limit]
+
+    if PACK_SEARCH_CAPTIONS and prefix and len(results) < limit:
+        seen = {r["name"] for r in results}
+        for doc in packs_collection.find({"user_id": user_id, "$text": {"$search": text}}, projection).limit(limit):
+            if doc["name"] not in seen and len(results) < limit:
+                results.append(doc)
+        complete = False  # Los resultados por caption no se pueden filtrar por prefijo
+
+    if len(_search_cache) > 1000:
+        _search_cache.clear()
+    _search_cache[(user_id, prefix)] = (time.monotonic(), results, complete)
+    return results
+
+@metrics.timed_function("db_call_seconds")
 def get_pack_for_sending(pack_name):
     """Obtiene el contenido de un pack para ser enviado."""
     pack_data = packs_collection.find_one({"name": pack_name})
     return pack_data.get("content", []) if pack_data else None
 
+@metrics.timed_function("db_call_seconds")
 def get_pack_details(pack_name, user_id):
     """Obtiene el documento completo de un pack para edición."""
     return packs_collection.find_one({"name": pack_name, "user_id": user_id})
 
+@metrics.timed_function("db_call_seconds")
+def get_pack_summary(pack_name, user_id):
+    """
+    Devuelve solo los IDs de las fotos y cuántos adjuntos tiene cada una, sin traer
+    file_ids ni captions. Pensado para los menús de edición. None si el pack no existe.
+    """
+    entry = _summary_cache.get(pack_name, {}).get(user_id) if SUMMARY_CACHE_ENABLED else None
+    if entry and time.monotonic() - entry[0] < SUMMARY_CACHE_SECONDS:
+        metrics.inc("cache_requests_total", cache="pack_summary", result="hit")
+        return entry[1]
+    metrics.inc("cache_requests_total", cache="pack_summary", result="miss")
+
+    pipeline = [
+        {"$match": {"name": pack_name, "user_id": user_id}},
+        {"$project": {
+            "_id": 0,
+            "photos": {"$map": {
+                "input": {"$ifNull": ["$content", []]},
+                "as": "photo",
+                "in": {
+                    "photo_id": "$$photo.photo_id",
+                    "attachments": {"$size": {"$ifNull": ["$$photo.videos", []]}}
+                }
+            }}
+        }}
+    ]
+    docs = list(packs_collection.aggregate(pipeline))
+    summary = docs[0]["photos"] if docs else None
+
+    if SUMMARY_CACHE_ENABLED and summary is not None:
+        if pack_name not in _summary_cache and len(_summary_cache) >= SUMMARY_CACHE_SIZE:
+            _summary_cache.pop(next(iter(_summary_cache)))
+        _summary_cache.setdefault(pack_name, {})[user_id] = (time.monotonic(), summary)
+    return summary
+
+@metrics.timed_function("db_call_seconds")
 def delete_pack(pack_name, user_id):
     """Elimina un pack completo."""
     result = packs_collection.delete_one({"name": pack_name, "user_id": user_id})
+    _invalidate_summary(pack_name)
+    if result.deleted_count > 0:
+        media_collection.update_many({"packs": pack_name}, {"$pull": {"packs": pack_name}})
+        _search_cache.clear()
     return result.deleted_count > 0
 
+@metrics.timed_function("db_call_seconds")
 def delete_photo_from_pack(pack_name, photo_id_str):
     """Elimina una foto específica de un pack usando su ID como string."""
     try:
         photo_id = ObjectId(photo_id_str)
+        pack = packs_collection.find_one({"name": pack_name}, {"content": {"$elemMatch": {"photo_id": photo_id}}})
         result = packs_collection.update_one(
             {"name": pack_name},
             {"$pull": {"content": {"photo_id": photo_id}}}
         )
+        _invalidate_summary(pack_name)
+        _search_cache.clear()
+        if result.modified_count > 0 and pack and pack.get("content"):
+            removed = {v["file_unique_id"] for v in pack["content"][0].get("videos", []) if v.get("file_unique_id")}
+            _forget_media_in_pack(removed, pack_name)
         return result.modified_count > 0
     except Exception as e:
         logger.error(f"Error al intentar borrar foto con ID {photo_id_str}: {e}")
         return False
+
+# --- Clonar, fusionar y dividir packs ---
+# El pack nuevo se construye en el servidor con una sola agregación que termina en $merge:
+# no pasa por el bot ni hay una escritura por foto. Como una agregación no puede generar
+# ObjectIds, cada foto recibe uno formado por un prefijo propio de la operación (instante
+# y 4 bytes aleatorios, como un ObjectId normal) más su posición en hexadecimal.
+
+_HEX_DIGITS = "0123456789abcdef"
+
+def _hex_expr(value, width=8):
+    """Expresión de agregación que da `value` (entero) como texto hexadecimal de `width` cifras."""
+    return {"$concat": [
+        {"$substrCP": [_HEX_DIGITS, {"$toInt": {"$mod": [{"$floor": {"$divide": [value, 16 ** k]}}, 16]}}, 1]}
+        for k in range(width - 1, -1, -1)
+    ]}
+
+def _derive_pack(user_id, source_names, new_name, start=0):
+    """
+    Crea `new_name` con las fotos de `source_names` (en ese orden) desde la posición `start` y
+    devuelve cuántas tiene. Lanza ValueError si el nombre está ocupado o no existe ningún origen.
+    """
+    from pymongo.errors import OperationFailure
+    if _archived_names(user_id, [new_name]):
+        raise ValueError(f"Ya hay un pack archivado con el nombre '{new_name}' (/archivo para restaurarlo).")
+    prefix = f"{int(time.time()):08x}{secrets.token_hex(4)}"
+    content = {"$ifNull": ["$content", []]}
+    if start:
+        content = {"$slice": [content, start, {"$max": [{"$size": content}, 1]}]}
+    pipeline = [
+        {"$match": {"user_id": user_id, "name": {"$in": source_names}}},
+        {"$set": {"_order": {"$indexOfArray": [{"$literal": source_names}, "$name"]}}},
+        {"$sort": {"_order": 1}},
+        {"$group": {"_id": None, "parts": {"$push": content}}},
+        {"$project": {"_id": 0, "content": {"$reduce": {
+            "input": "$parts", "initialValue": [], "in": {"$concatArrays": ["$$value", "$$this"]}}}}},
+        {"$project": {
+            "name": {"$literal": new_name},
+            "name_lower": {"$literal": new_name.lower()},
+            "user_id": {"$literal": user_id},
+            "created_at": "$$NOW",
+            "content": {"$map": {
+                "input": {"$range": [0, {"$size": "$content"}]},
+                "as": "i",
+                "in": {"$mergeObjects": [
+                    {"$arrayElemAt": ["$content", "$$i"]},
+                    {"photo_id": {"$toObjectId": {"$concat": [prefix, _hex_expr("$$i")]}}}
+                ]}
+            }}
+        }},
+        {"$merge": {"into": packs_collection.name, "on": ["name", "user_id"],
+                    "whenMatched": "fail", "whenNotMatched": "insert"}},
+    ]
+    try:
+        packs_collection.aggregate(pipeline)
+    except OperationFailure as e:
+        if e.code == 11000:
+            raise ValueError(f"Ya existe un pack con el nombre '{new_name}'.")
+        raise
+    _invalidate_summary(new_name)
+    _search_cache.clear()
+    photos = _reindex_pack_media(new_name, user_id)
+    if photos is None:  # Sin packs de origen el $group no produce nada y no se inserta
+        raise ValueError(f"No existe el pack '{source_names[0]}'." if len(source_names) == 1 else "No existe ninguno de los packs indicados.")
+    return photos
+
+def _reindex_pack_media(pack_name, user_id):
+    """
+    Deja el índice de duplicados al día para un pack cuyo contenido cambió de golpe, con un
+    número fijo de operaciones. Devuelve cuántas fotos tiene el pack (None si no existe).
+    """
+    from pymongo import UpdateOne
+    pack = packs_collection.find_one({"name": pack_name, "user_id": user_id}, {"_id": 0, "content.videos.file_unique_id": 1})
+    if pack is None:
+        return None
+    content = pack.get("content", [])
+    ids = {video["file_unique_id"] for item in content for video in item.get("videos", []) if video.get("file_unique_id")}
+    media_collection.update_many({"packs": pack_name, "_id": {"$nin": list(ids)}}, {"$pull": {"packs": pack_name}})
+    if ids:
+        now = datetime.now(timezone.utc)
+        media_collection.bulk_write([
+            UpdateOne({"_id": file_unique_id},
+                      {"$addToSet": {"packs": pack_name}, "$setOnInsert": {"first_seen_at": now}}, upsert=True)
+            for file_unique_id in ids
+        ], ordered=False)
+    return len(content)
+
+@metrics.timed_function("db_call_seconds")
+def merge_packs(source_names, new_name, user_id):
+    """Crea `new_name` con las fotos de todos los packs de `source_names`, en ese orden."""
+    try:
+        photos = _derive_pack(user_id, list(source_names), new_name)
+    except ValueError as e:
+        return False, str(e)
+    return True, f"Pack '{new_name}' creado con {photos} fotos."
+
+def clone_pack(pack_name, new_name, user_id):
+    """Copia un pack con otro nombre (las fotos reciben IDs nuevos)."""
+    return merge_packs([pack_name], new_name, user_id)
+
+@metrics.timed_function("db_call_seconds")
+def split_pack(pack_name, index, new_name, user_id):
+    """Mueve a un pack nuevo las fotos de `pack_name` desde la posición `index` (base 0)."""
+    try:
+        photos = _derive_pack(user_id, [pack_name], new_name, start=index)
+    except ValueError as e:
+        return False, str(e)
+    packs_collection.update_one({"name": pack_name, "user_id": user_id},
+                                [{"$set": {"content": {"$slice": [{"$ifNull": ["$content", []]}, index]}}}])
+    _invalidate_summary(pack_name)
+    kept = _reindex_pack_media(pack_name, user_id)
+    return True, f"Pack '{pack_name}' dividido: se queda con {kept} fotos y '{new_name}' recibe {photos}."
+
+# --- Exportación e importación (ver pack_transfer.py) ---
+
+def iter_packs_for_export(user_id, name_prefix="", batch_size=100):
+    """Packs del usuario uno a uno, leídos del cursor por lotes (memoria constante)."""
+    query = {"user_id": user_id}
+    if name_prefix:
+        query["name_lower"] = {"$regex": f"^{re.escape(name_prefix.lower())}"}
+    projection = {"_id": 0, "name": 1, "created_at": 1, "content": 1}
+    yield from packs_collection.find(query, projection).sort("name_lower", 1).batch_size(batch_size)
+
+@metrics.timed_function("db_call_seconds")
+def import_pack_batch(user_id, docs, overwrite=False):
+    """
+    Guarda un lote de packs con un único bulk_write ordenado, con upsert por (name, user_id):
+    los que no existen se crean; los que existen se omiten o, con `overwrite`, se reemplaza su
+    contenido. Los nombres de packs archivados se rechazan (ver _archived_names).
+    Devuelve {"inserted", "replaced", "skipped", "errors": [(índice, mensaje)]}.
+    """
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+    now = datetime.now(timezone.utc)
+    archived = _archived_names(user_id, [doc["name"] for doc in docs])
+    errors = [(index, f"ya existe un pack archivado con el nombre '{doc['name']}'")
+              for index, doc in enumerate(docs) if doc["name"] in archived]
+    positions = [index for index, doc in enumerate(docs) if doc["name"] not in archived]  # Operación -> índice en docs
+    operations = []
+    for doc in (docs[index] for index in positions):
+        key = {"name": doc["name"], "user_id": user_id}
+        fields = {"name_lower": doc["name"].lower(), "content": doc["content"]}
+        created = {"created_at": doc.get("created_at") or now}
+        if overwrite:
+            operations.append(UpdateOne(key, {"$set": fields, "$setOnInsert": created}, upsert=True))
+        else:
+            operations.append(UpdateOne(key, {"$setOnInsert": {**fields, **created}}, upsert=True))
+
+    executed = len(operations)
+    upserted = matched = 0
+    upserted_indexes = set()
+    try:
+        if operations:
+            result = packs_collection.bulk_write(operations, ordered=True)
+            upserted, matched, upserted_indexes = result.upserted_count, result.matched_count, set(result.upserted_ids)
+    except BulkWriteError as e:
+        # Ordenado: se detiene en el primer error y las operaciones siguientes no se ejecutan
+        details = e.details
+        upserted, matched = details.get("nUpserted", 0), details.get("nMatched", 0)
+        upserted_indexes = {item["index"] for item in details.get("upserted", [])}
+        executed = details["writeErrors"][0]["index"]
+        errors.append((positions[executed], details["writeErrors"][0].get("errmsg", "error de escritura")))
+        errors += [(positions[index], "no procesado por el error anterior del lote") for index in range(executed + 1, len(operations))]
+    errors.sort()
+
+    # Índice de duplicados: solo los packs cuyo contenido se ha escrito
+    written = [docs[positions[index]] for index in range(executed) if overwrite or index in upserted_indexes]
+    media_operations = [
+        UpdateOne({"_id": video["file_unique_id"]},
+                  {"$addToSet": {"packs": doc["name"]}, "$setOnInsert": {"first_seen_at": now}}, upsert=True)
+        for doc in written for item in doc["content"] for video in item["videos"] if video.get("file_unique_id")
+    ]
+    if media_operations:
+        media_collection.bulk_write(media_operations, ordered=False)
+
+    for doc in docs:
+        _invalidate_summary(doc["name"])
+    _search_cache.clear()
+    return {"inserted": upserted, "replaced": matched if overwrite else 0,
+            "skipped": 0 if overwrite else matched, "errors": errors}
+
+# --- Archivo de packs ya publicados ---
+# Los packs publicados hace más de PACK_ARCHIVE_DAYS (y no restaurados desde entonces) pasan de
+# "packs" a "packs_archive" por lotes, con el documento intacto: list_all_packs, la búsqueda y
+# los menús solo recorren los activos. restore_pack() los devuelve a "packs" cuando hagan falta.
+# El índice de duplicados (media_index) los sigue contando, porque su contenido no se ha borrado.
+
+@metrics.timed_function("db_call_seconds")
+def mark_pack_published(pack_name, user_id):
+    packs_collection.update_one({"name": pack_name, "user_id": user_id},
+                                {"$set": {"last_published_at": datetime.now(timezone.utc)}})
+    _invalidate_summary(pack_name)
+
+@metrics.timed_function("db_call_seconds")
+def archive_stale_packs(older_than, exclude_names=(), limit=500):
+    """
+    Mueve al archivo hasta `limit` packs publicados por última vez (o restaurados) antes de
+    `older_than`, salvo los de `exclude_names` (en cola o programados). Los que chocan con un
+    pack archivado del mismo nombre se quedan activos. Devuelve (archivados, en conflicto).
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    query = {
+        "last_published_at": {"$lt": cutoff},
+        "$or": [{"restored_at": {"$exists": False}}, {"restored_at": {"$lt": cutoff}}],
+        "name": {"$nin": list(exclude_names)},
+    }
+    docs = list(packs_collection.find(query, {"name": 1, "user_id": 1}).limit(limit))
+    if not docs:
+        return [], []
+    # El índice único (name, user_id) de packs_archive haría fallar el $merge entero
+    clashes = {(doc["name"], doc["user_id"]) for doc in archive_collection.find(
+        {"$or": [{"name": doc["name"], "user_id": doc["user_id"], "_id": {"$ne": doc["_id"]}} for doc in docs]},
+        {"name": 1, "user_id": 1})}
+    conflicts = [doc["name"] for doc in docs if (doc["name"], doc["user_id"]) in clashes]
+    docs = [doc for doc in docs if (doc["name"], doc["user_id"]) not in clashes]
+    if not docs:
+        return [], conflicts
+    ids = [doc["_id"] for doc in docs]
+    packs_collection.aggregate([
+        {"$match": {"_id": {"$in": ids}}},
+        {"$set": {"archived_at": "$$NOW"}},
+        {"$merge": {"into": archive_collection.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ])
+    # Solo se borran los que siguen cumpliendo la condición (alguno pudo publicarse mientras tanto)
+    packs_collection.delete_many({**query, "_id": {"$in": ids}})
+    still_active = set(packs_collection.distinct("_id", {"_id": {"$in": ids}}))
+    if still_active:
+        archive_collection.delete_many({"_id": {"$in": list(still_active)}})
+    archived = [doc["name"] for doc in docs if doc["_id"] not in still_active]
+    for name in archived:
+        _invalidate_summary(name)
+    _search_cache.clear()
+    return archived, conflicts
+
+@metrics.timed_function("db_call_seconds")
+def list_archived_packs(user_id, text="", limit=20):
+    """Packs archivados cuyo nombre empieza por `text`, como [{"name", "last_published_at", "photos"}]."""
+    query = {"user_id": user_id}
+    if text.strip():
+        query["name_lower"] = {"$regex": f"^{re.escape(text.strip().lower())}"}
+    projection = {"_id": 0, "name": 1, "last_published_at": 1, "photos": {"$size": {"$ifNull": ["$content", []]}}}
+    docs = list(archive_collection.find(query, projection).sort("last_published_at", -1).limit(limit))
+    for doc in docs:
+        doc["last_published_at"] = _as_utc(doc.get("last_published_at"))
+    return docs
+
+@metrics.timed_function("db_call_seconds")
+def count_archived_packs(user_id):
+    return archive_collection.count_documents({"user_id": user_id})
+
+@metrics.timed_function("db_call_seconds")
+def restore_pack(pack_name, user_id):
+    """Devuelve un pack del archivo a la colección activa, con una agregación y un borrado."""
+    from pymongo.errors import OperationFailure
+    if archive_collection.count_documents({"name": pack_name, "user_id": user_id}, limit=1) == 0:
+        return False, f"No hay ningún pack archivado con el nombre '{pack_name}'."
+    try:
+        archive_collection.aggregate([
+            {"$match": {"name": pack_name, "user_id": user_id}},
+            {"$unset": "archived_at"},
+            {"$set": {"restored_at": "$$NOW"}},
+            {"$merge": {"into": packs_collection.name, "on": ["name", "user_id"], "whenMatched": "fail", "whenNotMatched": "insert"}},
+        ])
+    except OperationFailure as e:
+        if e.code == 11000:
+            return False, f"Ya existe un pack activo con el nombre '{pack_name}'. Renómbralo o bórralo antes de restaurar."
+        raise
+    archive_collection.delete_one({"name": pack_name, "user_id": user_id})
+    _invalidate_summary(pack_name)
+    _search_cache.clear()
+    return True, f"Pack '{pack_name}' restaurado."
+
+# --- Cola de publicación (drip) ---
+
+def _as_utc(value):
+    """pymongo devuelve fechas naive en UTC; las convierte en aware."""
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _normalize_queue_entry(entry):
+    for key in ("created_at", "planned_start", "planned_end", "started_at", "finished_at"):
+        if key in entry:
+            entry[key] = _as_utc(entry[key])
+    return entry
+
+@metrics.timed_function("db_call_seconds")
+def enqueue_pack(pack_name, user_id, user_chat_id):
+    """Añade un pack al final de la cola de publicación."""
+    entry = {
+        "pack_name": pack_name,
+        "user_id": user_id,
+        "user_chat_id": user_chat_id,
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc),
+        "planned_start": None,
+        "planned_end": None
+    }
+    result = queue_collection.insert_one(entry)
+    return result.inserted_id
+
+@metrics.timed_function("db_call_seconds")
+def list_publish_queue(statuses=("pending", "running")):
+    """Entradas de la cola en orden de llegada."""
+    cursor = queue_collection.find({"status": {"$in": list(statuses)}}).sort("created_at", 1)
+    return [_normalize_queue_entry(entry) for entry in cursor]
+
+@metrics.timed_function("db_call_seconds")
+def get_queue_entry(entry_id):
+    entry = queue_collection.find_one({"_id": ObjectId(entry_id)})
+    return _normalize_queue_entry(entry) if entry else None
+
+@metrics.timed_function("db_call_seconds")
+def update_queue_entry(entry_id, expected_status=None, **fields):
+    """Actualiza una entrada; con `expected_status`, solo si sigue en ese estado (cambio atómico)."""
+    query = {"_id": ObjectId(entry_id)}
+    if expected_status:
+        query["status"] = expected_status
+    result = queue_collection.update_one(query, {"$set": fields})
+    return result.modified_count > 0
+
+@metrics.timed_function("db_call_seconds")
+def remove_queue_entry(entry_id):
+    result = queue_collection.delete_one({"_id": ObjectId(entry_id), "status": "pending"})
+    return result.deleted_count > 0
+
+@metrics.timed_function("db_call_seconds")
+def remove_pack_from_queue(pack_name):
+    """Quita de la cola las entradas pendientes de un pack (p. ej. al eliminarlo)."""
+    result = queue_collection.delete_many({"pack_name": pack_name, "status": "pending"})
+    return result.deleted_count
+
+# --- Ajustes ---
+
+@metrics.timed_function("db_call_seconds")
+def get_setting(key, default=None):
+    doc = settings_collection.find_one({"_id": key})
+    return _as_utc(doc["value"]) if doc else default
+
+@metrics.timed_function("db_call_seconds")
+def set_setting(key, value):
+    settings_collection.update_one({"_id": key}, {"$set": {"value": value}}, upsert=True)
+
+# --- Índice de huellas de medios ---
+# Un documento por archivo con _id = file_unique_id (el mismo para un archivo aunque cambie
+# su file_id): en qué packs está y cuándo se publicó en cada canal. Las consultas son por _id.
+
+def _normalize_media(doc):
+    doc["posted"] = {channel: _as_utc(at) for channel, at in doc.get("posted", {}).items()}
+    return doc
+
+@metrics.timed_function("db_call_seconds")
+def record_media_in_pack(file_unique_id, pack_name):
+    media_collection.update_one(
+        {"_id": file_unique_id},
+        {"$addToSet": {"packs": pack_name}, "$setOnInsert": {"first_seen_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+def _forget_media_in_pack(file_unique_ids, pack_name):
+    """Quita el pack del índice para los archivos que ya no aparecen en ninguna de sus fotos."""
+    for file_unique_id in file_unique_ids:
+        if not packs_collection.count_documents({"name": pack_name, "content.videos.file_unique_id": file_unique_id}, limit=1):
+            media_collection.update_one({"_id": file_unique_id}, {"$pull": {"packs": pack_name}})
+
+@metrics.timed_function("db_call_seconds")
+def record_media_posted(file_unique_ids, channel_id):
+    """Marca como publicados ahora en `channel_id` varios archivos, en una sola escritura."""
+    from pymongo import UpdateOne
+    if not file_unique_ids:
+        return
+    now = datetime.now(timezone.utc)
+    media_collection.bulk_write([
+        UpdateOne({"_id": file_unique_id},
+                  {"$set": {f"posted.{channel_id}": now}, "$setOnInsert": {"first_seen_at": now}},
+                  upsert=True)
+        for file_unique_id in set(file_unique_ids)
+    ], ordered=False)
+
+@metrics.timed_function("db_call_seconds")
+def find_media(file_unique_id):
+    """Entrada del índice de un archivo ({packs, posted: {canal: fecha}}) o None."""
+    doc = media_collection.find_one({"_id": file_unique_id})
+    return _normalize_media(doc) if doc else None
+
+@metrics.timed_function("db_call_seconds")
+def find_media_many(file_unique_ids):
+    """Entradas del índice de varios archivos, indexadas por file_unique_id."""
+    ids = [i for i in set(file_unique_ids) if i]
+    if not ids:
+        return {}
+    return {doc["_id"]: _normalize_media(doc) for doc in media_collection.find({"_id": {"$in": ids}})}
+
+# --- Estado de conversación (persistencia de PTB, ver persistence.py) ---
+# Un documento por entrada: _id = "<tipo>:<clave>" (p. ej. "user:123"), con los datos en "data".
+# Se lee al inicializar la Application, antes de setup_database(), por eso no usa una global.
+
+def _state_collection():
+    return get_client().get_database("telegramBotDB").get_collection("conversation_state")
+
+@metrics.timed_function("db_call_seconds")
+def load_state(kind):
+    """Todas las entradas de un tipo ('user', 'chat', 'bot') como {clave: datos}."""
+    return {doc["key"]: doc["data"] for doc in _state_collection().find({"kind": kind})}
+
+@metrics.timed_function("db_call_seconds")
+def save_state(entries):
+    """
+    Escribe varias entradas en una sola operación. `entries` es {(tipo, clave): datos};
+    datos None borra la entrada.
+    """
+    from pymongo import DeleteOne, UpdateOne
+    if not entries:
+        return
+    now = datetime.now(timezone.utc)
+    operations = []
+    for (kind, key), data in entries.items():
+        if data is None:
+            operations.append(DeleteOne({"_id": f"{kind}:{key}"}))
+        else:
+            operations.append(UpdateOne({"_id": f"{kind}:{key}"},
+                                        {"$set": {"kind": kind, "key": key, "data": data, "updated_at": now}},
+                                        upsert=True))
+    _state_collection().bulk_write(operations, ordered=False)
+
+# --- Leases entre instancias (ver coordination.py) ---
+# Un documento por lease: _id = nombre, holder = instancia que lo tiene, expires_at = hasta
+# cuándo vale sin renovarse. Tomar un lease es un único find_one_and_update atómico.
+
+@metrics.timed_function("db_call_seconds")
+def acquire_lease(name, holder, seconds, payload=None):
+    """
+    Toma (o renueva) el lease `name` si está libre, caducado o ya es de `holder`.
+    `payload` describe la tarea para que otra instancia pueda retomarla si esta deja de renovarlo.
+    """
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+    now = datetime.now(timezone.utc)
+    fields = {"holder": holder, "expires_at": now + timedelta(seconds=seconds), "done": False, "renewed_at": now}
+    if payload is not None:
+        fields["payload"] = payload
+    try:
+        doc = leases_collection.find_one_and_update(
+            {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+            {"$set": fields, "$setOnInsert": {"acquired_at": now}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return False  # Existe y es de otra instancia: el upsert choca con su _id
+    return doc is not None
+
+@metrics.timed_function("db_call_seconds")
+def renew_leases(names, holder, seconds):
+    """Renueva los leases de `holder` y devuelve los nombres que sigue teniendo."""
+    now = datetime.now(timezone.utc)
+    leases_collection.update_many({"_id": {"$in": list(names)}, "holder": holder, "done": False},
+                                  {"$set": {"expires_at": now + timedelta(seconds=seconds), "renewed_at": now}})
+    return {doc["_id"] for doc in leases_collection.find({"_id": {"$in": list(names)}, "holder": holder}, {"_id": 1})}
+
+@metrics.timed_function("db_call_seconds")
+def release_lease(name, holder, done=True, keep_seconds=0):
+    """
+    Suelta un lease. Con done=True queda marcado como terminado durante `keep_seconds` (nadie lo
+    vuelve a ejecutar en ese tiempo); con done=False caduca ya y otra instancia puede retomarlo.
+    """
+    now = datetime.now(timezone.utc)
+    leases_collection.update_one({"_id": name, "holder": holder},
+                                 {"$set": {"done": done, "expires_at": now + timedelta(seconds=keep_seconds)}})
+
+@metrics.timed_function("db_call_seconds")
+def update_lease_payload(name, holder, **fields):
+    """Actualiza campos del payload (punto de reanudación) de un lease de `holder`."""
+    leases_collection.update_one({"_id": name, "holder": holder},
+                                 {"$set": {f"payload.{key}": value for key, value in fields.items()}})
+
+@metrics.timed_function("db_call_seconds")
+def list_orphan_leases():
+    """Tareas cuyo titular dejó de renovar el lease sin terminarlas."""
+    now = datetime.now(timezone.utc)
+    return list(leases_collection.find({"done": False, "expires_at": {"$lt": now}, "payload": {"$exists": True}}))
+
+@metrics.timed_function("db_call_seconds")
+def get_lease(name):
+    doc = leases_collection.find_one({"_id": name})
+    if doc:
+        doc["expires_at"] = _as_utc(doc["expires_at"])
+    return doc
@@ -0,0 +1,204 @@
+# drip.py
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import metrics
+
+# Pausa fija entre envíos de videos en _publish_to_channel
+INTER_VIDEO_PAUSE = 1.5
+
+# Latencias por defecto (segundos) hasta que haya medidas reales
+DEFAULT_LATENCIES = {
+    "photo": float(os.getenv("DRIP_DEFAULT_PHOTO_SECONDS", "4.0")),
+    "video": float(os.getenv("DRIP_DEFAULT_VIDEO_SECONDS", "1.0")),
+}
+# Margen de seguridad que se añade a cada estimación
+SAFETY_FACTOR = float(os.getenv("DRIP_SAFETY_FACTOR", "1.2"))
+
+
+class SendLatencyTracker:
+    """Media móvil exponencial de la latencia de cada tipo de envío (foto de canal, video/documento)."""
+
+    def __init__(self, alpha: float = 0.2, defaults: dict[str, float] | None = None):
+        self._alpha = alpha
+        self._values = dict(defaults or DEFAULT_LATENCIES)
+        self.samples = {kind: 0 for kind in self._values}
+
+    def record(self, kind: str, seconds: float):
+        if not self.samples.get(kind):
+            self._values[kind] = seconds  # La primera medida real sustituye al valor por defecto
+        else:
+            self._values[kind] += self._alpha * (seconds - self._values[kind])
+        self.samples[kind] = self.samples.get(kind, 0) + 1
+
+    def latency(self, kind: str) -> float:
+        return self._values.get(kind, 1.0)
+
+
+latency_tracker = SendLatencyTracker()
+
+
+# --- Simulación de una publicación (sin enviar nada) ---
+
+# Latencia por defecto de los métodos que no pasan por latency_tracker
+DEFAULT_METHOD_LATENCIES = {"getFile": 0.3, "download": 1.0}
+# Llamadas medidas a partir de las cuales se usa la media real de bot_api_seconds
+MIN_MEASURED_CALLS = 5
+# Pausa al final de cada foto en _publish_to_channel
+INTER_PHOTO_PAUSE = 0.01
+
+
+@dataclass
+class PublishEstimate:
+    seconds: float = 0.0
+    calls: Counter = field(default_factory=Counter)  # Método de la Bot API -> llamadas
+    photos: int = 0
+    videos: int = 0
+    skipped_broken: int = 0
+    skipped_posted: int = 0
+    retry_seconds: float = 0.0  # Parte de `seconds` que se espera perder en RetryAfter (canal más lento)
+    measured: bool = False  # Si alguna latencia viene de medidas reales y no de los valores por defecto
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def method_latency(method: str, tracker: SendLatencyTracker = latency_tracker) -> tuple[float, bool]:
+    """(segundos por llamada, medido) según bot_api_seconds o, sin medidas suficientes, latency_tracker."""
+    histogram = metrics.histograms("bot_api_seconds").get((("method", method),))
+    if histogram and histogram.count >= MIN_MEASURED_CALLS:
+        return histogram.sum / histogram.count, True
+    kind = {"setChatPhoto": "photo", "sendVideo": "video", "sendDocument": "video"}.get(method)
+    if kind:
+        return tracker.latency(kind), bool(tracker.samples.get(kind))
+    return DEFAULT_METHOD_LATENCIES.get(method, 1.0), False
+
+
+def retry_after_cost(method: str) -> float:
+    """Segundos que se espera perder por llamada en RetryAfter: frecuencia medida × espera media."""
+    histogram = metrics.histograms("bot_api_seconds").get((("method", method),))
+    waits = metrics.histograms("retry_after_seconds").get(())
+    if not histogram or not histogram.count or not waits or not waits.count:
+        return 0.0
+    retries = metrics.counters("retry_after_total").get((("method", method), ("source", "bot_api")), 0)
+    return retries / histogram.count * (waits.sum / waits.count + 1)
+
+
+def simulate_publish(pack_content: list, channel_ids: list, is_broken=lambda file_id: False,
+                     is_cached=lambda file_id: False, posted_by_channel: dict | None = None,
+                     tracker: SendLatencyTracker = latency_tracker) -> PublishEstimate:
+    """
+    Recorre el pack como _publish_to_channel (fotos rotas y videos ya publicados se saltan, la
+    foto se descarga si no está en cache) contando las llamadas a la API de cada canal. Los
+    canales se publican en paralelo: la duración es la del canal más lento, con SAFETY_FACTOR.
+    """
+    estimate = PublishEstimate()
+    latencies = {}
+    retry = Counter()  # Canal -> segundos de RetryAfter previstos
+
+    def cost(method: str, channel_id) -> float:
+        if method not in latencies:
+            latency, measured = method_latency(method, tracker)
+            estimate.measured |= measured
+            latencies[method] = (latency, retry_after_cost(method))
+        latency, retry_cost = latencies[method]
+        retry[channel_id] += retry_cost
+        return latency + retry_cost
+
+    slowest, slowest_channel = 0.0, None
+    for channel_id in channel_ids:
+        posted = (posted_by_channel or {}).get(channel_id, set())
+        seconds = 0.0
+        for item in pack_content:
+            videos = item.get('videos', [])
+            if is_broken(item['photo_file_id']):
+                estimate.skipped_broken += 1
+                continue
+            if posted and videos and all(v.get('file_unique_id') in posted for v in videos):
+                estimate.skipped_posted += len(videos)
+                continue
+            if not is_cached(item['photo_file_id']):
+                estimate.calls.update(["getFile", "download"])
+                seconds += cost("getFile", channel_id) + cost("download", channel_id)
+            estimate.calls["setChatPhoto"] += 1
+            seconds += cost("setChatPhoto", channel_id)
+            estimate.photos += 1
+            for video in videos:
+                if is_broken(video['file_id']):
+                    estimate.skipped_broken += 1
+                    continue
+                if video.get('file_unique_id') in posted:
+                    estimate.skipped_posted += 1
+                    continue
+                method = "sendDocument" if video.get('caption', '').startswith("SUBTITLE:") else "sendVideo"
+                estimate.calls[method] += 1
+                seconds += cost(method, channel_id) + INTER_VIDEO_PAUSE
+                estimate.videos += 1
+            seconds += INTER_PHOTO_PAUSE
+        if slowest_channel is None or seconds > slowest:
+            slowest, slowest_channel = seconds, channel_id
+    estimate.seconds = slowest * SAFETY_FACTOR
+    estimate.retry_seconds = retry[slowest_channel] * SAFETY_FACTOR
+    return estimate
+
+
+def estimate_from_counts(photo_count: int, video_count: int, channel_count: int = 1,
+                         tracker: SendLatencyTracker = latency_tracker) -> PublishEstimate:
+    """
+    Lo mismo que simulate_publish con solo los conteos del pack (get_pack_summary): supone que
+    ninguna foto está en cache ni rota y que no hay videos ya publicados, así que es el caso peor.
+    Es la estimación de los menús y de la planificación de la cola.
+    """
+    estimate = PublishEstimate(photos=photo_count * channel_count, videos=video_count * channel_count)
+    if not channel_count:
+        return estimate
+    per_photo = ("getFile", "download", "setChatPhoto")
+    seconds = retry_seconds = 0.0
+    for method, count in [*((method, photo_count) for method in per_photo), ("sendVideo", video_count)]:
+        if not count:
+            continue
+        latency, measured = method_latency(method, tracker)
+        retry_cost = retry_after_cost(method)
+        estimate.measured |= measured
+        estimate.calls[method] = count * channel_count
+        seconds += count * (latency + retry_cost)
+        retry_seconds += count * retry_cost
+    seconds += photo_count * INTER_PHOTO_PAUSE + video_count * INTER_VIDEO_PAUSE
+    estimate.seconds = seconds * SAFETY_FACTOR
+    estimate.retry_seconds = retry_seconds * SAFETY_FACTOR
+    return estimate
+
+
+def plan_slots(entries: list[dict], start_at: datetime, spacing: timedelta, estimate: callable,
+               now: datetime, busy: list[tuple[datetime, datetime]] = ()) -> list[tuple[dict, datetime, datetime]]:
+    """
+    Calcula el hueco de cada entrada pendiente de la cola, en orden, de forma que ninguna
+    ejecución se solape con otra ni con los intervalos `busy` (otras publicaciones programadas)
+    y que entre dos ejecuciones haya al menos `spacing`.
+
+    Las entradas 'running' no se replanifican, pero empujan el cursor hasta su fin previsto
+    (o hasta ahora, si ya van con retraso).
+    """
+    cursor = max(start_at, now)
+    plan = []
+    for entry in entries:
+        if entry["status"] == "running":
+            expected_end = max(entry.get("planned_end") or now, now)
+            cursor = max(cursor, expected_end + spacing)
+            continue
+
+        duration = timedelta(seconds=estimate(entry))
+        start = cursor
+        moved = True
+        while moved:
+            moved = False
+            for busy_start, busy_end in busy:
+                if start < busy_end + spacing and start + duration + spacing > busy_start:
+                    start = busy_end + spacing
+                    moved = True
+        plan.append((entry, start, start + duration))
+        cursor = start + duration + spacing
+    return plan
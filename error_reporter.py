@@ -0,0 +1,164 @@
+# error_reporter.py
+import os
+import time
+import html
+import asyncio
+import hashlib
+import logging
+import traceback
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from telegram.constants import ParseMode
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL_SECONDS = int(os.getenv("ERROR_DIGEST_MINUTES", "10")) * 60
+MAX_MESSAGES_PER_HOUR = int(os.getenv("ERROR_MESSAGES_PER_HOUR", "20"))
+QUEUE_SIZE = 100
+MAX_SECTION_CHARS = 1200
+
+
+@dataclass
+class ErrorGroup:
+    fingerprint: str
+    title: str
+    first_seen: float
+    last_seen: float
+    count: int = 1
+    reported_count: int = 0  # Ocurrencias ya incluidas en un mensaje (informe o resumen)
+    last_sample: str = field(default="", repr=False)
+
+
+def fingerprint(error: BaseException) -> str:
+    """Huella estable de un error: tipo y pila (archivo y función de cada frame, sin números de línea)."""
+    frames = traceback.extract_tb(error.__traceback__)
+    parts = [type(error).__module__, type(error).__qualname__]
+    parts += [f"{os.path.basename(frame.filename)}:{frame.name}" for frame in frames]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:10]
+
+
+def _trim(text: str, limit: int = MAX_SECTION_CHARS) -> str:
+    return text if len(text) <= limit else text[:limit] + " …"
+
+
+class ErrorReporter:
+    """
+    Agrupa los errores por huella y los envía al admin desde una tarea en segundo plano: el
+    primer error de cada grupo con su informe completo y las repeticiones en resúmenes
+    periódicos con su cuenta. Los envíos tienen un presupuesto propio por hora, así que una
+    tormenta de errores no se come el límite de la Bot API que necesitan las publicaciones.
+    """
+
+    def __init__(self, chat_id: int, digest_interval: float = DIGEST_INTERVAL_SECONDS,
+                 max_messages_per_hour: int = MAX_MESSAGES_PER_HOUR):
+        self.chat_id = chat_id
+        self.digest_interval = digest_interval
+        self.max_messages_per_hour = max_messages_per_hour
+        self._groups: dict[str, ErrorGroup] = {}
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._bot = None
+        self._sent: list[float] = []  # Instantes de los últimos envíos (ventana de una hora)
+        self._dropped = 0
+
+    def start(self, bot):
+        self._bot = bot
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def report(self, error: BaseException, context_text: str = ""):
+        """Registra un error. No espera a ningún envío: se puede llamar desde cualquier handler."""
+        key = fingerprint(error)
+        now = time.time()
+        metrics.inc("errors_total", type=type(error).__name__)
+        group = self._groups.get(key)
+        if group:
+            group.count += 1
+            group.last_seen = now
+            return
+        title = _trim(f"{type(error).__name__}: {error}", 200)
+        tb_string = "".join(traceback.format_exception(None, error, error.__traceback__))
+        group = ErrorGroup(fingerprint=key, title=title, first_seen=now, last_seen=now,
+                           last_sample=tb_string[-MAX_SECTION_CHARS * 2:])
+        self._groups[key] = group
+        if self._queue is None:
+            logger.error(f"Informe de error sin enviar (reporter sin iniciar): {title}")
+            return
+        try:
+            self._queue.put_nowait((group, self._format_first(group, context_text)))
+            group.reported_count = 1
+        except asyncio.QueueFull:
+            self._dropped += 1  # Sin informe completo: aparecerá en el próximo resumen
+
+    def _format_first(self, group: ErrorGroup, context_text: str) -> str:
+        text = (f"🐞 <b>Error nuevo</b> <code>#{group.fingerprint}</code>\n"
+                f"{html.escape(group.title)}\n\n"
+                f"<pre>{html.escape(group.last_sample)}</pre>")
+        if context_text:
+            text += f"\n\n<pre>{html.escape(_trim(context_text))}</pre>"
+        return text[:4000]
+
+    def _format_digest(self) -> str | None:
+        pending = [g for g in self._groups.values() if g.count > g.reported_count]
+        if not pending and not self._dropped:
+            return None
+        lines = [f"🔁 <b>Resumen de errores</b> (últimos {self.digest_interval // 60:.0f} min)"]
+        for group in sorted(pending, key=lambda g: g.count - g.reported_count, reverse=True)[:15]:
+            repeats = group.count - group.reported_count
+            last = datetime.fromtimestamp(group.last_seen).strftime("%H:%M:%S")
+            lines.append(f"• <code>#{group.fingerprint}</code> ×{repeats} (total {group.count}, último {last})\n"
+                         f"  {html.escape(group.title)}")
+            group.reported_count = group.count
+        if len(pending) > 15:
+            lines.append(f"… y {len(pending) - 15} grupo(s) más")
+        if self._dropped:
+            lines.append(f"⚠️ {self._dropped} informe(s) descartados por exceso de errores.")
+            self._dropped = 0
+        return "\n".join(lines)[:4000]
+
+    def _budget_available(self) -> bool:
+        now = time.monotonic()
+        self._sent = [t for t in self._sent if now - t < 3600]
+        return len(self._sent) < self.max_messages_per_hour
+
+    async def _send(self, text: str) -> bool:
+        if not self._budget_available():
+            return False
+        self._sent.append(time.monotonic())
+        try:
+            await self._bot.send_message(chat_id=self.chat_id, text=text, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logger.error(f"No se pudo enviar el informe de error: {e}")
+        return True
+
+    async def _run(self):
+        next_digest = time.monotonic() + self.digest_interval
+        while True:
+            timeout = max(0.0, next_digest - time.monotonic())
+            try:
+                group, text = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                if not await self._send(text):
+                    # Sin presupuesto: el grupo saldrá en el próximo resumen
+                    group.reported_count = 0
+                    self._dropped += 1
+                continue
+            except asyncio.TimeoutError:
+                pass
+            next_digest = time.monotonic() + self.digest_interval
+            if not self._budget_available():
+                continue  # Las cuentas se conservan para el siguiente resumen
+            digest = self._format_digest()
+            if digest:
+                await self._send(digest)
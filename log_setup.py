@@ -0,0 +1,161 @@
+# log_setup.py
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import threading
+import traceback
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# Tarea del task_manager en cuyo contexto se emite cada registro (la fija TaskManager._run)
+current_task_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("task_id", default=None)
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" (una línea JSON por registro) o "text"
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Nivel por logger; LOG_LEVELS ("root=INFO,pymongo=WARNING") cambia o añade entradas
+DEFAULT_LEVELS = {"root": "INFO", "httpx": "WARNING", "httpcore": "WARNING", "pymongo": "WARNING",
+                  "telethon": "WARNING", "apscheduler": "INFO", "tornado.access": "WARNING"}
+# Muestreo: de cada punto del código (registros de nivel WARNING o inferior) pasan como mucho
+# SAMPLE_BURST registros cada SAMPLE_WINDOW_SECONDS; el primero que pasa en la ventana
+# siguiente indica cuántos se omitieron. 0 lo desactiva.
+SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
+SAMPLE_WINDOW_SECONDS = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "10"))
+# Registros pendientes de escribir; si la salida se atasca, los nuevos se descartan
+QUEUE_SIZE = 10000
+
+_listener: QueueListener | None = None
+
+
+def parse_levels(spec: str | None) -> dict[str, str]:
+    """Convierte 'root=INFO,pymongo=WARNING' en un diccionario de niveles."""
+    levels = dict(DEFAULT_LEVELS)
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, level = part.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class SamplingFilter(logging.Filter):
+    """Limita los registros repetitivos (FloodWait, envíos por video...) por punto del código."""
+
+    def __init__(self, burst: int = SAMPLE_BURST, window: float = SAMPLE_WINDOW_SECONDS):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._sites: dict[tuple[str, int], list] = {}  # (archivo, línea) -> [inicio de ventana, emitidos, omitidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno > logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= self.window:
+                if site and site[2]:
+                    record.suppressed = site[2]
+                site = self._sites[key] = [record.created, 0, 0]
+            if site[1] >= self.burst:
+                site[2] += 1
+                metrics.inc("log_records_sampled_total", logger=record.name)
+                return False
+            site[1] += 1
+        return True
+
+
+class _AsyncQueueHandler(QueueHandler):
+    """
+    Lo único que se hace en el hilo que registra (el del bucle de eventos): componer el
+    mensaje, anotar la tarea en curso y encolar. Formatear y escribir es cosa del listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        record.msg, record.args, record.exc_info = record.message, None, None
+        record.task_id = current_task_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "task_id", None):
+            entry["task_id"] = record.task_id
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "task_id", None):
+            text += f" [#{record.task_id}]"
+        if getattr(record, "suppressed", 0):
+            text += f" (+{record.suppressed} similares omitidos)"
+        return text
+
+
+def setup_logging(stream=None, fmt: str = LOG_FORMAT, levels: str | None = None,
+                  sample_burst: int = SAMPLE_BURST, sample_window: float = SAMPLE_WINDOW_SECONDS) -> QueueListener:
+    """
+    Sustituye los handlers del logger raíz por una cola: los registros se encolan sin bloquear
+    y un hilo (QueueListener) los formatea y los escribe en `stream` (stderr por defecto).
+    """
+    global _listener
+    stop_logging()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+    log_queue = queue.Queue(QUEUE_SIZE)
+    handler = _AsyncQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_burst, sample_window))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    for name, level in parse_levels(os.getenv("LOG_LEVELS") if levels is None else levels).items():
+        (root if name == "root" else logging.getLogger(name)).setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.unregister(stop_logging)
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Escribe lo que quede en la cola y detiene el hilo. Llamarlo más de una vez no hace nada."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    try:
+        listener.stop()
+    except queue.Full:
+        pass  # La cola sigue llena: la salida está atascada y no tiene sentido esperarla
@@ -0,0 +1,170 @@
+# metrics.py
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+# Límites de los buckets de los histogramas de latencia (segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_HELP = {
+    "handler_seconds": "Duración de los handlers de updates.",
+    "bot_api_seconds": "Latencia de las llamadas a la Bot API por método.",
+    "bot_api_errors_total": "Llamadas a la Bot API que no devolvieron 200, por método y código.",
+    "retry_after_total": "Esperas por límite de Telegram (RetryAfter de la Bot API, FloodWait de Telethon).",
+    "retry_after_seconds": "Segundos de espera pedidos por cada RetryAfter durante las publicaciones.",
+    "db_call_seconds": "Duración de las funciones de database.py.",
+    "subtitle_api_seconds": "Duración de las llamadas a la API de subtítulos.",
+    "task_seconds": "Duración de las tareas en segundo plano por tipo y estado final.",
+    "cache_requests_total": "Consultas a caches internas por resultado (hit/miss).",
+}
+
+_lock = threading.Lock()  # database.py y subtitles.py también se ejecutan en hilos
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Aproximación de un cuantil a partir de los buckets (el límite superior del bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+
+# (nombre, etiquetas ordenadas) -> Histogram / valor
+_histograms: dict[tuple, Histogram] = {}
+_counters: dict[tuple, float] = {}
+_gauge_callbacks = []
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(seconds)
+
+
+def inc(name: str, amount: float = 1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauges(callback):
+    """Registra una función que devuelve [(nombre, {etiquetas}, valor)] y se evalúa al exportar."""
+    _gauge_callbacks.append(callback)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed_function(name: str, label: str = "function"):
+    """Decorador para funciones síncronas: registra su duración con la etiqueta `label`=nombre de la función."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name, **{label: func.__name__}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_handler(callback):
+    """Envuelve un callback de PTB para medir su duración con la etiqueta handler=nombre."""
+    if getattr(callback, "_instrumented", False):
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with timed("handler_seconds", handler=callback.__name__):
+            return await callback(update, context)
+    wrapper._instrumented = True
+    return wrapper
+
+
+def histograms(name: str) -> dict[tuple, Histogram]:
+    """Histogramas de una métrica, indexados por sus etiquetas."""
+    with _lock:
+        return {labels: h for (n, labels), h in _histograms.items() if n == name}
+
+
+def counters(name: str) -> dict[tuple, float]:
+    with _lock:
+        return {labels: v for (n, labels), v in _counters.items() if n == name}
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus() -> str:
+    """Exporta todas las métricas en el formato de texto de Prometheus."""
+    lines = []
+    with _lock:
+        hist_items = sorted(_histograms.items())
+        counter_items = sorted(_counters.items())
+
+    seen = set()
+    for (name, labels), hist in hist_items:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+    for (name, labels), value in counter_items:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for callback in _gauge_callbacks:
+        for name, labels, value in callback():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+# pack_transfer.py
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from bson import ObjectId, json_util
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 200
+MAX_REPORTED_ERRORS = 100
+MODES = {"omitir": False, "reemplazar": True}  # Modo de /importar -> sobrescribir los existentes
+
+# Formato: una línea JSON por pack, en Extended JSON relajado de MongoDB (ObjectId como
+# {"$oid": ...}, fechas como {"$date": ...}):
+#   {"name": "...", "created_at": {...}, "content": [{"photo_id": {...}, "photo_file_id": "...",
+#    "videos": [{"file_id": "...", "caption": "...", "file_unique_id": "..."}]}]}
+# Los file_id solo valen para el bot que los obtuvo: importar en otro bot exige los mismos file_id.
+
+
+def export_packs(user_id: int, path: str, name_prefix: str = "", cancel_event: threading.Event | None = None) -> dict:
+    """
+    Escribe en `path` los packs del usuario, uno por línea, sin tenerlos todos en memoria.
+    Si `cancel_event` se activa, para en el siguiente pack (stats["cancelled"]).
+    """
+    started = time.monotonic()
+    stats = {"packs": 0, "photos": 0, "videos": 0, "cancelled": False}
+    with open(path, "w", encoding="utf-8") as f:
+        for pack in db.iter_packs_for_export(user_id, name_prefix):
+            if cancel_event and cancel_event.is_set():
+                stats["cancelled"] = True
+                break
+            f.write(json_util.dumps(pack, json_options=json_util.RELAXED_JSON_OPTIONS, ensure_ascii=False))
+            f.write("\n")
+            stats["packs"] += 1
+            stats["photos"] += len(pack.get("content", []))
+            stats["videos"] += sum(len(item.get("videos", [])) for item in pack.get("content", []))
+        stats["bytes"] = f.tell()
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+def _parse_pack(line: str) -> dict:
+    """Valida una línea y la normaliza al esquema de la colección. Lanza ValueError si no vale."""
+    try:
+        raw = json_util.loads(line)
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"JSON no válido: {e}")
+    if not isinstance(raw, dict):
+        raise ValueError("cada línea debe ser un objeto")
+    name = raw.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("falta 'name'")
+    content = []
+    for position, item in enumerate(raw.get("content") or [], start=1):
+        if not isinstance(item, dict) or not item.get("photo_file_id"):
+            raise ValueError(f"la foto {position} no tiene 'photo_file_id'")
+        videos = []
+        for video in item.get("videos") or []:
+            if not isinstance(video, dict) or not video.get("file_id"):
+                raise ValueError(f"un adjunto de la foto {position} no tiene 'file_id'")
+            clean = {"file_id": video["file_id"], "caption": video.get("caption") or ""}
+            if video.get("file_unique_id"):
+                clean["file_unique_id"] = video["file_unique_id"]
+            videos.append(clean)
+        photo_id = item.get("photo_id")
+        content.append({"photo_id": photo_id if isinstance(photo_id, ObjectId) else ObjectId(),
+                        "photo_file_id": item["photo_file_id"], "videos": videos})
+    created_at = raw.get("created_at")
+    return {"name": name.strip(), "content": content, "created_at": created_at if isinstance(created_at, datetime) else None}
+
+
+def import_packs(user_id: int, path: str, overwrite: bool = False, cancel_event: threading.Event | None = None) -> dict:
+    """
+    Lee `path` línea a línea y guarda los packs en lotes de IMPORT_BATCH_SIZE (un bulk_write
+    ordenado por lote). Si `cancel_event` se activa, no escribe más lotes (report["cancelled"]).
+    Devuelve el informe: conteos de lo escrito de verdad, errores por línea y ritmo.
+    """
+    started = time.monotonic()
+    report = {"mode": "reemplazar" if overwrite else "omitir", "lines": 0, "inserted": 0, "replaced": 0,
+              "skipped": 0, "invalid": 0, "failed": 0, "photos": 0, "cancelled": False, "errors": []}
+
+    def add_error(line_number: int, message: str):
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "error": message})
+
+    batch, batch_lines = [], []
+
+    def flush():
+        result = db.import_pack_batch(user_id, batch, overwrite=overwrite)
+        for key in ("inserted", "replaced", "skipped"):
+            report[key] += result[key]
+        report["failed"] += len(result["errors"])
+        for index, message in result["errors"]:
+            add_error(batch_lines[index], message)
+        batch.clear()
+        batch_lines.clear()
+
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            report["lines"] += 1
+            try:
+                pack = _parse_pack(line)
+            except ValueError as e:
+                report["invalid"] += 1
+                add_error(line_number, str(e))
+                continue
+            batch.append(pack)
+            batch_lines.append(line_number)
+            report["photos"] += len(pack["content"])
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                if cancel_event and cancel_event.is_set():
+                    break
+                flush()
+    if cancel_event and cancel_event.is_set():
+        # Lo leído y no escrito no cuenta: el informe refleja solo los lotes ya guardados
+        report["cancelled"] = True
+        report["lines"] -= len(batch)
+        report["photos"] -= sum(len(pack["content"]) for pack in batch)
+    elif batch:
+        flush()
+
+    seconds = time.monotonic() - started
+    report["seconds"] = round(seconds, 2)
+    report["packs_per_second"] = round(report["lines"] / seconds, 1) if seconds else None
+    report["photos_per_second"] = round(report["photos"] / seconds, 1) if seconds else None
+    return report
@@ -0,0 +1,173 @@
+# persistence.py
+import os
+import copy
+import asyncio
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database as db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos pasa PTB el estado modificado a la persistencia (y se escribe en Mongo)
+FLUSH_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_FLUSH_SECONDS", "30"))
+# Espera para juntar en una sola escritura todas las entradas de una misma pasada
+WRITE_DELAY_SECONDS = 1.0
+
+
+class MongoPersistence(BasePersistence):
+    """
+    Persistencia de user_data, chat_data y bot_data en MongoDB con escritura diferida: PTB
+    trabaja sobre la copia en memoria y cada FLUSH_INTERVAL_SECONDS entrega lo que han tocado
+    los updates; aquí solo se marcan como pendientes las entradas que cambiaron de verdad y se
+    escriben todas juntas con un único bulk_write. flush() (al parar la Application) escribe lo
+    que quede pendiente. Así el estado sobrevive a un reinicio sin una escritura por update.
+
+    La carga no retrasa el arranque: Application.initialize() recibe diccionarios vacíos y el
+    estado guardado se lee en segundo plano; cada entrada se rellena en refresh_*_data, la
+    primera vez que llega un update suyo (esperando a la carga si aún no terminó).
+    """
+
+    def __init__(self, update_interval: float = FLUSH_INTERVAL_SECONDS):
+        # callback_data no se persiste: los botones usan callback_codec, no datos arbitrarios
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._written: dict[tuple[str, object], dict] = {}  # Última versión escrita de cada entrada
+        self._dirty: dict[tuple[str, object], dict | None] = {}
+        self._write_task: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+        self._load_task: asyncio.Task | None = None
+        self._loaded: dict[str, dict] = {}  # Estado leído de Mongo y aún no entregado a PTB
+        self._refreshed: set[tuple[str, object]] = set()
+
+    # --- Carga inicial (en segundo plano) ---
+
+    def _start_loading(self):
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._load_all())
+
+    async def _load_all(self):
+        for kind in ("user", "chat", "bot"):
+            self._loaded[kind] = await self._load(kind)
+
+    async def _fill(self, kind: str, key, target: dict):
+        """Pasa a `target` (el diccionario de PTB) lo guardado para la entrada, solo la primera vez."""
+        entry = (kind, key)
+        if entry in self._refreshed:
+            return
+        if self._load_task:
+            await asyncio.shield(self._load_task)
+        self._refreshed.add(entry)
+        stored = self._loaded.get(kind, {}).pop(key, None)
+        if stored and not target:
+            target.update(stored)
+
+    async def _load(self, kind: str) -> dict:
+        try:
+            entries = await asyncio.to_thread(db.load_state, kind)
+        except Exception as e:
+            # Sin estado guardado el bot sigue funcionando; solo se pierde lo de antes del reinicio
+            logger.error(f"No se pudo cargar el estado persistido ({kind}): {e}")
+            return {}
+        for key, data in entries.items():
+            self._written[(kind, key)] = copy.deepcopy(data)
+        logger.info(f"Estado persistido cargado: {len(entries)} entrada(s) de tipo '{kind}'.")
+        return entries
+
+    async def get_user_data(self) -> dict[int, dict]:
+        self._start_loading()
+        return {}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        self._start_loading()
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        self._start_loading()
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}  # El bot no usa ConversationHandler: los flujos van en user_data['state']
+
+    # --- Cambios (solo en memoria hasta la siguiente escritura) ---
+
+    def _mark(self, kind: str, key, data: dict | None):
+        entry = (kind, key)
+        if data is not None:
+            if self._written.get(entry) == data:
+                self._dirty.pop(entry, None)  # Vuelve a estar como en Mongo
+                return
+            data = copy.deepcopy(data)  # Los handlers modifican user_data en el sitio
+        elif entry not in self._written:
+            self._dirty.pop(entry, None)
+            return
+        self._dirty[entry] = data
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_soon())
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark("user", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._mark("chat", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._mark("bot", 0, data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._fill("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._fill("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        await self._fill("bot", 0, bot_data)
+
+    # --- Escritura ---
+
+    async def _write_soon(self):
+        await asyncio.sleep(WRITE_DELAY_SECONDS)
+        await self._write()
+
+    async def _write(self):
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            pending, self._dirty = self._dirty, {}
+            try:
+                await asyncio.to_thread(db.save_state, pending)
+            except Exception as e:
+                logger.error(f"No se pudo guardar el estado de {len(pending)} entrada(s): {e}")
+                # Se reintenta en la siguiente escritura, sin pisar cambios más recientes
+                for entry, data in pending.items():
+                    self._dirty.setdefault(entry, data)
+                return
+            metrics.inc("persistence_entries_written_total", len(pending))
+            for entry, data in pending.items():
+                if data is None:
+                    self._written.pop(entry, None)
+                else:
+                    self._written[entry] = data
+
+    async def flush(self) -> None:
+        if self._write_task and not self._write_task.done():
+            await self._write_task  # Como mucho WRITE_DELAY_SECONDS más la escritura en curso
+        await self._write()
+        if self._dirty:
+            logger.warning(f"Quedaron {len(self._dirty)} entrada(s) de estado sin guardar al parar.")
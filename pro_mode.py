@@ -1,7 +1,10 @@
 # pro_mode.py
 import os
 import asyncio
+import base64
+import logging
 import re
+import struct
 from dotenv import load_dotenv
 
 from telethon import TelegramClient
@@ -10,15 +13,57 @@ from telethon.tl.types import MessageService, PeerChannel
 from telethon.tl.functions.channels import EditPhotoRequest
 from telethon.errors.rpcerrorlist import FloodWaitError, ChannelPrivateError
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
+
+import channels
+import database as db
+import metrics
+from progress import ProgressReporter
+
+logger = logging.getLogger(__name__)
 
 # Cargar variables de entorno
 load_dotenv()
-API_ID = int(os.getenv("API_ID"))
-API_HASH = os.getenv("API_HASH")
-SESSION_STRING = os.getenv("SESSION_STRING")
 REPLACEMENT_USERNAME = os.getenv("REPLACEMENT_USERNAME", "@estrenos_fh")
-MY_CHANNEL_ID = int(os.getenv("CHANNEL_ID")) 
+
+# Pausas entre envíos para no provocar FloodWait
+VIDEO_PAUSE_SECONDS = 1
+BLOCK_PAUSE_SECONDS = 3
+
+def _get_config() -> tuple[int, str, str, int]:
+    """
+    Lee la configuración del Modo Pro al lanzar una misión y no al importar el módulo,
+    para que un Modo Pro sin configurar no impida arrancar al resto del bot.
+    """
+    api_id = os.getenv("API_ID")
+    api_hash = os.getenv("API_HASH")
+    session_string = os.getenv("SESSION_STRING")
+    channel_id = os.getenv("CHANNEL_ID")
+    if not (api_id and api_hash and session_string and channel_id):
+        raise ValueError("Modo Pro no configurado: faltan API_ID, API_HASH, SESSION_STRING o CHANNEL_ID.")
+    return int(api_id), api_hash, session_string, int(channel_id)
+
+def _default_client_factory(session_string: str, api_id: int, api_hash: str):
+    return TelegramClient(StringSession(session_string), api_id, api_hash)
+
+def file_unique_id(document) -> str:
+    """
+    file_unique_id que la Bot API asigna a un documento de Telethon (videos incluidos), para
+    poder cruzarlo con el índice de duplicados: tipo 2 (documento) + id, con los ceros
+    comprimidos (RLE) y en base64url sin relleno.
+    """
+    raw = struct.pack("<iq", 2, document.id)
+    encoded, zeros = bytearray(), 0
+    for byte in raw:
+        if byte == 0:
+            zeros += 1
+            continue
+        if zeros:
+            encoded += bytes((0, zeros))
+            zeros = 0
+        encoded.append(byte)
+    if zeros:
+        encoded += bytes((0, zeros))
+    return base64.urlsafe_b64encode(bytes(encoded)).decode().rstrip("=")
 
 def parse_private_link(link: str) -> tuple[int | None, int | None]:
     match = re.match(r"https?://t\.me/c/(\d+)/(\d+)", link)
@@ -31,27 +76,38 @@ def clean_caption(original_caption: str | None) -> str:
     pattern = r'@\w+|https?://t\.me/\S+'
     return re.sub(pattern, REPLACEMENT_USERNAME, original_caption)
 
-async def _send_with_retry(client_action, bot, user_chat_id):
-    """Función wrapper silenciosa para manejar FloodWaitError."""
+async def _send_with_retry(make_action, progress: ProgressReporter):
+    """
+    Función wrapper silenciosa para manejar FloodWaitError. Recibe una función que crea la
+    corrutina, porque una corrutina ya esperada no se puede volver a esperar al reintentar.
+    Las esperas largas se avisan en el mensaje de estado, no con mensajes sueltos.
+    """
     try:
-        await client_action
+        await make_action()
         return True
     except FloodWaitError as fwe:
+        metrics.inc("retry_after_total", source="telethon")
+        logger.warning(f"FloodWait de Telethon: esperando {fwe.seconds + 2}s.")
         if fwe.seconds > 10:
-             await bot.send_message(user_chat_id, f"⏳ Telegram está ocupado. El bot esperará automáticamente {fwe.seconds} segundos y continuará.")
+            progress.note(f"⏳ Telegram está ocupado. El bot esperará automáticamente {fwe.seconds} segundos y continuará.")
         await asyncio.sleep(fwe.seconds + 2)
         try:
-            await client_action
+            await make_action()
             return True
         except Exception:
             return False
     except Exception:
         return False
 
-async def _process_block(block: dict, bot, user_chat_id, client, my_channel_entity) -> tuple[int, int, str]:
-    """Función aislada para procesar un solo bloque de contenido."""
+async def _process_block(block: dict, progress: ProgressReporter, client, my_channel_entity, already_posted: set, posted_now: list) -> tuple[int, int, str]:
+    """
+    Función aislada para procesar un solo bloque de contenido. Los videos cuyo file_unique_id
+    esté en `already_posted` se omiten; los enviados se añaden a `posted_now`.
+    """
     videos_sent = 0
     errors = 0
+    pending_videos = [v for v in block["videos"] if file_unique_id(v.document) not in already_posted]
+    skipped = len(block["videos"]) - len(pending_videos)
     
     block_title = "Sin Título"
     if block["videos"] and block["videos"][0].text:
@@ -59,26 +115,31 @@ async def _process_block(block: dict, bot, user_chat_id, client, my_channel_enti
         
     photo_temp_path = None
     try:
+        if not pending_videos:
+            return 0, 0, f"♻️ *{block_title}*: ya publicado, bloque omitido."
+
         photo_msg = block["photo_msg"]
         photo_temp_path = await client.download_media(photo_msg.action.photo, file=f"./temp_{photo_msg.id}.jpg")
         
         if photo_temp_path:
             uploaded_file = await client.upload_file(photo_temp_path)
-            action = client(EditPhotoRequest(channel=my_channel_entity, photo=uploaded_file))
-            if not await _send_with_retry(action, bot, user_chat_id):
+            action = lambda: client(EditPhotoRequest(channel=my_channel_entity, photo=uploaded_file))
+            if not await _send_with_retry(action, progress):
                 errors += 1
                 return 0, errors, f"❌ *{block_title}*: Error al actualizar foto."
 
-        for video_msg in block["videos"]:
-            await asyncio.sleep(1)
+        for video_msg in pending_videos:
+            await asyncio.sleep(VIDEO_PAUSE_SECONDS)
             new_caption = clean_caption(video_msg.text)
-            action = client.send_file(my_channel_entity, video_msg.media, caption=new_caption)
-            if await _send_with_retry(action, bot, user_chat_id):
+            action = lambda: client.send_file(my_channel_entity, video_msg.media, caption=new_caption)
+            if await _send_with_retry(action, progress):
                 videos_sent += 1
+                posted_now.append(file_unique_id(video_msg.document))
             else:
                 errors += 1
         
-        return videos_sent, errors, f"✅ *{block_title}*: {videos_sent}/{len(block['videos'])} videos enviados."
+        skipped_note = f" ({skipped} ya publicados)" if skipped else ""
+        return videos_sent, errors, f"✅ *{block_title}*: {videos_sent}/{len(block['videos'])} videos enviados{skipped_note}."
     
     except Exception as e:
         return videos_sent, errors + 1, f"❌ *{block_title}*: Error crítico: {str(e)[:50]}"
@@ -87,9 +148,41 @@ async def _process_block(block: dict, bot, user_chat_id, client, my_channel_enti
             os.remove(photo_temp_path)
 
 
-async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, bot, status_message_id: int, completion_callback: callable):
+async def _run_block(block: dict, progress: ProgressReporter, client, my_channel_id: int, my_channel_entity, skip_duplicates: bool):
+    """Procesa un bloque dentro del carril del canal y lo registra en el índice de duplicados."""
+    channel_key = str(my_channel_id)
+    already_posted = set()
+    if skip_duplicates:
+        ids = [file_unique_id(v.document) for v in block["videos"]]
+        already_posted = {uid for uid, media in db.find_media_many(ids).items() if channel_key in media["posted"]}
+    posted_now = []
+    try:
+        # Cada bloque usa el carril del canal para no intercalarse con publicaciones de packs
+        async with channels.lane(my_channel_id):
+            return await _process_block(block, progress, client, my_channel_entity, already_posted, posted_now)
+    finally:
+        try:
+            db.record_media_posted(posted_now, channel_key)
+        except Exception as e:
+            logger.error(f"No se pudo actualizar el índice de duplicados: {e}")
+
+def _report_block(progress: ProgressReporter, summary: str, videos_sent: int, errors: int):
+    progress.advance()
+    progress.set_line("Último bloque", summary.replace("*", ""))
+    progress.set_line("Totales", f"{videos_sent} videos enviados · {errors} errores")
+
+async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, bot, status_message_id: int, completion_callback: callable,
+                          client_factory: callable = None, skip_duplicates: bool = False, status_markup=None,
+                          checkpoint: callable = None):
     """
     Tarea principal que ahora es cancelable y limpia su mensaje de estado al finalizar.
+    `client_factory(session_string, api_id, api_hash)` permite sustituir el TelegramClient
+    (p. ej. por el cliente falso de benchmarks/fake_telethon.py). Con `skip_duplicates` se
+    omiten los videos que el índice de duplicados ya registra como publicados en el canal.
+    El progreso (bloque actual, último resumen, FloodWaits) se muestra en el mensaje de
+    estado, que conserva `status_markup` (el botón de cancelar) mientras la misión avanza.
+    Tras cada bloque se llama a `checkpoint(offset_id, bloques_procesados)`: desde offset_id
+    empieza el siguiente bloque, para poder retomar la misión ahí si se interrumpe.
     """
     total_blocks_processed = 0
     total_videos_sent = 0
@@ -97,11 +190,15 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
     summary_details = []
     task_cancelled = False
     final_status = "Completada"
+    progress = ProgressReporter(bot, user_chat_id, status_message_id, f"🤖 Misión del Modo Pro: {post_count} bloques",
+                                total=post_count, unit="bloques", reply_markup=status_markup)
 
     try:
-        async with TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH) as client:
+        api_id, api_hash, session_string, my_channel_id = _get_config()
+        async with (client_factory or _default_client_factory)(session_string, api_id, api_hash) as client:
             me = await client.get_me()
-            await bot.send_message(user_chat_id, f"🤖 Agente '{me.first_name}' activado. Misión: procesar {post_count} bloques.")
+            progress.set_line("Agente", f"'{me.first_name}' activado")
+            progress.start()
 
             source_channel_id, start_msg_id = parse_private_link(start_link)
             if not source_channel_id:
@@ -110,7 +207,7 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
 
             try:
                 source_channel_entity = await client.get_entity(PeerChannel(source_channel_id))
-                my_channel_entity = await client.get_entity(MY_CHANNEL_ID)
+                my_channel_entity = await client.get_entity(my_channel_id)
             except Exception as e:
                  await bot.send_message(user_chat_id, f"❌ MISIÓN ABORTADA: No se pudo acceder a los canales: {e}")
                  return
@@ -122,12 +219,16 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
 
                 if isinstance(message, MessageService) and message.action and hasattr(message.action, 'photo'):
                     if current_block.get("videos"):
-                        sent, errs, summary = await _process_block(current_block, bot, user_chat_id, client, my_channel_entity)
+                        progress.set_line("Bloque", f"{total_blocks_processed + 1}/{post_count} en curso")
+                        sent, errs, summary = await _run_block(current_block, progress, client, my_channel_id, my_channel_entity, skip_duplicates)
                         total_videos_sent += sent
                         total_errors += errs
                         summary_details.append(summary)
                         total_blocks_processed += 1
-                        await asyncio.sleep(3)
+                        _report_block(progress, summary, total_videos_sent, total_errors)
+                        if checkpoint:
+                            checkpoint(message.id - 1, total_blocks_processed)
+                        await asyncio.sleep(BLOCK_PAUSE_SECONDS)
                     
                     current_block = {"photo_msg": message, "videos": []}
                 
@@ -135,11 +236,13 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
                     current_block.setdefault("videos", []).append(message)
             
             if total_blocks_processed < post_count and current_block.get("videos"):
-                sent, errs, summary = await _process_block(current_block, bot, user_chat_id, client, my_channel_entity)
+                progress.set_line("Bloque", f"{total_blocks_processed + 1}/{post_count} en curso")
+                sent, errs, summary = await _run_block(current_block, progress, client, my_channel_id, my_channel_entity, skip_duplicates)
                 total_videos_sent += sent
                 total_errors += errs
                 summary_details.append(summary)
                 total_blocks_processed += 1
+                _report_block(progress, summary, total_videos_sent, total_errors)
     
     except asyncio.CancelledError:
         task_cancelled = True
@@ -153,6 +256,7 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
     finally:
         # Enviar el informe final solo si no fue cancelada y se procesó algo
         if not task_cancelled and (total_blocks_processed > 0 or total_errors > 0):
+            details = '\n'.join(summary_details) if summary_details else 'No se procesaron bloques con éxito.'
             final_summary = (
                 f"🎉 **Misión Finalizada** 🎉\n\n"
                 f"📄 **Resumen de Operaciones:**\n"
@@ -160,19 +264,12 @@ async def run_mirror_task(user_chat_id: int, start_link: str, post_count: int, b
                 f"- 📹 Videos Totales Enviados: *{total_videos_sent}*\n"
                 f"- ⚠️ Errores Encontrados: *{total_errors}*\n\n"
                 f"🔍 **Informe Detallado por Bloque:**\n"
-                f"{'\n'.join(summary_details) if summary_details else 'No se procesaron bloques con éxito.'}"
+                f"{details}"
             )
             await bot.send_message(user_chat_id, final_summary, parse_mode=ParseMode.MARKDOWN)
 
         # Limpiar el mensaje de estado
-        try:
-            await bot.edit_message_text(
-                chat_id=user_chat_id,
-                message_id=status_message_id,
-                text=f"✅ Tarea finalizada (estado: {final_status})."
-            )
-        except BadRequest:
-            pass
+        await progress.close(f"✅ Tarea finalizada (estado: {final_status}).")
         
         # Ejecutar el callback para limpiar la referencia de la tarea en bot.py
         if completion_callback:
@@ -0,0 +1,101 @@
+# profiling.py
+import io
+import time
+import asyncio
+import cProfile
+import pstats
+import logging
+import tracemalloc
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cpu", "mem", "all")
+MAX_SECONDS = 300
+TRACEMALLOC_FRAMES = 10
+
+_running = False  # Solo una captura a la vez: cProfile no admite dos perfiladores activos
+
+
+def is_running() -> bool:
+    return _running
+
+
+def _cpu_report(profiler: cProfile.Profile, top: int) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs()
+    out.write("=== CPU: ordenado por tiempo acumulado ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    out.write("\n=== CPU: ordenado por tiempo propio ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return out.getvalue()
+
+
+def _memory_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, traced: tuple[int, int], top: int) -> str:
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    before = before.filter_traces(ignore)
+    after = after.filter_traces(ignore)
+    current, peak = traced
+    lines = [f"=== Memoria: {current / 1024 / 1024:.1f} MB trazados ahora, pico {peak / 1024 / 1024:.1f} MB ===",
+             "", f"--- Top {top} crecimiento durante la captura (por línea) ---"]
+    lines += [str(stat) for stat in after.compare_to(before, "lineno")[:top]]
+    lines += ["", f"--- Top {top} memoria retenida al final (por línea) ---"]
+    lines += [str(stat) for stat in after.statistics("lineno")[:top]]
+    lines += ["", "--- Top 5 crecimiento con traza completa ---"]
+    for stat in after.compare_to(before, "traceback")[:5]:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB en {stat.count_diff:+d} bloques")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    return "\n".join(lines)
+
+
+async def capture(mode: str, seconds: float, top: int = 30) -> tuple[str, bytes]:
+    """
+    Perfila el proceso durante `seconds` mientras sigue atendiendo tráfico real y devuelve
+    (nombre de archivo, informe). Nada se activa hasta que se llama, así que fuera de una
+    captura no hay coste alguno. Si la captura se cancela, se desactiva todo igualmente.
+    """
+    global _running
+    if mode not in MODES:
+        raise ValueError(f"Modo no válido: {mode}. Usa {', '.join(MODES)}.")
+    if _running:
+        raise RuntimeError("Ya hay una captura de perfil en curso.")
+    seconds = min(max(seconds, 1), MAX_SECONDS)
+
+    _running = True
+    profiler = cProfile.Profile() if mode in ("cpu", "all") else None
+    started_tracemalloc = False
+    before = None
+    after = None
+    traced = (0, 0)
+    started = time.monotonic()
+    try:
+        if mode in ("mem", "all"):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracemalloc = True
+            before = tracemalloc.take_snapshot()
+        if profiler:
+            # El event loop corre en este hilo: se perfilan todos los handlers y tareas
+            # (no lo que se ejecuta en hilos con asyncio.to_thread, como las consultas a Mongo)
+            profiler.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        if profiler:
+            profiler.disable()
+        if before is not None:
+            after = tracemalloc.take_snapshot()
+            traced = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _running = False
+
+    elapsed = time.monotonic() - started
+    sections = [f"Perfil '{mode}' de {elapsed:.1f}s tomado el {datetime.now():%d/%m/%Y %H:%M:%S}"]
+    if profiler:
+        sections.append(_cpu_report(profiler, top))
+    if after is not None:
+        sections.append(_memory_report(before, after, traced, top))
+    logger.info(f"Captura de perfil '{mode}' completada en {elapsed:.1f}s")
+    file_name = f"perfil_{mode}_{datetime.now():%Y%m%d_%H%M%S}.txt"
+    return file_name, "\n\n".join(sections).encode("utf-8")
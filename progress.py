@@ -0,0 +1,149 @@
+# progress.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Como mucho una edición del mensaje de estado cada este número de segundos
+FLUSH_INTERVAL_SECONDS = float(os.getenv("PROGRESS_EDIT_SECONDS", "4"))
+# Avances recientes que se usan para medir el ritmo (y con él la ETA)
+RATE_WINDOW = 30
+MAX_NOTES = 3
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressReporter:
+    """
+    Mensaje de estado de una tarea larga (publicación, misión del Modo Pro...). Los cambios
+    solo actualizan el estado en memoria; una tarea en segundo plano edita el mensaje como
+    mucho cada `interval` segundos y solo si el texto ha cambiado, para que el progreso no
+    compita con los envíos al canal por el límite de la Bot API.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, title: str, total: int = 0, unit: str = "",
+                 reply_markup=None, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.title = title
+        self.total = total
+        self.unit = unit
+        self.reply_markup = reply_markup
+        self.interval = interval
+        self.done = 0
+        self._lines: dict[str, str] = {}
+        self._notes: deque[str] = deque(maxlen=MAX_NOTES)
+        self._advances: deque[float] = deque(maxlen=RATE_WINDOW)
+        self._started_at = time.monotonic()
+        self._last_text: str | None = None
+        self._task: asyncio.Task | None = None
+
+    # --- Estado (sin llamadas a la API) ---
+
+    def set_line(self, key: str, text: str):
+        """Línea de estado propia de `key` (p. ej. un canal); sustituye a la anterior."""
+        self._lines[key] = text
+
+    def note(self, text: str):
+        """Aviso puntual (FloodWait, item saltado...). Se muestran los últimos MAX_NOTES."""
+        self._notes.append(text)
+
+    def advance(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        self._advances.extend([now] * count)
+
+    def rate(self) -> float | None:
+        """Unidades por segundo medidas sobre los últimos avances."""
+        if len(self._advances) < 2:
+            return None
+        span = self._advances[-1] - self._advances[0]
+        if span <= 0:
+            return None
+        return (len(self._advances) - 1) / span
+
+    def render(self) -> str:
+        parts = [self.title]
+        if self._lines:
+            parts.append("\n".join(f"• {key}: {text}" for key, text in self._lines.items()))
+        if self.total:
+            summary = f"Progreso: {self.done}/{self.total} ({self.done * 100 // self.total}%)"
+            rate = self.rate()
+            if rate:
+                summary += f" · {rate * 60:.1f} {self.unit}/min"
+                remaining = max(self.total - self.done, 0)
+                summary += f" · ETA {format_duration(remaining / rate)}" if remaining else ""
+            elif self.done < self.total:
+                summary += " · ETA calculando…"
+            summary += f" · {format_duration(time.monotonic() - self._started_at)} transcurridos"
+            parts.append(summary)
+        if self._notes:
+            parts.append("\n".join(self._notes))
+        return "\n\n".join(parts)
+
+    # --- Envío ---
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self, text: str | None = None, reply_markup=None, final: bool = False):
+        text = text or self.render()
+        if text == self._last_text:
+            metrics.inc("progress_edits_total", result="skipped")
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message_id, text=text[:4096],
+                reply_markup=reply_markup if final else self.reply_markup,
+            )
+            self._last_text = text
+            metrics.inc("progress_edits_total", result="sent")
+        except RetryAfter as e:
+            # El progreso cede ante el límite: se salta esta edición y la siguiente llevará el estado al día
+            metrics.inc("progress_edits_total", result="retry_after")
+            if not final:
+                await asyncio.sleep(e.retry_after)
+        except BadRequest as e:
+            # "message is not modified" o mensaje borrado: el progreso no debe frenar la tarea
+            if "not modified" in str(e).lower():
+                self._last_text = text
+            metrics.inc("progress_edits_total", result="failed")
+        except TelegramError as e:
+            # TimedOut, NetworkError...: se intenta de nuevo en la siguiente edición
+            logger.warning(f"No se pudo editar el mensaje de progreso: {e}")
+            metrics.inc("progress_edits_total", result="failed")
+
+    async def close(self, final_text: str | None = None, reply_markup=None):
+        """Detiene las ediciones periódicas y deja el mensaje con `final_text` (o el último estado)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # El progreso nunca debe cambiar el resultado de la tarea que lo usa
+                logger.exception("La tarea de progreso terminó con un error.")
+            self._task = None
+        await self.flush(final_text, reply_markup=reply_markup, final=True)
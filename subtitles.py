@@ -3,8 +3,10 @@ import os
 import requests
 import logging
 
+import metrics
+
 API_KEY = os.getenv("OPENSUBTITLES_API_KEY")
-API_URL = "https://api.opensubtitles.com/api/v1"
+API_URL = os.getenv("OPENSUBTITLES_API_URL", "https://api.opensubtitles.com/api/v1")
 
 auth_token = None
 
@@ -16,6 +18,7 @@ COMMON_HEADERS = {
     'User-Agent': APP_NAME_FOR_API
 }
 
+@metrics.timed_function("subtitle_api_seconds")
 def get_auth_token():
     global auth_token
     if auth_token:
@@ -61,6 +64,7 @@ def get_auth_token():
         return None
 
 # <<< CORRECCIÓN AQUÍ >>>
+@metrics.timed_function("subtitle_api_seconds")
 def search_subtitles(query: str, language_code: str = 'es'):
     """Busca subtítulos por nombre y idioma, garantizando siempre devolver una tupla."""
     token = get_auth_token()
@@ -98,6 +102,7 @@ def search_subtitles(query: str, language_code: str = 'es'):
         logging.error(f"Error de red al buscar subtítulos: {e}")
         return None, "Error de red al buscar subtítulos."
 
+@metrics.timed_function("subtitle_api_seconds")
 def request_download_link(file_id: int):
     token = get_auth_token()
     if not token:
@@ -119,6 +124,7 @@ def request_download_link(file_id: int):
         logging.error(f"Error de red al solicitar descarga: {e}")
         return None, "Error de red al solicitar el enlace de descarga."
 
+@metrics.timed_function("subtitle_api_seconds")
 def download_subtitle_content(download_link: str):
     headers = {'User-Agent': APP_NAME_FOR_API}
     try:
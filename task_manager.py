@@ -0,0 +1,233 @@
+# task_manager.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import metrics
+from log_setup import current_task_id
+
+logger = logging.getLogger(__name__)
+
+# Prioridades: un número mayor se ejecuta antes dentro de la misma cola
+PRIORITY_MANUAL = 0
+PRIORITY_SCHEDULED = 10
+
+# Límites de concurrencia por tipo de tarea si no se configuran otros
+DEFAULT_LIMITS = {"publish": 1, "mission": 1, "search": 3, "warmup": 2, "profile": 1, "transfer": 1}
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+STATUS_DEFERRED = "deferred"  # Interrumpida por el apagado; se puede retomar en otra ejecución
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "⏳ En cola",
+    STATUS_RUNNING: "▶️ En ejecución",
+    STATUS_DONE: "✅ Finalizada",
+    STATUS_CANCELLED: "🛑 Cancelada",
+    STATUS_FAILED: "❌ Fallida",
+    STATUS_DEFERRED: "⏸️ Aplazada por reinicio",
+}
+
+
+@dataclass
+class ManagedTask:
+    task_id: str
+    kind: str
+    owner_id: int
+    description: str
+    priority: int
+    factory: Callable[["ManagedTask"], Awaitable] = field(repr=False)
+    on_done: Callable[["ManagedTask"], None] | None = field(default=None, repr=False)
+    status: str = STATUS_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (STATUS_QUEUED, STATUS_RUNNING)
+
+
+def parse_limits(spec: str | None) -> dict[str, int]:
+    """Convierte 'publish=1,search=3' en un diccionario de límites."""
+    limits = dict(DEFAULT_LIMITS)
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        kind, value = part.split("=", 1)
+        limits[kind.strip()] = max(1, int(value))
+    return limits
+
+
+class TaskManager:
+    """
+    Gestor de tareas en segundo plano. Las tareas se encolan por tipo (publish, mission,
+    search...) en lugar de rechazarse; cada tipo tiene su propio límite de concurrencia
+    y dentro de un tipo se respetan las prioridades (programadas antes que manuales).
+    """
+
+    def __init__(self, limits: dict[str, int] | None = None, default_limit: int = 1, history_size: int = 20):
+        self._limits = limits or dict(DEFAULT_LIMITS)
+        self._default_limit = default_limit
+        self._history_size = history_size
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._queues: dict[str, list] = {}
+        self._running: dict[str, set[str]] = {}
+        self._tasks: dict[str, ManagedTask] = {}
+        self._history: list[str] = []
+        self._closed = False
+
+    def limit_for(self, kind: str) -> int:
+        return self._limits.get(kind, self._default_limit)
+
+    def new_task_id(self) -> str:
+        """Reserva un ID para poder crear el botón de cancelación antes de encolar la tarea."""
+        return str(next(self._ids))
+
+    def is_saturated(self, kind: str) -> bool:
+        """True si una tarea nueva de este tipo tendría que esperar en cola."""
+        return self.running_count(kind) + self.queued_count(kind) >= self.limit_for(kind)
+
+    def submit(self, kind: str, factory: Callable[[ManagedTask], Awaitable], *, owner_id: int,
+               description: str, priority: int = PRIORITY_MANUAL, task_id: str | None = None,
+               on_done: Callable[[ManagedTask], None] | None = None) -> ManagedTask:
+        """
+        Encola una tarea. `factory` recibe el ManagedTask y devuelve la corrutina a ejecutar;
+        solo se llama cuando la tarea obtiene un hueco, no al encolarla. `on_done` se llama
+        siempre al terminar, incluso si se cancela antes de empezar.
+        """
+        managed = ManagedTask(task_id=task_id or self.new_task_id(), kind=kind, owner_id=owner_id,
+                              description=description, priority=priority, factory=factory, on_done=on_done)
+        self._tasks[managed.task_id] = managed
+        if self._closed:
+            # Apagándose: no se empieza nada nuevo, se aplaza directamente
+            managed.status = STATUS_DEFERRED
+            managed.finished_at = time.time()
+            self._archive(managed)
+            logger.info(f"Tarea #{managed.task_id} ({kind}) aplazada: el bot se está apagando.")
+            return managed
+        heapq.heappush(self._queues.setdefault(kind, []), (-priority, next(self._seq), managed.task_id))
+        logger.info(f"Tarea #{managed.task_id} ({kind}) encolada: {description}")
+        self._dispatch(kind)
+        return managed
+
+    def _dispatch(self, kind: str):
+        queue = self._queues.get(kind, [])
+        running = self._running.setdefault(kind, set())
+        while queue and len(running) < self.limit_for(kind):
+            _, _, task_id = heapq.heappop(queue)
+            managed = self._tasks.get(task_id)
+            if not managed or managed.status != STATUS_QUEUED:
+                continue
+            running.add(task_id)
+            managed.status = STATUS_RUNNING
+            managed.started_at = time.time()
+            managed.task = asyncio.create_task(self._run(managed))
+
+    async def _run(self, managed: ManagedTask):
+        current_task_id.set(managed.task_id)  # Solo en el contexto de esta tarea: aparece en sus logs
+        try:
+            await managed.factory(managed)
+            # Las tareas que capturan la cancelación terminan "bien": se respeta el estado que se les puso
+            if managed.status not in (STATUS_CANCELLED, STATUS_DEFERRED):
+                managed.status = STATUS_DONE
+        except asyncio.CancelledError:
+            if managed.status != STATUS_DEFERRED:
+                managed.status = STATUS_CANCELLED
+        except Exception:
+            managed.status = STATUS_FAILED
+            logger.exception(f"La tarea #{managed.task_id} ({managed.kind}) terminó con un error.")
+        finally:
+            managed.finished_at = time.time()
+            metrics.observe("task_seconds", managed.finished_at - managed.started_at, kind=managed.kind, status=managed.status)
+            self._running.get(managed.kind, set()).discard(managed.task_id)
+            self._archive(managed)
+            logger.info(f"Tarea #{managed.task_id} ({managed.kind}) terminada: {managed.status}")
+            self._dispatch(managed.kind)
+
+    def _archive(self, managed: ManagedTask):
+        if managed.on_done:
+            try:
+                managed.on_done(managed)
+            except Exception:
+                logger.exception(f"Error en on_done de la tarea #{managed.task_id}")
+        self._history.append(managed.task_id)
+        while len(self._history) > self._history_size:
+            self._tasks.pop(self._history.pop(0), None)
+
+    def cancel(self, task_id: str) -> bool:
+        """Cancela una tarea en cola o en ejecución. Devuelve False si ya no estaba activa."""
+        managed = self._tasks.get(task_id)
+        if not managed or not managed.is_active:
+            return False
+        if managed.status == STATUS_QUEUED:
+            # Queda en el heap, pero _dispatch la ignora al no estar en estado 'queued'
+            managed.status = STATUS_CANCELLED
+            managed.finished_at = time.time()
+            self._archive(managed)
+        else:
+            managed.status = STATUS_CANCELLED
+            managed.task.cancel()
+        return True
+
+    def close(self) -> list[ManagedTask]:
+        """
+        Deja de aceptar tareas (las nuevas se aplazan al enviarlas) y aplaza las que esperan en
+        cola. Devuelve las aplazadas.
+        """
+        self._closed = True
+        deferred = [t for t in self._tasks.values() if t.status == STATUS_QUEUED]
+        for managed in deferred:
+            managed.status = STATUS_DEFERRED
+            managed.finished_at = time.time()
+            self._archive(managed)
+        return deferred
+
+    async def drain(self, timeout: float, cancel_timeout: float = 5.0) -> tuple[list[ManagedTask], list[ManagedTask]]:
+        """
+        Espera hasta `timeout` segundos a que terminen las tareas en ejecución y aplaza (cancela)
+        las que sigan vivas, dándoles `cancel_timeout` para ejecutar sus finally.
+        Devuelve (terminadas, aplazadas).
+        """
+        running = [t for t in self._tasks.values() if t.status == STATUS_RUNNING]
+        if running:
+            await asyncio.wait([t.task for t in running], timeout=timeout)
+        remaining = [t for t in running if not t.task.done()]
+        for managed in remaining:
+            managed.status = STATUS_DEFERRED
+            managed.task.cancel()
+        if remaining:
+            await asyncio.wait([t.task for t in remaining], timeout=cancel_timeout)
+        return [t for t in running if t not in remaining], remaining
+
+    def get(self, task_id: str) -> ManagedTask | None:
+        return self._tasks.get(task_id)
+
+    def list_tasks(self, owner_id: int | None = None, include_finished: bool = False) -> list[ManagedTask]:
+        """Tareas activas (en ejecución primero, luego en cola por orden de salida)."""
+        tasks = [t for t in self._tasks.values()
+                 if (include_finished or t.is_active) and (owner_id is None or t.owner_id == owner_id)]
+        return sorted(tasks, key=lambda t: (t.status != STATUS_RUNNING, -t.priority, t.created_at))
+
+    def queue_position(self, task_id: str) -> int | None:
+        """Posición (1 = la siguiente) de una tarea en la cola de su tipo."""
+        managed = self._tasks.get(task_id)
+        if not managed or managed.status != STATUS_QUEUED:
+            return None
+        ahead = [t for t in self.list_tasks() if t.kind == managed.kind and t.status == STATUS_QUEUED]
+        return ahead.index(managed) + 1
+
+    def queued_count(self, kind: str | None = None) -> int:
+        return sum(1 for t in self._tasks.values() if t.status == STATUS_QUEUED and (kind is None or t.kind == kind))
+
+    def running_count(self, kind: str | None = None) -> int:
+        return sum(1 for t in self._tasks.values() if t.status == STATUS_RUNNING and (kind is None or t.kind == kind))
@@ -0,0 +1,187 @@
+# warmup.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "5"))
+PREFETCH_TTL_SECONDS = int(os.getenv("PREFETCH_TTL_MINUTES", "120")) * 60
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_MB", "50")) * 1024 * 1024
+# Respuestas de la Bot API que indican que un file_id no vale (las demás pueden ser temporales)
+BROKEN_FILE_MARKERS = ("wrong file identifier", "file not found", "invalid file_id", "wrong remote file identifier")
+
+
+def is_broken_file_error(error: Exception) -> bool:
+    """Si el error dice que el archivo no existe, y no es un fallo de red o de límite."""
+    return isinstance(error, BadRequest) and any(marker in str(error).lower() for marker in BROKEN_FILE_MARKERS)
+
+
+class PhotoCache:
+    """
+    Cache en memoria de los bytes de las fotos ya descargadas (LRU con TTL y tope de bytes)
+    y de los file_ids que no se pudieron resolver.
+    """
+
+    def __init__(self, ttl: float = PREFETCH_TTL_SECONDS, max_bytes: int = PREFETCH_MAX_BYTES):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._size = 0
+        self._broken: dict[str, tuple[float, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_id: str) -> bytes | None:
+        entry = self._entries.get(file_id)
+        if entry and time.monotonic() - entry[0] < self._ttl:
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache="photo_prefetch", result="hit")
+            return entry[1]
+        if entry:
+            self._discard(file_id)
+        self.misses += 1
+        metrics.inc("cache_requests_total", cache="photo_prefetch", result="miss")
+        return None
+
+    def put(self, file_id: str, data: bytes):
+        self._discard(file_id)
+        self._entries[file_id] = (time.monotonic(), data)
+        self._size += len(data)
+        self._broken.pop(file_id, None)
+        while self._size > self._max_bytes and self._entries:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, file_id: str):
+        entry = self._entries.pop(file_id, None)
+        if entry:
+            self._size -= len(entry[1])
+
+    def has(self, file_id: str) -> bool:
+        """Si la foto está en cache, sin contar como consulta ni renovar su posición."""
+        entry = self._entries.get(file_id)
+        return bool(entry) and time.monotonic() - entry[0] < self._ttl
+
+    def mark_broken(self, file_id: str, reason: str):
+        self._discard(file_id)
+        self._broken[file_id] = (time.monotonic(), reason)
+
+    def broken_reason(self, file_id: str) -> str | None:
+        entry = self._broken.get(file_id)
+        if entry and time.monotonic() - entry[0] < self._ttl:
+            return entry[1]
+        self._broken.pop(file_id, None)
+        return None
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+
+photo_cache = PhotoCache()
+
+
+@dataclass
+class WarmupReport:
+    photos_total: int = 0
+    photos_cached: int = 0
+    files_checked: int = 0
+    broken: list[tuple[int, str, str]] = field(default_factory=list)  # (foto nº, tipo, motivo)
+    failed: list[tuple[int, str, str]] = field(default_factory=list)  # Errores temporales: la publicación lo reintentará
+    broken_file_ids: set[str] = field(default_factory=set)
+    elapsed: float = 0.0
+
+    def to_text(self, pack_name: str) -> str:
+        text = (f"🔥 Precalentamiento del pack '{pack_name}' completado en {self.elapsed:.1f}s.\n"
+                f"- Fotos descargadas: {self.photos_cached}/{self.photos_total}\n"
+                f"- Archivos verificados: {self.files_checked}\n"
+                f"- Elementos rotos: {len(self.broken)}")
+        for photo_number, kind, reason in self.broken[:20]:
+            text += f"\n  • Foto {photo_number} ({kind}): {reason}"
+        if len(self.broken) > 20:
+            text += f"\n  • ... y {len(self.broken) - 20} más"
+        if self.failed:
+            text += f"\n- No comprobados por errores temporales (se reintentarán al publicar): {len(self.failed)}"
+        return text
+
+
+async def _with_retry(action):
+    """Ejecuta una llamada a la Bot API respetando un RetryAfter."""
+    for attempt in range(3):
+        try:
+            return await action()
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after + 1)
+    return await action()
+
+
+async def warm_up_pack(bot, pack_content: list, concurrency: int = WARMUP_CONCURRENCY,
+                       download_photos: bool = True, mark_broken: bool = True) -> WarmupReport:
+    """
+    Resuelve en paralelo (con un máximo de `concurrency` llamadas a la vez) todos los file_ids
+    del pack, deja los bytes de cada foto en photo_cache y marca los elementos rotos. Con
+    download_photos=False solo se comprueban, y con mark_broken=False los rotos solo quedan en
+    el informe, sin tocar photo_cache (simulación de una publicación).
+    """
+    report = WarmupReport(photos_total=len(pack_content))
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    def record_error(photo_number: int, file_id: str, kind: str, error: Exception):
+        # Solo un file_id inválido se marca como roto (y la publicación lo salta); un fallo de
+        # red o un RetryAfter persistente se deja para que la publicación lo reintente
+        if is_broken_file_error(error):
+            if mark_broken:
+                photo_cache.mark_broken(file_id, str(error))
+            report.broken_file_ids.add(file_id)
+            report.broken.append((photo_number, kind, str(error)[:80]))
+        else:
+            logger.warning(f"Precalentamiento: error temporal en la foto {photo_number} ({kind}): {error}")
+            report.failed.append((photo_number, kind, str(error)[:80]))
+
+    async def warm_photo(photo_number: int, file_id: str):
+        async with semaphore:
+            try:
+                file_obj = await _with_retry(lambda: bot.get_file(file_id))
+                data = await _with_retry(file_obj.download_as_bytearray)
+                photo_cache.put(file_id, bytes(data))
+                report.photos_cached += 1
+            except Exception as e:
+                record_error(photo_number, file_id, "foto", e)
+            report.files_checked += 1
+
+    async def check_file(photo_number: int, file_id: str, kind: str):
+        async with semaphore:
+            try:
+                await _with_retry(lambda: bot.get_file(file_id))
+            except Exception as e:
+                # La Bot API no deja descargar archivos de más de 20 MB, pero si responde
+                # "too big" es que el file_id sí existe y se puede reenviar.
+                if not (isinstance(e, BadRequest) and "too big" in str(e).lower()):
+                    record_error(photo_number, file_id, kind, e)
+            report.files_checked += 1
+
+    jobs = []
+    for index, item in enumerate(pack_content):
+        if download_photos:
+            jobs.append(warm_photo(index + 1, item['photo_file_id']))
+        else:
+            jobs.append(check_file(index + 1, item['photo_file_id'], "foto"))
+        for video in item.get('videos', []):
+            kind = "subtítulo" if video.get('caption', '').startswith("SUBTITLE:") else "video"
+            jobs.append(check_file(index + 1, video['file_id'], kind))
+    await asyncio.gather(*jobs)
+
+    report.broken.sort()
+    report.elapsed = time.monotonic() - start
+    logger.info(f"{'Precalentamiento' if download_photos else 'Comprobación'}: {report.photos_cached}/{report.photos_total} fotos descargadas, "
+                f"{report.files_checked} archivos, {len(report.broken)} rotos, {report.elapsed:.1f}s")
+    return report
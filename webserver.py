@@ -0,0 +1,60 @@
+# webserver.py
+import json
+import logging
+import hmac
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    """Recibe los updates de Telegram y los mete en la cola de la Application."""
+
+    def initialize(self, application, secret_token):
+        self.ptb_application = application
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token:
+            received = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(received, self.secret_token):
+                raise tornado.web.HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.ptb_application.bot)
+        except Exception as e:
+            logger.error(f"Update del webhook no válido: {e}")
+            raise tornado.web.HTTPError(400)
+        if update:
+            await self.ptb_application.update_queue.put(update)
+        self.set_status(200)
+
+    def check_xsrf_cookie(self):
+        pass
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render_prometheus())
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("ok")
+
+
+def build_server(application=None, url_path: str | None = None, secret_token: str | None = None) -> HTTPServer:
+    """
+    Servidor con /metrics (Prometheus) y /healthz. Si se pasa `url_path`, también recibe el
+    webhook de Telegram en el mismo puerto; sin él sirve solo las métricas (modo polling).
+    """
+    routes = [(r"/metrics", MetricsHandler), (r"/healthz", HealthHandler)]
+    if url_path:
+        routes.insert(0, (rf"/{url_path}/?", WebhookHandler, {"application": application, "secret_token": secret_token}))
+    return HTTPServer(tornado.web.Application(routes))